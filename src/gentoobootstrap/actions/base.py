@@ -4,11 +4,29 @@
 class ActionBase(object):
 	"""
 	Base class for all actions. Sub-classes must implement the .test() method and optionally the execute method.
+
+	The execute methods of actions run in parallel unless an action requires a resource (e.g. 'storage') which
+	another action provides.
 	"""
+	# the resources which must be available before execute() is called
+	requires = ()
+	# the resources which are available after execute() finished
+	provides = ()
+	# the checkpoint journal of the bootstrap (set by Bootstrap). Phases recorded in it are skipped on resume.
+	journal = None
 
 	def __init__(self, config):
 		self.config = config
 
+	def is_done(self, phase):
+		"""Returns True if phase has been completed by a previous run of the bootstrap"""
+		return self.journal is not None and self.journal.is_done(phase)
+
+	def checkpoint(self, phase, **data):
+		"""Records phase as completed in the journal"""
+		if self.journal is not None:
+			self.journal.mark(phase, **data)
+
 	def test(self):
 		"""This method is called before any action starts execution. Subclasses must implement this method to do
 		pre-execution tests. If this method returns False, the bootstrap process will stop.
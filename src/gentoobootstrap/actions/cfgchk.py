@@ -1,32 +1,23 @@
 # -*- coding: utf-8 -*-
 import logging
 import re
-from configparser import NoOptionError
 from gentoobootstrap.actions.base import ActionBase
 
 
 class CheckConfigAction(ActionBase):
 	"""
 	Action to test for configuration errors. This class does not implement the .execute() method as it is
-	a test-only action
+	a test-only action. The configuration is validated against its schema without resolving any settings.
 	"""
+	provides = ('config',)
 
 	def test(self):
 		if not re.match("^[\w\d_-]+$", self.config.name, re.IGNORECASE):
 			logging.error("The domU name must not contain characters beside a-Z0-9_-.")
 			return False
 
-		for attr_name in dir(self.config):
-			if attr_name.startswith('_'):
-				continue
+		errors = self.config.validate()
+		for error in errors:
+			logging.error("Configuration error: %s" % error)
 
-			try:
-				# try to get each attr in the configuration option
-				# mandatory options must raise an exception if they are not set.
-				logging.debug("Testing: %s" % attr_name)
-				getattr(self.config, attr_name)
-			except NoOptionError:
-				logging.error("Attribute '%s' not defined in configuration" % attr_name)
-				return False
-
-		return True
+		return not errors
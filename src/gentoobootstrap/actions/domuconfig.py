@@ -6,6 +6,8 @@ from gentoobootstrap.actions.base import ActionBase
 
 
 class CreateDomUConfig(ActionBase):
+	requires = ('storage',)
+	provides = ('domu_config',)
 
 	def __init__(self, config):
 		super(CreateDomUConfig, self).__init__(config)
@@ -13,12 +15,19 @@ class CreateDomUConfig(ActionBase):
 		logging.debug("domU configuration file: %s" % self.domu_config)
 
 	def test(self):
+		if self.is_done('domu_config'):
+			return True
+
 		e = os.path.exists(self.domu_config)
 		if e:
 			logging.error("domU config %s already exists" % self.domu_config)
 		return not e
 
 	def execute(self):
+		if self.is_done('domu_config'):
+			logging.info("domU config %s has been written by the previous run" % self.domu_config)
+			return
+
 		logging.info("Writing domU config...")
 
 		with XenConfig(self.domu_config) as cfg:
@@ -31,3 +40,5 @@ class CreateDomUConfig(ActionBase):
 			])
 			cfg.set('root', self.config.root_storage.domu_device)
 			cfg.set('vif', [ XenDomUVifConfigValue(mac=self.config.mac_address, bridge=self.config.network[0]) ])
+
+		self.checkpoint('domu_config')
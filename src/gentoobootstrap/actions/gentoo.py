@@ -1,68 +1,351 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import logging
 import os
 import shutil
+import tempfile
+import threading
 import traceback
 from cfgio.fstab import FstabConfig, FstabEntry
 from cfgio.keyvalue import KeyValueConfig, KeyValueConfigValue
 from cfgio.simple import SimpleConfig, KeyOnlyValue
 from gentoobootstrap.actions.base import ActionBase
 from urllib.parse import urljoin
-from gentoobootstrap.loader import Loader
+from gentoobootstrap.loader import Loader, PartialDownload, ChecksumError, hash_file, is_network_error
+from gentoobootstrap import delta
+from gentoobootstrap.mirrors import MirrorRanking
+from gentoobootstrap.archive import ArchiveExtractor
+from gentoobootstrap.binpkg import BinaryPackageCache, CHROOT_PKGDIR
+from gentoobootstrap.distfiles import DistfilesIndex, CHROOT_DISTDIR
+from gentoobootstrap import makeconf
+from gentoobootstrap import report
+from gentoobootstrap.output import MarkerOutput, OutputCapture
+from gentoobootstrap.digests import parse_digests, parse_md5sum
+from gentoobootstrap.squashfs import SquashfsStore, snapshot_date
+from gentoobootstrap.template import TemplateStore, copy_tree
 
-from sh import mount, umount, tar, sed, ln, chroot, Command
+from sh import mount, umount, sed, ln, chroot, Command
+
+
+# prefix of the lines the chroot script prints when it starts and when it completed a stage
+CHROOT_STAGE_MARKER = '@@stage '
+CHROOT_DONE_MARKER = '@@done '
 
 
 class GentooLoader(Loader):
 
-	def __init__(self, mirror_urls):
-		super(GentooLoader, self).__init__()
+	def __init__(self, mirror_urls, verify=True, deltas=False, **kwargs):
+		super(GentooLoader, self).__init__(**kwargs)
 		self.mirror_urls = mirror_urls
+		self.verify = verify
+		# update the portage snapshot with the daily delta patches
+		self.deltas = deltas
+		self._probed = False
+		self._probe_lock = threading.Lock()
+		self._local = threading.local()
+		self.ranking = MirrorRanking(os.path.join(self.cache_dir, 'mirrors.json'))
+
+	@property
+	def stage3_path(self):
+		"""The mirror-relative path of the last stage3 archive loaded by fetch_stage3 in the current thread"""
+		return getattr(self._local, 'stage3_path', None)
+
+	@stage3_path.setter
+	def stage3_path(self, path):
+		self._local.stage3_path = path
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(config.gentoo_mirrors, verify=config.verify_digests, deltas=config.portage_deltas,
+					cache_dir=config.cache_dir, cache_size=config.cache_size, connections=config.download_connections)
+
+	def _mirror_of(self, url):
+		return next((mirror for mirror in self.mirror_urls if url.startswith(mirror)), None)
+
+	def report_throughput(self, source, bytes_read, seconds):
+		mirror = self._mirror_of(source)
+		if mirror:
+			self.ranking.record_throughput(mirror, bytes_read, seconds)
+
+	def report_failure(self, source):
+		mirror = self._mirror_of(source)
+		if mirror:
+			self.ranking.record_failure(mirror)
+
+	@property
+	def ranked_mirrors(self):
+		return self.ranking.rank(self.mirror_urls)
+
+	def mirror_alternatives(self, path):
+		"""Returns the url of path on every usable mirror, best mirror first"""
+		return [urljoin(mirror, path) for mirror in self.ranked_mirrors if not self.ranking.is_backed_off(mirror)]
+
+	def _try_mirrors(self, what, func):
+		"""Calls func(mirror) for each mirror in ranked order and returns the first result"""
+		try:
+			for mirror in self.ranked_mirrors:
+				try:
+					return func(mirror)
+				except Exception as ex:
+					# a full disk or a failing consumer isn't the fault of the mirror
+					if is_network_error(ex):
+						self.ranking.record_failure(mirror)
+					logging.error("Could not load %s from %s: %s" % (what, mirror, ex))
+					logging.debug(traceback.format_exc())
+		finally:
+			self.ranking.save()
+
+	def _fetch_checksum(self, mirror, path, suffix, parse, force=False):
+		"""
+		Loads the checksum file path + suffix from mirror and returns the (algorithm, hexdigest) for path. Returns
+		None if checksums aren't verified, unless force is True.
+		"""
+		if not (self.verify or force):
+			return None
+
+		checksum_file = self.download(urljoin(mirror, path + suffix), key=path + suffix)
+		with open(checksum_file, 'r') as f:
+			checksum = parse(f.read(), os.path.basename(path))
+
+		if not checksum:
+			raise Exception("No checksum for %s found in %s%s" % (os.path.basename(path), path, suffix))
+
+		logging.debug("%s checksum of %s: %s" % (checksum[0], path, checksum[1]))
+		return checksum
+
+	@staticmethod
+	def _latest_file_path(arch, subarch):
+		return "releases/{arch}/autobuilds/latest-stage3-{subarch}.txt".format(arch=arch, subarch=subarch or arch)
+
+	def _probe(self, path):
+		# the loader may be shared by several bootstraps; the mirrors are probed once
+		with self._probe_lock:
+			if not self._probed:
+				logging.debug("Probing %s mirror(s)" % len(self.mirror_urls))
+				with report.phase('mirror selection'):
+					self.ranking.probe(dict((mirror, urljoin(mirror, path)) for mirror in self.mirror_urls))
+				self._probed = True
+
+	def _latest_stage3_path(self, mirror, arch, subarch):
+		latest_path = self._latest_file_path(arch, subarch)
+		latest_file = urljoin(mirror, latest_path)
+		logging.debug("Fetching 'latest' file from %s" % latest_file)
+		# the mirror independent path is the cache key, so the cache survives a change of the best mirror
+		latest = self.download(latest_file, key=latest_path)
 
-	def fetch_stage3(self, arch, subarch=None):
-		for mirror in self.mirror_urls:
-			try:
-				latest_file = urljoin(mirror, "releases/{arch}/autobuilds/latest-stage3-{subarch}.txt".format(arch=arch, subarch=subarch or arch))
-				logging.debug("Fetching 'latest' file from %s" % latest_file)
-				latest = self.download(latest_file)
+		with open(latest, 'r') as f:
+			content = f.read().split('\n')
 
-				with open(latest, 'r') as f:
-					content = f.read().split('\n')
+		content = [x for x in content if x and not x.startswith('#')]
 
-				content = [x for x in content if x and not x.startswith('#')]
+		if not (content and len(content) == 1):
+			raise Exception("Unexpected content in %s" % latest_file)
 
-				if content and len(content) == 1:
-					url = urljoin(mirror, "releases/{arch}/autobuilds/{url}".format(arch=arch, url=content[0]))
-					logging.debug("Downloading url: %s" % url)
+		return "releases/{arch}/autobuilds/{url}".format(arch=arch, url=content[0])
 
-					return self.download(url)
+	def latest_stage3(self, arch, subarch=None):
+		"""Returns the mirror-relative path of the latest stage3 archive"""
+		self._probe(self._latest_file_path(arch, subarch))
+		return self._try_mirrors('latest stage3', lambda mirror: self._latest_stage3_path(mirror, arch, subarch))
 
-			except Exception as ex:
-				logging.error("Could not load stage3 from %s: %s" % (mirror, ex))
-				logging.error(traceback.format_exc())
+	@staticmethod
+	def stage3_name(path):
+		"""Returns the name of a stage3 archive without the extension, e.g. stage3-amd64-20150101"""
+		return os.path.basename(path).split('.tar')[0]
 
-		return None
+	def fetch_stage3(self, arch, subarch=None, consumer=None):
+		self._probe(self._latest_file_path(arch, subarch))
 
-	def fetch_portage(self):
-		for mirror in self.mirror_urls:
-			try:
-				url = urljoin(mirror, 'snapshots/portage-latest.tar.bz2')
-				logging.debug("Downloading url: %s" % url)
-				return self.download(url)
-			except Exception as ex:
-				logging.error("Downloading portage snapshot from %s failed: %s" % (mirror, ex))
+		def fetch(mirror):
+			path = self._latest_stage3_path(mirror, arch, subarch)
+			checksum = self._fetch_checksum(mirror, path, '.DIGESTS', parse_digests)
+			url = urljoin(mirror, path)
+			logging.debug("Downloading url: %s" % url)
 
-		return False
+			# stage3 archives are versioned by their path, so the other mirrors can serve segments of it
+			stage3 = self.download(url, self.mirror_alternatives(path), consumer=consumer, key=path, checksum=checksum)
+			self.stage3_path = path
+			return stage3
+
+		return self._try_mirrors('stage3', fetch)
+
+	# the mirror-relative path (and cache key) of the portage snapshot
+	portage_path = 'snapshots/portage-latest.tar.bz2'
+
+	def fetch_portage(self, consumer=None):
+		path = self.portage_path
+
+		def fetch(mirror):
+			# the deltas are verified against the checksum of the snapshot
+			checksum = self._fetch_checksum(mirror, path, '.md5sum', parse_md5sum, force=self.deltas)
+
+			if self.deltas and not self._cached(path, checksum):
+				try:
+					self._update_portage(mirror, checksum)
+				except Exception as ex:
+					logging.warning("Could not update the portage snapshot with deltas: %s. Downloading it" % ex)
+					logging.debug(traceback.format_exc())
+
+			url = urljoin(mirror, path)
+			logging.debug("Downloading url: %s" % url)
+			return self.download(url, consumer=consumer, key=path, checksum=checksum)
+
+		return self._try_mirrors('portage snapshot', fetch) or False
+
+	def _update_portage(self, mirror, checksum):
+		"""
+		Makes the latest portage snapshot available in the cache by patching the newest dated snapshot in the cache
+		(the base) with the daily deltas. Without a base, the dated snapshot is downloaded and becomes the next base.
+		"""
+		base = delta.latest_base(entry.key for entry in self.cache.entries())
+		if base and not self.cache.lookup(base[1]):
+			base = None
+		base_date, base_key = base or (None, None)
+
+		if base and self.cache.lookup(base_key).verified == "%s:%s" % checksum:
+			target = base_date
+		else:
+			target = None
+			for date in delta.candidate_dates(base_date):
+				try:
+					dated_checksum = self._fetch_checksum(mirror, delta.snapshot_path(date), '.md5sum', parse_md5sum, force=True)
+				except Exception:
+					# no snapshot from that date
+					continue
+				if dated_checksum == checksum:
+					target = date
+					break
+
+			if not target:
+				raise Exception("No dated snapshot matches %s" % self.portage_path)
+
+		target_key = delta.snapshot_path(target)
+		if target != base_date:
+			if base is None:
+				logging.info("No base snapshot for portage deltas. Downloading %s" % target_key)
+				self.download(urljoin(mirror, target_key), key=target_key, checksum=checksum)
+			else:
+				self._apply_deltas(mirror, base_key, base_date, target, checksum)
+				# only the newest snapshot is kept as base
+				self.cache.remove(base_key)
+
+		self._link_cached(target_key, self.portage_path)
+
+	def _apply_deltas(self, mirror, base_key, base_date, target, checksum):
+		patches = delta.delta_paths(base_date, target)
+		logging.info("Updating the portage snapshot from %s to %s with %s delta(s)" % (base_date, target, len(patches)))
+		patch_files = [self.download(urljoin(mirror, p), key=p) for p in patches]
+
+		tmp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+		try:
+			base_tar, new_tar, new_bz2 = [os.path.join(tmp_dir, x) for x in ['base.tar', 'new.tar', 'new.tar.bz2']]
+			with open(base_tar, 'wb') as f:
+				Command('bzip2')('-dc', self.cache.lookup(base_key).path, _out=f)
+
+			# patcher is part of diffball, like in emerge-delta-webrsync
+			Command('patcher')(base_tar, *patch_files + [new_tar])
+
+			# the checksum is the one of the archive compressed with bzip2 -9
+			with open(new_bz2, 'wb') as f:
+				Command('bzip2')('-9', '-c', new_tar, _out=f)
+			if hash_file(new_bz2, checksum[0]) != checksum[1]:
+				raise ChecksumError("The patched snapshot does not match the %s checksum" % checksum[0])
+
+			target_key = delta.snapshot_path(target)
+			with self.cache.lock(target_key):
+				self.cache.store(target_key, new_bz2, hash_file(new_bz2, 'sha256'), verified="%s:%s" % checksum)
+		finally:
+			shutil.rmtree(tmp_dir)
+			for p in patches:
+				self.cache.remove(p)
+
+	def _link_cached(self, source_key, key):
+		"""Makes the cached content of source_key the content of key, too"""
+		entry = self.cache.lookup(source_key)
+		with self.cache.lock(key):
+			part = PartialDownload(self.cache.part_file(key))
+			part.remove()
+			os.link(entry.path, part.part_file)
+			# store() drops the link again, as the content is cached already
+			self.cache.store(key, part.part_file, entry.digest, verified=entry.verified)
+
+	def fetch_distfile(self, name):
+		"""Loads the distfile name from the mirrors and returns the cache file"""
+		# mirrors store the distfiles in directories named after the BLAKE2B hash of the name (see
+		# distfiles/layout.conf); older mirrors have a flat layout
+		paths = ['distfiles/%s/%s' % (hashlib.blake2b(name.encode('utf-8')).hexdigest()[:2], name), 'distfiles/%s' % name]
+
+		def fetch(mirror):
+			for path in paths:
+				try:
+					return self.download(urljoin(mirror, path), key='distfiles/%s' % name)
+				except Exception as ex:
+					logging.debug("Could not load %s: %s" % (urljoin(mirror, path), ex))
+			raise Exception("Distfile %s not found" % name)
+
+		return self._try_mirrors('distfile %s' % name, fetch)
+
+
+class PrefetchAction(ActionBase):
+	"""Downloads the archives into the cache while the storage is created"""
+	requires = ('config',)
+	provides = ('downloads',)
+
+	def __init__(self, config, loader=None):
+		super(PrefetchAction, self).__init__(config)
+		self.loader = loader
+
+	def test(self):
+		return True
+
+	def execute(self):
+		loader = self.loader or GentooLoader.from_config(self.config)
+
+		# in streaming mode, InstallGentooAction extracts the archives while it downloads them. Prefetching them
+		# would download them before the storage is ready, so the download and the extraction would not overlap.
+		# Templates and squashfs images are built from the whole archive, so they are prefetched anyway.
+		streaming = self.config.stream_extract
+		stream_stage3 = streaming and not self.config.stage3_template and not self.config.root_overlay
+		stream_portage = streaming and self.config.portage == 'fetch'
+
+		# failed downloads are retried by InstallGentooAction
+		try:
+			# a cloned root contains the stage3 already
+			if not self.config.can_clone_root and not self.is_done('stage3') and not stream_stage3:
+				logging.info("Prefetching the stage3 archive")
+				with report.phase('stage3'):
+					loader.fetch_stage3(self.config.arch, self.config.subarch)
+
+			if self.config.portage in ('fetch', 'squashfs') and not self.is_done('portage') and not stream_portage:
+				logging.info("Prefetching the portage snapshot")
+				with report.phase('portage'):
+					loader.fetch_portage()
+		except Exception as ex:
+			logging.warning("Prefetching failed: %s" % ex)
 
 
 class InstallGentooAction(ActionBase):
+	requires = ('storage', 'downloads')
+	provides = ('root',)
 
-	def __init__(self, config, personalize=True):
+	def __init__(self, config, personalize=True, loader=None):
 		super(InstallGentooAction, self).__init__(config)
 		self.do_personalization = personalize
+		self.loader = loader
 		self.clean_resolv_conf = False
+		# host directory with the mountpoint of the portage image and the overlay directories
+		self.portage_overlay = None
+		# host directories the root storage is mounted to and temporary directories of the root overlay
+		self.host_mounts = []
+		self.host_dirs = []
+		self.template_lock = None
+		# the directory with the layers of a root overlay which is flattened at the end
+		self.layers = None
 
 	def test(self):
+		if self.config.root_overlay and any(mount and mount != "/" for storage, mount in self.config.storage):
+			logging.error("The root overlay can't be used with storage mounted below the root")
+			return False
 		return True
 
 	def is_mounted(self, mountpoint):
@@ -90,6 +373,63 @@ class InstallGentooAction(ActionBase):
 				os.makedirs(mountpoint)
 			mount(storage.device, mountpoint)
 
+	def _prepare_overlay(self, lower):
+		"""
+		Mounts an overlay of lower (the stage3 template) to the working directory. The writes go to the root storage
+		or, if the root is flattened at the end, to a temporary directory.
+		"""
+		root = self.config.root_storage
+
+		if self.config.flatten_root:
+			# the layers are kept after a failure, so a resumed run continues with them
+			layers = os.path.join(self.config.cache_dir, 'overlays', self.config.name)
+			if os.path.exists(layers) and not self.is_done('stage3'):
+				shutil.rmtree(layers)
+			if not os.path.exists(layers):
+				os.makedirs(layers)
+			self.layers = layers
+		elif root.is_block_storage():
+			layers = tempfile.mkdtemp(prefix='root-')
+			mount(root.device, layers)
+			self.host_mounts.append(layers)
+		else:
+			layers = root.device
+
+		upper, work = os.path.join(layers, 'upper'), os.path.join(layers, 'work')
+		for d in [upper, work]:
+			if not os.path.exists(d):
+				os.mkdir(d)
+
+		self.template_lock = TemplateStore(os.path.join(self.config.cache_dir, 'templates')).hold(lower)
+		logging.info("Mounting an overlay of %s with the changes in %s to %s" % (lower, upper, self.config.working_directory))
+		mount('-t', 'overlay', 'overlay', '-o', 'lowerdir=%s,upperdir=%s,workdir=%s' % (lower, upper, work),
+			  self.config.working_directory)
+
+	def _flatten(self):
+		"""Copies the merged tree of the overlay onto the root storage"""
+		root = self.config.root_storage
+		# /dev, /proc, usr/portage etc. must not be copied
+		self._unmount_below(self.config.working_directory, include=False)
+
+		if root.is_block_storage():
+			target = tempfile.mkdtemp(prefix='root-')
+			mount(root.device, target)
+			self.host_mounts.append(target)
+		else:
+			target = root.device
+
+		logging.info("Flattening the overlay onto %s" % root.device)
+		copy_tree(self.config.working_directory, target, self.config.threads)
+
+	def _unmount_below(self, path, include=True):
+		"""Unmounts everything mounted below path (and path itself, if include is True), innermost first"""
+		mounts = FstabConfig('/proc/mounts')
+		below = mounts.find_all(lambda x: x.mountpoint.startswith(path) and (include or x.mountpoint != path))
+
+		for m in sorted(below, key=lambda x: x.mountpoint, reverse=True):
+			logging.debug("Unmounting %s" % m.mountpoint)
+			umount(m.mountpoint)
+
 	def _cleanup(self):
 		"""Unmounts all from the current installation run in the correct order"""
 
@@ -97,12 +437,32 @@ class InstallGentooAction(ActionBase):
 			os.remove(self._path('/etc/resolv.conf'))
 
 		if self.is_mounted(self.config.working_directory):
-			mounts = FstabConfig('/proc/mounts')
-			chroot_mounts = mounts.find_all(lambda x: x.mountpoint.startswith(self.config.working_directory))
+			self._unmount_below(self.config.working_directory)
 
-			for m in sorted(chroot_mounts, key=lambda x: x.mountpoint, reverse=True):
-				logging.debug("Unmounting %s" % m.mountpoint)
-				umount(m.mountpoint)
+		if self.portage_overlay:
+			lower = os.path.join(self.portage_overlay, 'lower')
+			if self.is_mounted(lower):
+				umount(lower)
+			shutil.rmtree(self.portage_overlay)
+			self.portage_overlay = None
+
+		if self.template_lock:
+			self.template_lock.close()
+			self.template_lock = None
+
+		for d in reversed(self.host_mounts):
+			if self.is_mounted(d):
+				umount(d)
+			os.rmdir(d)
+		self.host_mounts = []
+
+		for d in self.host_dirs:
+			shutil.rmtree(d)
+		self.host_dirs = []
+
+		if self.layers and (self.journal is None or self.is_done('root')):
+			shutil.rmtree(self.layers)
+		self.layers = None
 
 		os.rmdir(self.config.working_directory)
 
@@ -112,6 +472,38 @@ class InstallGentooAction(ActionBase):
 		"""
 		return os.path.join(self.config.working_directory, path.lstrip('/'))
 
+	def _mount_portage_image(self, loader, extractor):
+		"""
+		Mounts the SquashFS image of the latest portage snapshot read-only to usr/portage, with an overlay which
+		takes the writes of the chroot
+		"""
+		portage = loader.fetch_portage()
+		if not portage:
+			raise Exception("Could not load portage snapshot")
+
+		date = snapshot_date(loader.cache.lookup(loader.portage_path))
+		images = SquashfsStore(os.path.join(self.config.cache_dir, 'squashfs'))
+		image = images.get(date, portage, extractor, self.config.threads)
+
+		self.portage_overlay = tempfile.mkdtemp(prefix='portage-overlay-')
+		lower, upper, work = [os.path.join(self.portage_overlay, x) for x in ['lower', 'upper', 'work']]
+		for d in [lower, upper, work]:
+			os.mkdir(d)
+
+		wd_portage = self._path('/usr/portage')
+		if not os.path.exists(wd_portage):
+			os.makedirs(wd_portage)
+
+		logging.debug("Mounting %s to %s" % (image, wd_portage))
+		mount('-t', 'squashfs', '-o', 'loop,ro', image, lower)
+		mount('-t', 'overlay', 'overlay', '-o', 'lowerdir=%s,upperdir=%s,workdir=%s' % (lower, upper, work), wd_portage)
+
+	def _stream_extractor(self, extractor, target, preserve=True):
+		"""Returns a consumer for Loader.download which pipes the downloaded bytes into the extractor"""
+		def extract(reader):
+			extractor.extract_stream(reader, target, preserve)
+		return extract
+
 	def _print_summary(self):
 		logging.info("--------------------------------------------------------------")
 		logging.info("Name:            %s" % self.config.name)
@@ -141,54 +533,175 @@ class InstallGentooAction(ActionBase):
 				logging.info("    DHCP")
 			logging.info("--------------------------------------------------------------")
 
+	def _template(self, loader, extractor, stage3=None):
+		"""Returns the template of the latest stage3 archive"""
+		if not stage3:
+			with report.phase('download'):
+				stage3 = loader.fetch_stage3(self.config.arch, self.config.subarch)
+			if not stage3:
+				raise Exception("Could not load stage3 archive from one of the mirrors: %s" % ', '.join(self.config.gentoo_mirrors))
+
+		templates = TemplateStore(os.path.join(self.config.cache_dir, 'templates'))
+		with report.phase('template'):
+			return templates.get(self.config.arch, self.config.subarch, loader.stage3_name(loader.stage3_path), stage3, extractor)
+
+	def _install_stage3(self, loader, extractor, streaming):
+		"""Loads the latest stage3 archive and extracts it to the working directory"""
+		# in streaming mode, the archive is extracted while it is being downloaded. Templates are extracted
+		# once and cloned afterwards, so streaming doesn't apply to them.
+		use_template = self.config.stage3_template
+
+		stage3_consumer = None
+		if streaming and not use_template:
+			stage3_consumer = self._stream_extractor(extractor, self.config.working_directory)
+
+		# in streaming mode, the download phase includes the extraction
+		with report.phase('download'):
+			stage3 = loader.fetch_stage3(self.config.arch, self.config.subarch, consumer=stage3_consumer)
+		if not stage3:
+			raise Exception("Could not load stage3 archive from one of the mirrors: %s" % ', '.join(self.config.gentoo_mirrors))
+
+		if use_template:
+			templates = TemplateStore(os.path.join(self.config.cache_dir, 'templates'))
+			template = self._template(loader, extractor, stage3)
+			with report.phase('clone'):
+				templates.clone(template, self.config.working_directory, self.config.threads)
+		elif not streaming:
+			# extract stage3 archive to chroot
+			with report.phase('extract'):
+				extractor.extract(stage3, self.config.working_directory)
+
+	def _install_portage(self, loader, extractor, streaming):
+		if self.config.portage == 'fetch':
+			# get the portage snapshot and extract it to usr/portage
+			with report.phase('download'):
+				portage = loader.fetch_portage(consumer=self._stream_extractor(extractor, self._path('/usr/'), preserve=False) if streaming else None)
+			if not portage:
+				raise Exception("Could not load portage snapshot")
+			if not streaming:
+				with report.phase('extract'):
+					extractor.extract(portage, self._path('/usr/'), preserve=False)
+		elif self.config.portage == 'squashfs':
+			self._mount_portage_image(loader, extractor)
+		elif self.config.portage == 'inherit':
+			if not os.listdir('/usr/portage'):
+				raise Exception("You don't have a portage tree mounted at /usr/portage.")
+
+			wd_portage = self._path('/usr/portage')
+			if not os.path.exists(wd_portage):
+				os.makedirs(wd_portage)
+
+			# bind-mount the hosts /usr/portage to usr/portage
+			logging.debug("Bind'ing /usr/portage to %s" % wd_portage)
+			mount('-o', 'bind', '/usr/portage', wd_portage)
+
+	def _resumed_template(self):
+		"""Returns the template the root overlay of the previous run is based on"""
+		template = self.journal.get('stage3').get('template')
+		if not template or not os.path.exists(template):
+			raise Exception("Can't resume, the stage3 template %s of the previous run doesn't exist anymore" % template)
+		return template
+
 	def execute(self):
+		if self.is_done('root'):
+			logging.info("Gentoo has been installed by the previous run")
+			return
+
 		try:
 			self._print_summary()
-			self._prepare()
 
-			logging.info("Fetching and unpacking archive(s)...")
-
-			# load the latest stage3 archive
-			loader = GentooLoader(self.config.gentoo_mirrors)
+			loader = self.loader or GentooLoader.from_config(self.config)
+			streaming = self.config.stream_extract
+
+			extractor = ArchiveExtractor(self.config.threads)
+			logging.debug("Decompressing with up to %s thread(s)" % extractor.threads)
+
+			root = self.config.root_storage
+			# a cloned root contains the stage3 already
+			overlay = self.config.root_overlay and not root.cloned
+
+			if overlay:
+				# the upper layer of a resumed run belongs to the template of the previous run
+				if self.is_done('stage3'):
+					template = self._resumed_template()
+				else:
+					with report.phase('stage3'):
+						template = self._template(loader, extractor)
+				self._prepare_overlay(template)
+				self.checkpoint('stage3', template=template)
+			else:
+				self._prepare()
 
-			stage3 = loader.fetch_stage3(self.config.arch, self.config.subarch)
-			if not stage3:
-				raise Exception("Could not load stage3 archive from one of the mirrors: %s" % ', '.join(self.config.gentoo_mirrors))
+			logging.info("Fetching and unpacking archive(s)...")
 
-			# extract stage3 archive to chroot
-			logging.info("Extracting %s to %s" % (stage3, self.config.working_directory))
-			tar("xjpf", stage3, "-C", self.config.working_directory)
-
-			if self.config.portage == 'fetch':
-				# get the portage snapshot and extract it to usr/portage
-				portage = loader.fetch_portage()
-				if not portage:
-					raise Exception("Could not load portage snapshot")
-				tar("xjf", portage, '-C', self._path('/usr/'))
-			elif self.config.portage == 'inherit':
-				if not os.listdir('/usr/portage'):
-					raise Exception("You don't have a portage tree mounted at /usr/portage.")
-
-				wd_portage = self._path('/usr/portage')
-				if not os.path.exists(wd_portage):
-					os.makedirs(wd_portage)
-
-				# bind-mount the hosts /usr/portage to usr/portage
-				logging.debug("Bind'ing /usr/portage to %s" % wd_portage)
-				mount('-o', 'bind', '/usr/portage', wd_portage)
+			if root.cloned:
+				logging.info("%s has been cloned from a base and contains the stage3 already" % root.device)
+			elif overlay:
+				logging.info("The stage3 is the lower layer of the overlay")
+			elif self.is_done('stage3'):
+				logging.info("The stage3 has been extracted by the previous run")
+			else:
+				with report.phase('stage3'):
+					self._install_stage3(loader, extractor, streaming)
+
+				tag = loader.stage3_name(loader.stage3_path)
+				if self.config.can_clone_root and not root.has_base(tag):
+					# keep the freshly extracted stage3 as the base for the next domUs
+					with report.phase('save base'):
+						os.sync()
+						try:
+							root.save_base(tag)
+						except Exception as ex:
+							# the stage3 is installed, the next domUs just can't be cloned
+							logging.warning("Could not save %s as base: %s" % (root.device, ex))
+				self.checkpoint('stage3')
+
+			# the squashfs and inherit modes only mount the tree, which is repeated on resume
+			if self.config.portage == 'fetch' and self.is_done('portage'):
+				logging.info("The portage snapshot has been extracted by the previous run")
+			else:
+				with report.phase('portage'):
+					self._install_portage(loader, extractor, streaming)
+				if self.config.portage == 'fetch':
+					self.checkpoint('portage')
 
 			if self.do_personalization:
-				self.personalize()
+				with report.phase('personalize'):
+					self.personalize()
 
+			if overlay and self.config.flatten_root:
+				with report.phase('flatten'):
+					self._flatten()
+
+			self.checkpoint('root')
 		except Exception as ex:
 			logging.error("Installing gentoo failed: %s" % ex)
-			logging.error(traceback.format_exc())
+			raise
 		finally:
 			self._cleanup()
 
 	def personalize(self):
 		logging.info("Personalizing installation...")
 
+		if self.is_done('personalize'):
+			logging.info("The configuration files have been written by the previous run")
+			if self.config.network:
+				self._copy_resolv_conf()
+				self.clean_resolv_conf = self.clean_resolv_conf or self.journal.get('personalize').get('clean_resolv_conf')
+		else:
+			self._personalize_files()
+			self.checkpoint('personalize', clean_resolv_conf=self.clean_resolv_conf)
+
+		self.personalize_chroot()
+
+	def _copy_resolv_conf(self):
+		"""Copies the host's resolv.conf, so the chroot can resolve the mirrors"""
+		self.clean_resolv_conf = not os.path.exists(self._path('/etc/resolv.conf'))
+		shutil.copy('/etc/resolv.conf', self._path('/etc/resolv.conf'))
+
+	def _personalize_files(self):
+		"""Writes the configuration files of the domU"""
+
 		if self.config.locales:
 			logging.debug("Configuring locales...")
 			locale_gen = SimpleConfig(self._path('/etc/locale.gen'))
@@ -270,8 +783,7 @@ class InstallGentooAction(ActionBase):
 					if netsettings.resolv_search:
 						cfg.set('dns_search_eth0', netsettings.resolv_search)
 
-			self.clean_resolv_conf = not os.path.exists(self._path('/etc/resolv.conf'))
-			shutil.copy('/etc/resolv.conf', self._path('/etc/resolv.conf'))
+			self._copy_resolv_conf()
 
 		with open(self._path('/etc/timezone'), 'w') as f:
 			f.write(self.config.timezone)
@@ -284,8 +796,6 @@ class InstallGentooAction(ActionBase):
 		else:
 			logging.warning("Zoneinfo file %s does not exist" % tz_file)
 
-		self.personalize_chroot()
-
 	def personalize_chroot(self):
 		chroot_helper = None
 
@@ -306,43 +816,100 @@ class InstallGentooAction(ActionBase):
 		mount('-o', 'bind', '/dev', self._path('/dev'))
 		mount('-t', 'proc', 'none', self._path('/proc'))
 
+		settings = []
+		if self.config.binpkgs:
+			settings.extend(self._enable_binpkgs())
+		if self.config.shared_distfiles:
+			settings.extend(self._enable_distfiles())
+
+		make_conf = None
+		if settings:
+			make_conf = self._path('/etc/portage/make.conf')
+			if not os.path.exists(make_conf) and os.path.exists(self._path('/etc/make.conf')):
+				make_conf = self._path('/etc/make.conf')
+			make_conf = make_conf, makeconf.append_settings(make_conf, settings)
+
 		args = [ '-l', self.config.default_locale,
 				 '-p', self.config.root_password,
 				 '-e', self.config.merge_list or '',
 				 '-u', ' '.join(self.config.layman_urls),
 				 '-o', ' '.join(self.config.layman_overlays),
-				 '-s', self.config.boot_services or ''
+				 '-s', self.config.boot_services or '',
+				 # the stages completed by the previous run
+				 '-k', ' '.join(self.journal.completed('chroot/') if self.journal else [])
 		]
 
+		log_file = os.path.join(self.config.log_dir, '%s.log' % self.config.name) if self.config.log_dir else None
+		output = OutputCapture(log_file, self.config.output_tail)
+		# the chroot script announces its stages with '@@stage <name>' lines
+		stages = report.Stages()
+
+		chroot_output = MarkerOutput(output, {
+			CHROOT_STAGE_MARKER: lambda stage: stages.switch('chroot/%s' % stage),
+			CHROOT_DONE_MARKER: lambda stage: self.checkpoint('chroot/%s' % stage),
+		})
+
+		# the output is passed to the callbacks line by line; sh must not keep it (_no_out/_no_err), because
+		# an emerge of the merge list prints hundreds of MB
+		sh_args = dict(_err_to_out=True, _no_out=True, _no_err=True)
+
 		logging.info("Setting up system in chroot. Depending on your default emerge list this takes some time...")
-		cmd = None
+		if log_file:
+			logging.info("Writing the output of the chroot to %s" % log_file)
 		try:
-			cmd = chroot(self.config.working_directory, '/bin/bash', '/root/bootstrap.sh', *args, _iter=True)
-			for line in cmd:
-				logging.debug(line.strip())
+			output.header("chroot %s" % ' '.join(['/root/bootstrap.sh'] + args[:2] + args[4:]))
+			chroot(self.config.working_directory, '/bin/bash', '/root/bootstrap.sh', *args, _out=chroot_output, **sh_args)
+			stages.finish()
 
-			if self.config.post_setup_exec:
+			if self.config.post_setup_exec and not self.is_done('post_setup'):
 				logging.info("Executing post-setup executable: %s" % self.config.post_setup_exec)
-				c = Command(self.config.post_setup_exec)
-				cmd = c(self.config.working_directory)
-				for line in cmd:
-					logging.debug(line.strip())
+				with report.phase('post_setup'):
+					output.header(self.config.post_setup_exec)
+					Command(self.config.post_setup_exec)(self.config.working_directory, _out=output, **sh_args)
+				self.checkpoint('post_setup')
 
 		except Exception as ex:
-			# TODO: Make the output nicer and de-duplicate
+			stages.finish('failed')
 			logging.fatal("EXCEPTION:")
 			logging.fatal(ex)
-
-			if getattr(ex, 'stdout', None):
-				logging.fatal("STDOUT: ")
-				for line in str(ex.stdout, encoding='utf-8') .split('\n'):
-					logging.fatal(line)
-			if getattr(ex, 'stderr', None):
-				logging.fatal("STDERR: ")
-				for line in str(ex.stderr, encoding='utf-8').split('\n'):
-					logging.fatal(line)
+			output.log_tail(logging.FATAL)
+			raise
 		finally:
+			output.close()
 			for p in [self._path('/root/bootstrap.sh'), self._path('/root/chroot_exec')]:
 				if os.path.exists(p):
 					os.remove(p)
 
+			if make_conf is not None:
+				# the domU must not depend on the directories of the host
+				makeconf.restore(*make_conf)
+
+			if self.config.shared_distfiles:
+				DistfilesIndex(self.config.distfiles_dir).scan()
+
+	def _bind(self, host_path, chroot_path):
+		wd_path = self._path(chroot_path)
+		if not os.path.exists(wd_path):
+			os.makedirs(wd_path)
+		mount('-o', 'bind', host_path, wd_path)
+
+	def _enable_binpkgs(self):
+		"""
+		Bind-mounts the host's package directory for the settings of the chroot and returns the make.conf settings
+		which make emerge build and use binary packages
+		"""
+		packages = BinaryPackageCache(self.config.binpkg_dir)
+		pkgdir = packages.path(self.config.working_directory, self.config.arch, self.config.subarch)
+
+		logging.info("Using binary packages from %s" % pkgdir)
+		self._bind(pkgdir, CHROOT_PKGDIR)
+		return packages.make_conf_settings()
+
+	def _enable_distfiles(self):
+		"""Bind-mounts the host's shared distfiles directory and returns the make.conf settings to use it"""
+		index = DistfilesIndex(self.config.distfiles_dir)
+		logging.info("Using the shared distfiles in %s (%s file(s))" % (index.directory, len(index.entries())))
+		self._bind(index.directory, CHROOT_DISTDIR)
+		# distlocks lets concurrent chroots wait for each other instead of fetching the same file
+		return [('DISTDIR', CHROOT_DISTDIR), ('FEATURES', '${FEATURES} distlocks')]
+
@@ -1,15 +1,109 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from gentoobootstrap.actions.base import ActionBase
+from gentoobootstrap.actions.gentoo import GentooLoader
+from gentoobootstrap import report
 
 
 class CreateStorageAction(ActionBase):
+	requires = ('config',)
+	provides = ('storage',)
+
+	def __init__(self, config, loader=None):
+		super(CreateStorageAction, self).__init__(config)
+		self.loader = loader
+		self._created = []
+		self._created_lock = threading.Lock()
 
 	def test(self):
-		return self.config.has_storage and all([not storage.exists() for storage, mount in self.config.storage])
+		if not self.config.has_storage:
+			return False
+
+		if self.is_done('storage'):
+			# resuming: the storage has been created by the previous run
+			missing = [storage.device for storage, mount in self.config.storage if not os.path.exists(storage.device)]
+			if missing:
+				logging.error("Can't resume, the storage is missing: %s" % ', '.join(missing))
+			return not missing
 
-	def execute(self):
-		logging.info("Creating storage...")
 		for storage, mount in self.config.storage:
+			try:
+				storage.format_options()
+			except Exception as ex:
+				logging.error("%s: %s" % (storage.device, ex))
+				return False
+
+		return all([not storage.exists() for storage, mount in self.config.storage])
+
+	def _base_tag(self):
+		"""Returns the tag of the base the root storage can be cloned from: the name of the latest stage3"""
+		loader = self.loader or GentooLoader.from_config(self.config)
+		path = loader.latest_stage3(self.config.arch, self.config.subarch)
+		return loader.stage3_name(path) if path else None
+
+	def _create(self, storage, mount):
+		start = time.time()
+
+		if mount == "/" and self.config.can_clone_root:
+			tag = self._base_tag()
+			if tag and storage.has_base(tag):
+				with report.phase("clone %s" % storage.device):
+					cloned = storage.clone(tag)
+				if cloned:
+					with self._created_lock:
+						self._created.append(storage)
+					logging.info("Cloned %s in %.1fs" % (storage.device, time.time() - start))
+					return
+
+		with report.phase("create %s" % storage.device):
 			storage.create()
+		with self._created_lock:
+			self._created.append(storage)
+		created = time.time()
+
+		with report.phase("format %s" % storage.device):
 			storage.format()
+		logging.info("Created %s in %.1fs and formatted it in %.1fs" % (storage.device, created - start, time.time() - created))
+
+	def _rollback(self):
+		for storage in self._created:
+			try:
+				storage.remove()
+			except Exception as ex:
+				logging.error("Could not remove %s: %s" % (storage.device, ex))
+		self._created = []
+
+	def execute(self):
+		if self.is_done('storage'):
+			logging.info("Using the storage created by the previous run")
+			# the install must not extract the stage3 again onto a cloned root
+			self.config.root_storage.cloned = self.journal.get('storage').get('cloned', False)
+			return
+
+		logging.info("Creating storage...")
+		start = time.time()
+
+		# keep the name of the current thread (e.g. the domU in a batch) in the log messages of the workers
+		with ThreadPoolExecutor(max_workers=self.config.storage_workers,
+								thread_name_prefix=threading.current_thread().name) as executor:
+			create = report.bind(self._create)
+			futures = [(storage, executor.submit(create, storage, mount)) for storage, mount in self.config.storage]
+
+		errors = []
+		for storage, future in futures:
+			if future.exception():
+				logging.error("Creating %s failed: %s" % (storage.device, future.exception()))
+				errors.append("%s: %s" % (storage.device, future.exception()))
+
+		if errors:
+			logging.info("Rolling back the created storage")
+			self._rollback()
+			raise Exception("Creating storage failed (%s)" % '; '.join(errors))
+
+		logging.info("Created %s disk(s) in %.1fs" % (len(futures), time.time() - start))
+		self.checkpoint('storage', cloned=self.config.root_storage.cloned)
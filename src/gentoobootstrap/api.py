@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import socket
+import socketserver
+import time
+
+
+# the Unix socket of the bootstrap daemon
+DEFAULT_SOCKET = '/run/gentoo-bootstrap.sock'
+
+# the states of a job which don't change anymore
+FINISHED = ('ok', 'failed', 'cancelled')
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+	def handle(self):
+		# one JSON request per line, each answered by one JSON line
+		for line in self.rfile:
+			try:
+				request = json.loads(line.decode('utf-8'))
+				if not isinstance(request, dict):
+					raise ValueError("request must be an object")
+			except ValueError as ex:
+				response = {'ok': False, 'error': "Invalid request: %s" % ex}
+			else:
+				response = self.server.handler(request)
+
+			self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+			self.wfile.flush()
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	"""
+	Serves the job API on a Unix socket. Each request is a JSON object with a 'command'; handler(request) returns
+	the response object: {'ok': true, ...} or {'ok': false, 'error': '...'}.
+	"""
+	daemon_threads = True
+
+	def __init__(self, socket_path, handler):
+		if os.path.exists(socket_path):
+			if DaemonClient(socket_path).available():
+				raise Exception("A daemon is listening on %s already" % socket_path)
+			os.remove(socket_path)
+
+		self.handler = handler
+		socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+		# bootstrapping requires root, so does submitting jobs
+		os.chmod(socket_path, 0o600)
+
+	def server_close(self):
+		socketserver.UnixStreamServer.server_close(self)
+		if os.path.exists(self.server_address):
+			os.remove(self.server_address)
+
+
+class DaemonClient(object):
+	"""Client of the job API of the bootstrap daemon"""
+
+	def __init__(self, socket_path=DEFAULT_SOCKET):
+		self.socket_path = socket_path
+
+	def available(self):
+		"""Returns True if a daemon listens on the socket"""
+		if not os.path.exists(self.socket_path):
+			return False
+
+		try:
+			with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+				s.connect(self.socket_path)
+			return True
+		except OSError:
+			return False
+
+	def request(self, command, **args):
+		"""Sends the command and returns the response. Raises an exception if the daemon returned an error."""
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+			s.connect(self.socket_path)
+			s.sendall((json.dumps(dict(args, command=command)) + '\n').encode('utf-8'))
+			with s.makefile('r', encoding='utf-8') as f:
+				line = f.readline()
+
+		if not line:
+			raise Exception("The daemon closed the connection")
+
+		response = json.loads(line)
+		if not response.get('ok'):
+			raise Exception(response.get('error') or "Request failed")
+		return response
+
+	def submit(self, name, fqdn, config, **options):
+		"""
+		Submits a bootstrap and returns the job. options are install, personalize, create_config, resume and
+		xen_config_dir (default: the directory of the daemon).
+		"""
+		return self.request('submit', name=name, fqdn=fqdn, config=os.path.abspath(config), **options)['job']
+
+	def query(self, id=None):
+		"""Returns the job with id or, if id is None, all jobs (without their reports)"""
+		if id is None:
+			return self.request('query')['jobs']
+		return self.request('query', id=id)['job']
+
+	def cancel(self, id):
+		return self.request('cancel', id=id)['job']
+
+	def wait(self, id, interval=1.0):
+		"""Waits until the job finished and returns it"""
+		status = None
+		while True:
+			job = self.query(id)
+			if job['status'] != status:
+				status = job['status']
+				logging.info("Job %s (%s): %s" % (id, job['name'], status))
+			if status in FINISHED:
+				return job
+			time.sleep(interval)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import itertools
+import logging
+import os
+import shutil
+
+from sh import tar
+
+
+class Compression(object):
+	"""
+	A compression format, identified by its magic bytes. programs is a list of (binary, thread option) in order of
+	preference. The thread option is formatted with the number of threads; None means the program is single-threaded.
+	"""
+
+	def __init__(self, name, magic, programs):
+		self.name = name
+		self.magic = magic
+		self.programs = programs
+
+	def matches(self, header):
+		return header.startswith(self.magic)
+
+	def program(self, threads):
+		"""Returns the command line of the best available program for tar's --use-compress-program"""
+		for binary, thread_opt in self.programs:
+			if shutil.which(binary):
+				return binary if not thread_opt or threads <= 1 else "%s %s" % (binary, thread_opt % threads)
+		raise Exception("No decompressor for %s found. Install one of: %s" % (
+						self.name, ', '.join(binary for binary, _ in self.programs)))
+
+	def __repr__(self):
+		return self.name
+
+
+COMPRESSIONS = [
+	Compression('bzip2', b'BZh', [('lbzip2', '-n %s'), ('pbzip2', '-p%s'), ('bzip2', None)]),
+	# xz >= 5.4 decompresses multi-block archives in parallel
+	Compression('xz', b'\xfd7zXZ\x00', [('xz', '-T%s'), ('pixz', '-p %s')]),
+	Compression('zstd', b'\x28\xb5\x2f\xfd', [('zstd', '-T%s'), ('pzstd', '-p %s')]),
+	Compression('gzip', b'\x1f\x8b', [('pigz', '-p %s'), ('gzip', None)]),
+]
+
+# the magic of uncompressed tar files is at offset 257
+HEADER_SIZE = 262
+
+
+def detect(header):
+	"""Returns the Compression of an archive starting with header or None for uncompressed archives"""
+	for compression in COMPRESSIONS:
+		if compression.matches(header):
+			return compression
+
+	if header[257:262] == b'ustar':
+		return None
+
+	raise Exception("Unknown archive format")
+
+
+class ArchiveExtractor(object):
+	"""Extracts tar archives using a parallel decompressor limited to a number of threads"""
+
+	def __init__(self, threads=None):
+		self.threads = threads or os.cpu_count() or 1
+
+	def _tar_args(self, header, target, preserve):
+		compression = detect(header)
+		args = ['-x', '-C', target]
+		if preserve:
+			args.append('-p')
+
+		if compression:
+			program = compression.program(self.threads)
+			logging.debug("Decompressing %s archive with '%s'" % (compression, program))
+			args.extend(['-I', program])
+
+		return args
+
+	def extract(self, archive, target, preserve=True):
+		with open(archive, 'rb') as f:
+			header = f.read(HEADER_SIZE)
+
+		logging.info("Extracting %s to %s" % (archive, target))
+		tar(*self._tar_args(header, target, preserve) + ['-f', archive])
+
+	def extract_stream(self, chunks, target, preserve=True):
+		"""Extracts the archive from an iterable of byte chunks"""
+		chunks = iter(chunks)
+		head = []
+		header = b''
+		for chunk in chunks:
+			head.append(chunk)
+			header += chunk
+			if len(header) >= HEADER_SIZE:
+				break
+
+		logging.info("Streaming archive into %s" % target)
+		tar(*self._tar_args(header, target, preserve) + ['-f', '-'], _in=itertools.chain(head, chunks))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from gentoobootstrap.actions.gentoo import GentooLoader
+from gentoobootstrap.bootstrap import Bootstrap
+from gentoobootstrap.config.file import FileConfig
+
+
+class BatchJob(object):
+
+	def __init__(self, name, fqdn, config, xen_config_dir=None):
+		self.name = name
+		self.fqdn = fqdn
+		self.config = config
+		# overrides the xen_config_dir of the batch
+		self.xen_config_dir = xen_config_dir
+		self.status = 'pending'
+		self.duration = None
+		self.error = None
+		# the RunReport of the bootstrap as dict
+		self.report = None
+		# stops the bootstrap after its running actions
+		self.cancel = threading.Event()
+
+	def as_dict(self):
+		return {
+			'name': self.name,
+			'fqdn': self.fqdn,
+			'config': self.config,
+			'xen_config_dir': self.xen_config_dir,
+			'status': self.status,
+			'duration': self.duration,
+			'error': self.error,
+			'report': self.report,
+		}
+
+
+def parse_manifest(filename):
+	"""
+	Parses a manifest with one '<name> <fqdn> <config>' line per domU. Empty lines and lines starting with '#' are
+	ignored. Relative config paths are relative to the manifest.
+	"""
+	jobs = []
+	names = set()
+
+	with open(filename, encoding='utf-8') as f:
+		for lineno, line in enumerate(f, 1):
+			line = line.strip()
+			if not line or line.startswith('#'):
+				continue
+
+			fields = line.split()
+			if len(fields) != 3:
+				raise Exception("%s:%s: expected '<name> <fqdn> <config>'" % (filename, lineno))
+
+			name, fqdn, config = fields
+			if name in names:
+				raise Exception("%s:%s: duplicate domU name %s" % (filename, lineno, name))
+			names.add(name)
+
+			if not os.path.isabs(config):
+				config = os.path.join(os.path.dirname(os.path.abspath(filename)), config)
+			jobs.append(BatchJob(name, fqdn, config))
+
+	return jobs
+
+
+class BatchBootstrap(object):
+	"""
+	Bootstraps many domUs with a pool of workers. Jobs with the same mirrors and cache settings share one
+	GentooLoader, so the mirror ranking and the download cache are set up once and each archive is downloaded once.
+	"""
+
+	def __init__(self, jobs, workers=4, xen_config_dir='/etc/xen', resume=False):
+		self.jobs = jobs
+		self.workers = workers
+		self.xen_config_dir = xen_config_dir
+		self.resume = resume
+		self._loaders = {}
+		self._loaders_lock = threading.Lock()
+
+	def loader(self, config):
+		key = (tuple(config.gentoo_mirrors), config.cache_dir, config.cache_size, config.download_connections,
+			   config.verify_digests, config.portage_deltas)
+
+		with self._loaders_lock:
+			if key not in self._loaders:
+				self._loaders[key] = GentooLoader.from_config(config)
+			return self._loaders[key]
+
+	def _run(self, job, install, personalize, create_config, resume=False):
+		# the thread name shows up in the log messages of the job
+		threading.current_thread().name = job.name
+		job.status = 'running'
+		start = time.time()
+
+		try:
+			cfg = FileConfig(job.config, name=job.name, fqdn=job.fqdn, xen_config_dir=job.xen_config_dir or self.xen_config_dir)
+			bootstrap = Bootstrap(cfg, loader=self.loader(cfg), resume=resume, cancel=job.cancel)
+			ok = bootstrap.execute(install=install, personalize=personalize, create_config=create_config)
+			job.status = 'ok' if ok else ('cancelled' if job.cancel.is_set() else 'failed')
+			job.error = bootstrap.error
+			job.report = bootstrap.report.as_dict()
+		except Exception as ex:
+			logging.error("Bootstrapping %s failed: %s" % (job.name, ex))
+			logging.debug(traceback.format_exc())
+			job.status = 'failed'
+			job.error = str(ex)
+		finally:
+			job.duration = round(time.time() - start, 1)
+
+		logging.info("Bootstrapping %s finished with status %s after %ss" % (job.name, job.status, job.duration))
+		return job
+
+	def execute(self, install=True, personalize=True, create_config=True):
+		"""Bootstraps all jobs and returns True if all succeeded"""
+		logging.info("Bootstrapping %s domU(s) with %s worker(s)" % (len(self.jobs), self.workers))
+
+		with ThreadPoolExecutor(max_workers=self.workers) as executor:
+			list(executor.map(lambda job: self._run(job, install, personalize, create_config, self.resume), self.jobs))
+
+		return all(job.status == 'ok' for job in self.jobs)
+
+	def report(self):
+		return [job.as_dict() for job in self.jobs]
+
+	def write_report(self, filename):
+		with open(filename, 'w') as f:
+			json.dump(self.report(), f, indent=4)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+
+from gentoobootstrap.makeconf import parse_make_conf
+
+
+# the PKGDIR inside the chroot
+CHROOT_PKGDIR = '/var/cache/binpkgs'
+
+# make.conf variables which change the binary packages
+FINGERPRINT_VARIABLES = ['CHOST', 'CFLAGS', 'CXXFLAGS', 'LDFLAGS', 'USE', 'ACCEPT_KEYWORDS']
+
+
+def _read_tree(path):
+	"""Returns the content of the file path or of all files below the directory path"""
+	if os.path.isfile(path):
+		with open(path, encoding='utf-8', errors='replace') as f:
+			return f.read()
+
+	content = []
+	if os.path.isdir(path):
+		for root, dirs, files in os.walk(path):
+			dirs.sort()
+			for name in sorted(files):
+				content.append(_read_tree(os.path.join(root, name)))
+	return '\n'.join(content)
+
+
+def fingerprint(root, arch, subarch=None):
+	"""
+	Returns a fingerprint of the settings in root which change the binary packages: the arch, the portage profile,
+	the compiler flags and USE in make.conf and the package.use and package.keywords files.
+	"""
+	make_conf = ''
+	for f in ['etc/portage/make.conf', 'etc/make.conf']:
+		if os.path.exists(os.path.join(root, f)):
+			make_conf = _read_tree(os.path.join(root, f))
+			break
+	variables = parse_make_conf(make_conf)
+
+	profile = os.path.join(root, 'etc/portage/make.profile')
+	profile = os.readlink(profile) if os.path.islink(profile) else ''
+	# the profile link may be relative or absolute; only the profile name matters
+	profile = profile.split('profiles/', 1)[-1]
+
+	h = hashlib.sha256()
+	for value in [arch, subarch or arch, profile] + ['%s=%s' % (v, variables.get(v, '')) for v in FINGERPRINT_VARIABLES]:
+		h.update(value.encode('utf-8'))
+		h.update(b'\0')
+	for f in ['etc/portage/package.use', 'etc/portage/package.keywords', 'etc/portage/package.accept_keywords']:
+		h.update(_read_tree(os.path.join(root, f)).encode('utf-8'))
+		h.update(b'\0')
+
+	return "%s-%s" % (subarch or arch, h.hexdigest()[:16])
+
+
+class BinaryPackageCache(object):
+	"""
+	Keeps the binary packages built in the chroots in directory/<fingerprint>, so domUs with the same settings
+	install the packages built by the first one.
+	"""
+
+	def __init__(self, directory):
+		self.directory = directory
+
+	def path(self, root, arch, subarch=None):
+		"""Returns the package directory for the settings in root. The directory is created if it doesn't exist."""
+		path = os.path.join(self.directory, fingerprint(root, arch, subarch))
+		if not os.path.exists(path):
+			logging.info("Creating binary package directory %s" % path)
+			os.makedirs(path, exist_ok=True)
+		return path
+
+	@staticmethod
+	def make_conf_settings():
+		"""Returns the make.conf settings for building and using binary packages in the chroot"""
+		return [
+			('PKGDIR', CHROOT_PKGDIR),
+			('FEATURES', '${FEATURES} buildpkg'),
+			('EMERGE_DEFAULT_OPTS', '${EMERGE_DEFAULT_OPTS} --usepkg'),
+		]
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import tempfile
+import traceback
+
+from gentoobootstrap.actions.cfgchk import CheckConfigAction
+from gentoobootstrap.actions.gentoo import GentooLoader, InstallGentooAction, PrefetchAction
+from gentoobootstrap.actions.domuconfig import CreateDomUConfig
+from gentoobootstrap.actions.storage import CreateStorageAction
+from gentoobootstrap.journal import Journal
+from gentoobootstrap.scheduler import ActionScheduler
+from gentoobootstrap import report
+
+
+class Bootstrap(object):
+
+	def __init__(self, config, loader=None, resume=False, cancel=None):
+		self.config = config
+		# a GentooLoader shared with other bootstraps. If None, the actions create their own.
+		self.loader = loader
+		# continue a failed bootstrap after the phases recorded in its journal
+		self.resume = resume
+		# a threading.Event which stops the bootstrap after the running actions
+		self.cancel = cancel
+		# the error which stopped execute()
+		self.error = None
+		self.report = report.RunReport(config.name)
+
+	def check(self, actions):
+		logging.debug("Executing pre-flight checks...")
+
+		for action in actions:
+			with report.phase("%s.test" % action.__class__.__name__):
+				ok = action.test()
+			if not ok:
+				logging.error("Action '%s' failed to pass pre-execution tests" % action.__class__.__name__)
+				self.error = "Action '%s' failed to pass pre-execution tests" % action.__class__.__name__
+				return False
+
+		return True
+
+	def execute(self, install=True, personalize=True, create_config=True):
+		"""Runs all actions and returns True if the bootstrap succeeded. The timings are collected in self.report."""
+		with report.activate(self.report):
+			ok = self._execute(install, personalize, create_config)
+		self.report.finish('ok' if ok else 'failed')
+		return ok
+
+	def _execute(self, install, personalize, create_config):
+		base_dir = tempfile.mkdtemp()
+		logging.debug("Base directory: %s" % base_dir)
+
+		try:
+			check_config = CheckConfigAction(self.config)
+			if not self.check([check_config]):
+				return False
+
+			# the other actions use a snapshot of the settings, so the configuration files are evaluated once
+			config = self.config.resolve()
+
+			# the actions share one loader, so the install uses the archives prefetched while the storage is created
+			loader = self.loader or GentooLoader.from_config(config)
+
+			actions = [
+						check_config,
+						CreateStorageAction(config, loader=loader)
+			]
+
+			if install:
+				actions.append(PrefetchAction(config, loader=loader))
+				actions.append(InstallGentooAction(config, personalize=personalize, loader=loader))
+
+			if create_config:
+				actions.append(CreateDomUConfig(config))
+
+			journal = self._journal(config)
+			for action in actions:
+				action.journal = journal
+
+			if not self.check(actions[1:]):
+				return False
+
+			# a resumed bootstrap keeps the password and MAC address of the previous run
+			journal.set(root_password=config.root_password, mac_address=config.mac_address)
+
+			logging.info("Pre-execution tests passed. Starting bootstrapping")
+			logging.info("Actions: %s" % (', '.join([x.__class__.__name__ for x in actions])))
+
+			ActionScheduler(actions, cancel=self.cancel).execute()
+
+			journal.remove()
+			return True
+		except Exception as e:
+			self.error = str(e)
+			logging.error(e)
+			logging.error(traceback.format_exc())
+			return False
+		finally:
+			if os.path.exists(base_dir):
+				os.rmdir(base_dir)
+
+	def _journal(self, config):
+		journal = Journal(os.path.join(config.journal_dir, '%s.json' % config.name), load=self.resume)
+
+		if self.resume:
+			if journal.phases:
+				logging.info("Resuming %s after: %s" % (config.name, ', '.join(journal.completed())))
+			else:
+				logging.warning("No checkpoints of %s found. Starting from the beginning." % config.name)
+
+			if journal.value('root_password'):
+				config.root_pwd = journal.value('root_password')
+			if journal.value('mac_address'):
+				config._mac = journal.value('mac_address')
+
+		return journal
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class CacheEntry(object):
+
+	def __init__(self, cache, key, digest, size, etag, last_modified, last_access, verified=None):
+		self.key = key
+		self.digest = digest
+		self.size = size
+		self.etag = etag
+		self.last_modified = last_modified
+		self.last_access = last_access
+		# the upstream checksum ('<algorithm>:<hexdigest>') the file has been verified against
+		self.verified = verified
+		self.path = cache.object_path(digest)
+
+
+class DownloadCache(object):
+	"""
+	Content-addressed cache for downloaded files.
+
+	Files are stored once per content hash in objects/. A single SQLite index maps keys (usually urls) to the hash
+	and keeps the HTTP validators, the verified upstream checksum and the time of the last access. If max_size is
+	set, the least recently used entries are evicted when the cache grows beyond it.
+	"""
+
+	def __init__(self, directory, max_size=None):
+		self.directory = directory
+		self.max_size = max_size
+		self._lock = threading.Lock()
+
+		for d in [self.directory, self._objects_dir, self._tmp_dir]:
+			if not os.path.exists(d):
+				os.makedirs(d)
+
+		self.db = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=60, check_same_thread=False)
+		with self.db:
+			self.db.execute("CREATE TABLE IF NOT EXISTS entries ("
+							"key TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL, "
+							"etag TEXT, last_modified TEXT, last_access REAL NOT NULL, verified TEXT)")
+
+			# indexes created before checksums were verified
+			if 'verified' not in [row[1] for row in self.db.execute("PRAGMA table_info(entries)")]:
+				self.db.execute("ALTER TABLE entries ADD COLUMN verified TEXT")
+
+	@property
+	def _objects_dir(self):
+		return os.path.join(self.directory, 'objects')
+
+	@property
+	def _tmp_dir(self):
+		return os.path.join(self.directory, 'tmp')
+
+	def object_path(self, digest):
+		return os.path.join(self._objects_dir, digest[:2], digest)
+
+	def _tmp_file(self, key, suffix):
+		return os.path.join(self._tmp_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + suffix)
+
+	def part_file(self, key):
+		"""Returns the name of the file a download for key is written to until it is complete"""
+		return self._tmp_file(key, '.part')
+
+	@contextmanager
+	def lock(self, key):
+		"""
+		Locks key against other processes and threads. Wait for the lock before looking up or downloading key, so
+		only the first one downloads the file and all others use its result.
+		"""
+		with open(self._tmp_file(key, '.lock'), 'a') as f:
+			try:
+				fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				logging.info("Waiting for another download of %s to finish" % key)
+				fcntl.flock(f, fcntl.LOCK_EX)
+			yield
+
+	def _query(self, sql, *args):
+		with self._lock, self.db:
+			return self.db.execute(sql, args).fetchall()
+
+	def _entry(self, row):
+		return CacheEntry(self, *row)
+
+	def lookup(self, key):
+		"""Returns the CacheEntry for key or None. Entries whose file vanished or changed its size are dropped."""
+		rows = self._query("SELECT * FROM entries WHERE key = ?", key)
+		if not rows:
+			return None
+
+		entry = self._entry(rows[0])
+		if not os.path.exists(entry.path):
+			logging.debug("Cache file for %s vanished" % key)
+			self.remove(key)
+			return None
+
+		if os.path.getsize(entry.path) != entry.size:
+			logging.warning("Cache file for %s is corrupted" % key)
+			self.remove(key)
+			return None
+
+		return entry
+
+	def touch(self, key):
+		self._query("UPDATE entries SET last_access = ? WHERE key = ?", time.time(), key)
+
+	def set_verified(self, key, verified):
+		self._query("UPDATE entries SET verified = ? WHERE key = ?", verified, key)
+
+	def store(self, key, filename, digest, etag=None, last_modified=None, verified=None):
+		"""Moves filename into the cache as the content of key and returns the new CacheEntry"""
+		path = self.object_path(digest)
+		if not os.path.exists(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+
+		if os.path.exists(path):
+			# same content is already cached for another key
+			os.remove(filename)
+		else:
+			os.rename(filename, path)
+
+		old = self.lookup(key)
+		self._query("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+					key, digest, os.path.getsize(path), etag, last_modified, time.time(), verified)
+
+		if old and old.digest != digest:
+			self._remove_unreferenced(old.digest)
+
+		self.evict(keep=key)
+		return self.lookup(key)
+
+	def _remove_unreferenced(self, digest):
+		if not self._query("SELECT 1 FROM entries WHERE digest = ?", digest):
+			path = self.object_path(digest)
+			if os.path.exists(path):
+				logging.debug("Removing %s" % path)
+				os.remove(path)
+
+	def remove(self, key):
+		entry = self._query("SELECT digest FROM entries WHERE key = ?", key)
+		self._query("DELETE FROM entries WHERE key = ?", key)
+		if entry:
+			self._remove_unreferenced(entry[0][0])
+
+	def entries(self):
+		"""Returns all entries, least recently used first"""
+		return [self._entry(row) for row in self._query("SELECT * FROM entries ORDER BY last_access")]
+
+	@property
+	def size(self):
+		return self._query("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM entries)")[0][0]
+
+	def evict(self, max_size=None, keep=None):
+		"""Evicts the least recently used entries until the cache is smaller than max_size. Returns the evicted keys."""
+		max_size = max_size if max_size is not None else self.max_size
+		if max_size is None:
+			return []
+
+		evicted = []
+		for entry in self.entries():
+			if self.size <= max_size:
+				break
+			if entry.key == keep:
+				continue
+
+			logging.info("Evicting %s (%s bytes) from the cache" % (entry.key, entry.size))
+			self.remove(entry.key)
+			evicted.append(entry.key)
+
+		return evicted
+
+	def prune(self, max_size=None):
+		"""
+		Removes interrupted downloads, objects without an entry and entries without an object, then evicts.
+		Downloads which are still running are left alone.
+		"""
+		for name in os.listdir(self._tmp_dir):
+			if not name.endswith('.lock'):
+				continue
+
+			with open(os.path.join(self._tmp_dir, name), 'a') as f:
+				try:
+					fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				except BlockingIOError:
+					continue
+
+				for suffix in ['.part', '.part.state']:
+					part = os.path.join(self._tmp_dir, name[:-len('.lock')] + suffix)
+					if os.path.exists(part):
+						logging.debug("Removing %s" % part)
+						os.remove(part)
+
+		for entry in self.entries():
+			if not os.path.exists(entry.path):
+				self.remove(entry.key)
+
+		digests = set(row[0] for row in self._query("SELECT digest FROM entries"))
+		for d in os.listdir(self._objects_dir):
+			for digest in os.listdir(os.path.join(self._objects_dir, d)):
+				if digest not in digests:
+					os.remove(os.path.join(self._objects_dir, d, digest))
+
+		return self.evict(max_size)
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import collections
 import random
 import string
 import tempfile
@@ -47,12 +48,39 @@ class ConfigBase(object):
 
 		return self.root_pwd
 
+	@property
+	def storage(self):
+		"""The storage objects built from storage_specs (the (type, options, mountpoint) of each disk)"""
+		if not hasattr(self, '_storage'):
+			# the storage implementations need sh
+			from gentoobootstrap.storage import get_impl as get_storage_impl
+
+			specs = self.storage_specs
+			self._storage = None if specs is None else \
+				[(get_storage_impl(storage_type, **dict(opts)), mount) for storage_type, opts, mount in specs]
+		return self._storage
+
+	@property
+	def has_storage(self):
+		return bool(self.storage)
+
+	@property
+	def root_storage(self):
+		return next(storage for storage, mount in self.storage if mount == "/")
+
+	@property
+	def can_clone_root(self):
+		"""
+		The root storage can be cloned from a base containing the stage3 if it supports cloning and no other storage
+		is mounted below it (the base would miss the files of the other storage)
+		"""
+		return self.root_storage.can_clone() and all(not mount or mount == "/" for storage, mount in self.storage)
+
+	@property
+	def host_bridge(self):
+		return self.network[0] if self.network else None
 
-class NetworkSettings(object):
 
-	def __init__(self, config, gateway, dns_servers, domain, search):
-		self.config = config
-		self.gateway = gateway
-		self.dns_servers = dns_servers
-		self.resolv_domain = domain
-		self.resolv_search = search
+# the settings of a static network configuration
+NetworkSettings = collections.namedtuple('NetworkSettings',
+										 ['config', 'gateway', 'dns_servers', 'resolv_domain', 'resolv_search'])
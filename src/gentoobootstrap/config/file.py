@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from configparser import ConfigParser
 from cfgio.keyvalue import KeyValueConfig
 from gentoobootstrap.config.base import ConfigBase, NetworkSettings
+from gentoobootstrap.config import layers, resolved, schema
+from gentoobootstrap.config.resolved import ResolvedConfig, SnapshotConfig
 import logging
 import os
 from gentoobootstrap.size import Size
-from gentoobootstrap.storage import get_impl as get_storage_impl
 from gentoobootstrap.storage import get_impl_class as get_storage_impl_class
 
 
@@ -15,30 +15,25 @@ class FileConfig(ConfigBase):
 	def __init__(self, file, **kwargs):
 		super(FileConfig, self).__init__(**kwargs)
 		file = os.path.abspath(file)
+		self.file = file
+		self.defaults = kwargs
 		self.raw_keys = list(kwargs.keys())
 		# always pop out the inherit line in the global scope
 		self.raw_keys.append('inherit')
 		# and the configuration directory for domU configs, too
 		self.raw_keys.append('xen_config_dir')
 
-		parser = ConfigParser(defaults=kwargs)
-		# this lambda makes the keys in sections case-sensitive
-		parser.optionxform = lambda option: option
-		parser.read(file)
-
-		# if this file has an 'inherit' setting in DEFAULT, build a list of
-		# filenames and re-read the configuration (-> create a new parser)
-		inherits = parser.get('DEFAULT', 'inherit', fallback=None)
-		if inherits:
-			files = [f if os.path.isabs(f) else os.path.join(os.path.dirname(file), f) for f in inherits.split(' ')]
-			files.append(file)
-			logging.debug("Files to read after expanding 'inherit': %s" % ', '.join(files))
-			parser = ConfigParser(defaults=kwargs)
-			parser.optionxform = lambda option: option
-			parser.read(files)
-
-		self.parser = parser
+		# the files in the 'inherit' setting in DEFAULT (and the files they inherit) are read before this file.
+		# The parsed files are shared by all configs in the process.
+		chain = layers.chain(file)
+		self.files = [layer.path for layer in chain]
+		if len(self.files) > 1:
+			logging.debug("Files to read after expanding 'inherit': %s" % ', '.join(self.files))
+
+		self.parser = layers.merge(chain, kwargs)
 		self._mirrors = None
+		# the host's make.conf the mirrors have been read from
+		self._make_conf = None
 
 	def _make_list(self, value):
 		return [x.strip() for x in value.split(',')]
@@ -72,6 +67,7 @@ class FileConfig(ConfigBase):
 				for f in ['/etc/portage/make.conf', '/etc/make.conf']:
 					if os.path.exists(f):
 						make_conf = KeyValueConfig(f, values_quoted=True)
+						self._make_conf = f
 						break
 
 				if make_conf:
@@ -90,6 +86,80 @@ class FileConfig(ConfigBase):
 	def portage(self):
 		return self._get_value('bootstrap', 'portage', 'fetch')
 
+	@property
+	def download_connections(self):
+		return int(self._get_value('bootstrap', 'download_connections', 4))
+
+	@property
+	def cache_dir(self):
+		return self._get_value('bootstrap', 'cache_dir', '/var/cache/gentoo-bootstrap')
+
+	@property
+	def cache_size(self):
+		"""Maximum size of the download cache in bytes or None for an unbounded cache"""
+		size = self._get_value('bootstrap', 'cache_size', '10G')
+		return Size(size).bytes if size else None
+
+	@property
+	def verify_digests(self):
+		return self.parser.getboolean('bootstrap', 'verify', fallback=True)
+
+	@property
+	def portage_deltas(self):
+		return self.parser.getboolean('bootstrap', 'portage_deltas', fallback=False)
+
+	@property
+	def stage3_template(self):
+		return self.parser.getboolean('bootstrap', 'template', fallback=False)
+
+	@property
+	def root_overlay(self):
+		return self.parser.getboolean('bootstrap', 'overlay', fallback=False)
+
+	@property
+	def flatten_root(self):
+		return self.parser.getboolean('bootstrap', 'flatten', fallback=False)
+
+	@property
+	def stream_extract(self):
+		return self.parser.getboolean('bootstrap', 'stream', fallback=False)
+
+	@property
+	def binpkgs(self):
+		return self.parser.getboolean('bootstrap', 'binpkgs', fallback=False)
+
+	@property
+	def binpkg_dir(self):
+		return self._get_value('bootstrap', 'binpkg_dir', os.path.join(self.cache_dir, 'packages'))
+
+	@property
+	def shared_distfiles(self):
+		return self.parser.getboolean('bootstrap', 'shared_distfiles', fallback=False)
+
+	@property
+	def distfiles_dir(self):
+		return self._get_value('bootstrap', 'distfiles_dir', os.path.join(self.cache_dir, 'distfiles'))
+
+	@property
+	def log_dir(self):
+		"""Directory of the per-domU logs with the output of the chroot and post_setup. Empty disables the logs."""
+		return self._get_value('bootstrap', 'log_dir', '/var/log/gentoo-bootstrap')
+
+	@property
+	def output_tail(self):
+		"""Number of output lines kept in memory to show when the chroot or post_setup fails"""
+		return int(self._get_value('bootstrap', 'output_tail', 200))
+
+	@property
+	def journal_dir(self):
+		"""Directory of the checkpoint journals which allow to resume a failed bootstrap"""
+		return self._get_value('bootstrap', 'journal_dir', '/var/lib/gentoo-bootstrap/journal')
+
+	@property
+	def threads(self):
+		"""Maximum number of threads used for decompression and copying. 0 (the default) uses all cores"""
+		return int(self._get_value('bootstrap', 'threads', 0)) or None
+
 	@property
 	def kernel(self):
 		return self._get_value('system', 'kernel')
@@ -123,13 +193,9 @@ class FileConfig(ConfigBase):
 		return int(self._get_value('system', 'vcpu', 0))
 
 	@property
-	def has_storage(self):
-		return bool(self.storage)
-
-	@property
-	def storage(self):
-		if not hasattr(self, '_storage'):
-			self._storage = []
+	def storage_specs(self):
+		"""The (type, options, mountpoint) of each disk or None, if the storage isn't configured"""
+		if not hasattr(self, '_storage_specs'):
 			storage_layout = self._get_value('storage', 'layout')
 			storage_type = self._get_value('storage', 'type')
 
@@ -142,15 +208,18 @@ class FileConfig(ConfigBase):
 				logging.error("Storage layout '%s' not configured!" % storage_layout)
 				return None
 
+			self._storage_specs = []
+
 			no_disk = self.parser.getint(storage_section, 'disks')
 
 			global_storage_opts = dict(self.parser.items('storage'))
-			for x in ['type', 'layout', 'name']:
+			for x in ['type', 'layout', 'name', 'workers']:
 				if x in global_storage_opts:
 					del global_storage_opts[x]
 
 			for i in range(no_disk):
-				storage_impl = get_storage_impl_class(storage_type)
+				# fails for unknown storage types
+				get_storage_impl_class(storage_type)
 
 				disk_prefix = 'disk%s_' % i
 				storage_opts = {}
@@ -161,15 +230,15 @@ class FileConfig(ConfigBase):
 								if key.startswith(disk_prefix) and key != '%smount' % disk_prefix
 				]))
 
-				self._storage.append(
-					(get_storage_impl(storage_type, **storage_opts), self.parser.get(storage_section, 'disk%s_mount' % i)
-				))
+				self._storage_specs.append(
+					(storage_type, storage_opts, self.parser.get(storage_section, 'disk%s_mount' % i)))
 
-		return self._storage
+		return self._storage_specs
 
 	@property
-	def root_storage(self):
-		return next(storage for storage, mount in self.storage if mount == "/")
+	def storage_workers(self):
+		"""Maximum number of disks created and formatted at once"""
+		return int(self._get_value('storage', 'workers', 4))
 
 	@property
 	def network(self):
@@ -190,12 +259,6 @@ class FileConfig(ConfigBase):
 
 		return br, net_config
 
-	@property
-	def host_bridge(self):
-		if self.network:
-			return self.parser.get('network', 'bridge')
-		return None
-
 	@property
 	def portage_uses(self):
 		return self._section_to_list('portage_uses')
@@ -230,4 +293,32 @@ class FileConfig(ConfigBase):
 
 	@property
 	def post_setup_chroot_exec(self):
-		return self._get_value('post_setup', 'chroot_exec')
\ No newline at end of file
+		return self._get_value('post_setup', 'chroot_exec')
+
+	def validate(self, partial=False):
+		"""Returns the list of all errors in the configuration (see schema.validate)"""
+		return schema.validate(self.parser, partial)
+
+	def sources(self):
+		"""Returns the (file, mtime) of the files the settings are read from"""
+		files = [f for f in self.files if os.path.exists(f)]
+		if self._make_conf:
+			files.append(self._make_conf)
+		return [(f, os.path.getmtime(f)) for f in files]
+
+	def resolve(self):
+		"""
+		Returns a SnapshotConfig with all settings resolved into a ResolvedConfig. The snapshot is cached until one
+		of the configuration files changes.
+		"""
+		key = (self.file, tuple(sorted(self.defaults.items())))
+		snapshot = resolved.lookup(key)
+
+		if snapshot is None:
+			logging.debug("Resolving the configuration %s" % self.file)
+			# the settings are resolved before the sources: gentoo_mirrors may add the host's make.conf
+			values = dict((name, getattr(self, name)) for name in ResolvedConfig.settings)
+			snapshot = ResolvedConfig(sources=self.sources(), **values)
+			resolved.store(key, snapshot)
+
+		return SnapshotConfig(snapshot)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import threading
+from configparser import ConfigParser
+
+
+class ConfigLayer(object):
+	"""
+	The raw sections and options of one configuration file. DEFAULT is kept as a regular section, so the layers
+	can be merged in any combination. A missing file is an empty layer with mtime None.
+	"""
+
+	def __init__(self, path, mtime, sections):
+		self.path = path
+		self.mtime = mtime
+		self.sections = sections
+
+	@property
+	def inherits(self):
+		"""The absolute paths of the files in the 'inherit' setting in DEFAULT"""
+		inherit = self.sections.get('DEFAULT', {}).get('inherit', '')
+		return [os.path.normpath(os.path.join(os.path.dirname(self.path), f)) for f in inherit.split()]
+
+
+def parse(path, content, mtime=None):
+	# no default section and no interpolation: the values are interpolated by the merged parser
+	parser = ConfigParser(default_section='\0', interpolation=None)
+	# this lambda makes the keys in sections case-sensitive
+	parser.optionxform = lambda option: option
+	parser.read_string(content, source=path)
+	return ConfigLayer(path, mtime, dict((section, dict(parser.items(section))) for section in parser.sections()))
+
+
+_layers = {}
+_layers_lock = threading.Lock()
+
+
+def load(path):
+	"""
+	Returns the layer of the configuration file path. Layers are cached until their file changes, so parent
+	configs shared by many domUs are parsed only once per process.
+	"""
+	try:
+		mtime = os.path.getmtime(path)
+	except OSError:
+		# ConfigParser.read() ignores missing files, too
+		return ConfigLayer(path, None, {})
+
+	with _layers_lock:
+		layer = _layers.get(path)
+		if layer is not None and layer.mtime == mtime:
+			return layer
+
+	logging.debug("Parsing %s" % path)
+	with open(path, encoding='utf-8') as f:
+		layer = parse(path, f.read(), mtime)
+
+	with _layers_lock:
+		_layers[path] = layer
+	return layer
+
+
+def chain(path, _stack=()):
+	"""
+	Returns the layers of path and all files it inherits (transitively), parents first. A file inherited more than
+	once is included once, at its first position. Raises an exception if the files inherit each other.
+	"""
+	path = os.path.normpath(os.path.abspath(path))
+	if path in _stack:
+		raise Exception("Cyclic inherit: %s" % ' -> '.join(_stack + (path, )))
+
+	layer = load(path)
+	layers = []
+	for parent in layer.inherits:
+		for x in chain(parent, _stack + (path, )):
+			if x.path not in [l.path for l in layers]:
+				layers.append(x)
+	layers.append(layer)
+	return layers
+
+
+def merge(layers, defaults=None):
+	"""Returns a ConfigParser with the options of the layers; options of later layers override earlier ones"""
+	parser = ConfigParser(defaults=defaults)
+	parser.optionxform = lambda option: option
+	for layer in layers:
+		parser.read_dict(layer.sections, source=layer.path)
+	return parser
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+from gentoobootstrap.config.base import ConfigBase, NetworkSettings
+
+
+def _freeze(value):
+	"""Turns lists, dicts and generators into (nested) tuples"""
+	if isinstance(value, NetworkSettings):
+		return NetworkSettings(*[_freeze(x) for x in value])
+	if isinstance(value, dict):
+		return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+	if isinstance(value, (list, tuple)) or hasattr(value, '__next__'):
+		return tuple(_freeze(x) for x in value)
+	return value
+
+
+class ResolvedConfig(object):
+	"""
+	Immutable snapshot of all settings of a configuration, resolved once from the configuration files (see
+	FileConfig.resolve). Lists are stored as tuples, the storage as (type, options, mountpoint) specs.
+
+	The snapshot can be serialized with as_dict() and restored with from_dict(). sources lists the (file, mtime)
+	it was resolved from; the snapshot is outdated if one of them changed.
+	"""
+	settings = (
+		'name', 'fqdn', 'xen_config_dir',
+		'gentoo_mirrors', 'portage', 'download_connections', 'cache_dir', 'cache_size', 'verify_digests',
+		'portage_deltas', 'stage3_template', 'root_overlay', 'flatten_root', 'stream_extract', 'binpkgs', 'binpkg_dir',
+		'shared_distfiles', 'distfiles_dir', 'log_dir', 'output_tail', 'journal_dir', 'threads',
+		'kernel', 'arch', 'subarch', 'locales', 'default_locale', 'timezone', 'memory', 'vcpu', 'boot_services',
+		'merge_list', 'storage_specs', 'storage_workers', 'network', 'portage_uses', 'portage_keywords',
+		'make_conf_settings', 'layman_urls', 'layman_overlays', 'post_setup_exec', 'post_setup_chroot_exec',
+	)
+	__slots__ = settings + ('sources', )
+
+	def __init__(self, **values):
+		for name in self.__slots__:
+			object.__setattr__(self, name, _freeze(values.get(name)))
+
+	def __setattr__(self, name, value):
+		raise AttributeError("ResolvedConfig is immutable")
+
+	def __delattr__(self, name):
+		raise AttributeError("ResolvedConfig is immutable")
+
+	def is_current(self):
+		"""Returns True if none of the source files changed since the snapshot was resolved"""
+		try:
+			return all(os.path.getmtime(f) == mtime for f, mtime in self.sources)
+		except OSError:
+			return False
+
+	def as_dict(self):
+		return dict((name, getattr(self, name)) for name in self.__slots__)
+
+	@classmethod
+	def from_dict(cls, values):
+		values = dict(values)
+		# JSON turns the NetworkSettings into a list
+		if values.get('network') and values['network'][1]:
+			values['network'] = (values['network'][0], NetworkSettings(*values['network'][1]))
+		return cls(**values)
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def lookup(key):
+	"""Returns the cached snapshot for key or None, if there is none or it is outdated"""
+	with _snapshots_lock:
+		snapshot = _snapshots.get(key)
+	return snapshot if snapshot is not None and snapshot.is_current() else None
+
+
+def store(key, snapshot):
+	with _snapshots_lock:
+		_snapshots[key] = snapshot
+
+
+class SnapshotConfig(ConfigBase):
+	"""
+	The configuration the actions of a bootstrap use: the settings of a ResolvedConfig and the state of the run
+	(working directory, root password, MAC address and the storage objects).
+	"""
+
+	def __init__(self, resolved):
+		super(SnapshotConfig, self).__init__(name=resolved.name, fqdn=resolved.fqdn,
+											 xen_config_dir=resolved.xen_config_dir)
+		self.resolved = resolved
+
+	def __getattr__(self, name):
+		# only called for names which aren't attributes of the run
+		if name in ResolvedConfig.settings:
+			return getattr(self.resolved, name)
+		raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
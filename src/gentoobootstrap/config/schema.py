@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+from configparser import ConfigParser, Error as ConfigParserError
+
+from gentoobootstrap.size import Size
+from gentoobootstrap.storage.base import FORMAT_PROFILES
+
+
+def boolean(value):
+	if value.lower() not in ConfigParser.BOOLEAN_STATES:
+		raise ValueError("not a boolean: %s" % value)
+	return ConfigParser.BOOLEAN_STATES[value.lower()]
+
+
+def size(value):
+	try:
+		return Size(value).bytes
+	except Exception as ex:
+		raise ValueError(str(ex))
+
+
+class Option(object):
+	"""An option of the configuration with the type its value is converted to and the allowed values"""
+
+	def __init__(self, type=str, required=False, choices=None):
+		self.type = type
+		self.required = required
+		self.choices = choices
+
+	def check(self, value):
+		"""Returns the error message for value or None"""
+		try:
+			value = self.type(value)
+		except ValueError as ex:
+			return "invalid value '%s' (%s)" % (value, ex)
+
+		if self.choices and value not in self.choices:
+			return "invalid value '%s' (one of %s)" % (value, ', '.join(self.choices))
+		return None
+
+
+# the filesystems a disk can be formatted with
+FILESYSTEMS = ('ext2', 'ext3', 'ext4', 'xfs', 'btrfs', 'jfs', 'reiserfs', 'swap')
+
+# the [storage] options which can be overridden per disk (diskN_<option>)
+STORAGE_DISK_OPTIONS = {
+	'volume_group': Option(),
+	'thin_pool': Option(),
+	'format_profile': Option(choices=tuple(sorted(FORMAT_PROFILES))),
+	'zero_lv': Option(boolean),
+}
+
+# the options FileConfig understands per section
+SCHEMA = {
+	'bootstrap': {
+		'mirrors': Option(),
+		'portage': Option(choices=('fetch', 'squashfs', 'inherit')),
+		'portage_deltas': Option(boolean),
+		'download_connections': Option(int),
+		'cache_dir': Option(),
+		'cache_size': Option(lambda value: size(value) if value else None),
+		'verify': Option(boolean),
+		'stream': Option(boolean),
+		'template': Option(boolean),
+		'overlay': Option(boolean),
+		'flatten': Option(boolean),
+		'binpkgs': Option(boolean),
+		'binpkg_dir': Option(),
+		'shared_distfiles': Option(boolean),
+		'distfiles_dir': Option(),
+		'log_dir': Option(),
+		'output_tail': Option(int),
+		'journal_dir': Option(),
+		'threads': Option(int),
+	},
+	'system': {
+		'arch': Option(required=True),
+		'subarch': Option(),
+		'kernel': Option(),
+		'locales': Option(),
+		'default_locale': Option(),
+		'timezone': Option(),
+		'memory': Option(int),
+		'vcpu': Option(int),
+		'boot_services': Option(),
+		'merge_list': Option(),
+	},
+	'storage': dict({
+		'type': Option(required=True, choices=('lvm', 'filesystem')),
+		'layout': Option(required=True),
+		'workers': Option(int),
+	}, **STORAGE_DISK_OPTIONS),
+	'network': {
+		'bridge': Option(required=True),
+		'config': Option(),
+		'gateway': Option(),
+		'dns_servers': Option(),
+		'resolv_domain': Option(),
+		'resolv_search': Option(),
+	},
+	'layman': {
+		'overlays': Option(),
+		'add_overlays': Option(),
+	},
+	'post_setup': {
+		'exec': Option(),
+		'chroot_exec': Option(),
+	},
+}
+
+# sections with arbitrary options
+OPEN_SECTIONS = ('portage_uses', 'portage_keywords', 'make.conf')
+
+# the options of each disk in a storage_<layout> section (diskN_<option>)
+DISK_SCHEMA = dict({
+	'mount': Option(required=True),
+	'size': Option(size),
+	'fs': Option(choices=FILESYSTEMS),
+	'name': Option(),
+	'device': Option(),
+	'domu_device': Option(),
+	'opts': Option(),
+}, **STORAGE_DISK_OPTIONS)
+
+
+def _options(parser, section):
+	"""Returns the options of section without the defaults (the name, fqdn and inherit of the domU)"""
+	return [option for option in parser.options(section) if option not in parser.defaults()]
+
+
+def _check(errors, parser, section, option, schema):
+	try:
+		value = parser.get(section, option)
+	except ConfigParserError as ex:
+		errors.append("[%s] %s: %s" % (section, option, ex.message))
+		return
+
+	error = schema.check(value)
+	if error:
+		errors.append("[%s] %s: %s" % (section, option, error))
+
+
+def _require(errors, parser, section, option, hint=''):
+	if not parser.has_option(section, option):
+		errors.append("[%s] %s: missing%s" % (section, option, hint))
+
+
+def _validate_layout(errors, parser, section, required):
+	if not parser.has_option(section, 'disks'):
+		if required:
+			_require(errors, parser, section, 'disks')
+		return
+
+	disks = parser.get(section, 'disks', raw=True)
+	if not disks.isdigit():
+		errors.append("[%s] disks: invalid value '%s'" % (section, disks))
+		return
+	disks = int(disks)
+
+	for option in _options(parser, section):
+		if option == 'disks':
+			continue
+		prefix, _, name = option.partition('_')
+		if not (prefix.startswith('disk') and prefix[4:].isdigit() and int(prefix[4:]) < disks and name):
+			errors.append("[%s] %s: unknown option (expected disk0_ to disk%s_<option>)" % (section, option, disks - 1))
+		elif name in DISK_SCHEMA:
+			_check(errors, parser, section, option, DISK_SCHEMA[name])
+		else:
+			errors.append("[%s] %s: unknown option" % (section, option))
+
+	if not required:
+		return
+
+	storage_type = parser.get('storage', 'type', raw=True, fallback=None)
+	for i in range(disks):
+		_require(errors, parser, section, 'disk%s_mount' % i)
+		if storage_type == 'lvm':
+			_require(errors, parser, section, 'disk%s_size' % i, " (required for lvm)")
+			_require(errors, parser, section, 'disk%s_name' % i, " (required for lvm)")
+			if not parser.has_option('storage', 'volume_group'):
+				_require(errors, parser, section, 'disk%s_volume_group' % i, " (or volume_group in [storage])")
+		elif storage_type == 'filesystem':
+			_require(errors, parser, section, 'disk%s_device' % i, " (required for filesystem)")
+
+
+def validate(parser, partial=False):
+	"""
+	Validates the configuration in parser against SCHEMA and returns the list of all errors. Nothing is created or
+	read from the host. A partial configuration (e.g. a file inherited by the domU configs) may miss required
+	options and sections.
+	"""
+	errors = []
+	required = not partial
+
+	for section in parser.sections():
+		if section in SCHEMA:
+			for option in _options(parser, section):
+				if option in SCHEMA[section]:
+					_check(errors, parser, section, option, SCHEMA[section][option])
+				elif section not in OPEN_SECTIONS:
+					errors.append("[%s] %s: unknown option" % (section, option))
+		elif section not in OPEN_SECTIONS and not section.startswith('storage_'):
+			errors.append("[%s]: unknown section" % section)
+
+	if required:
+		for section in ['system', 'storage']:
+			if not parser.has_section(section):
+				errors.append("[%s]: missing" % section)
+				continue
+
+			for option, schema in SCHEMA[section].items():
+				if schema.required:
+					_require(errors, parser, section, option)
+
+		if parser.has_section('network'):
+			_require(errors, parser, 'network', 'bridge')
+			if parser.get('network', 'config', raw=True, fallback='auto') != 'auto':
+				_require(errors, parser, 'network', 'gateway', " (required for a static network configuration)")
+
+	layout = parser.get('storage', 'layout', raw=True, fallback=None) if parser.has_section('storage') else None
+	if layout:
+		section = 'storage_%s' % layout
+		if parser.has_section(section):
+			_validate_layout(errors, parser, section, required)
+		elif required:
+			errors.append("[%s]: missing (storage layout '%s')" % (section, layout))
+
+	return errors
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gentoobootstrap.api import JobServer, FINISHED
+from gentoobootstrap.batch import BatchBootstrap, BatchJob
+
+
+class DaemonJob(BatchJob):
+
+	def __init__(self, id, name, fqdn, config, options, xen_config_dir=None):
+		super(DaemonJob, self).__init__(name, fqdn, config, xen_config_dir)
+		self.id = id
+		self.options = options
+		self.submitted = time.time()
+
+	def as_dict(self, report=True):
+		d = super(DaemonJob, self).as_dict()
+		d.update(id=self.id, options=self.options, submitted=self.submitted)
+		if not report:
+			del d['report']
+		return d
+
+
+class BootstrapDaemon(BatchBootstrap):
+	"""
+	Runs the bootstraps submitted over the job API (see api.JobServer), at most workers at once. The daemon keeps
+	its caches between the jobs: the GentooLoaders (mirror ranking and download cache), the parsed configuration
+	files and the resolved configurations.
+
+	A queued job is cancelled right away, a running one after its running actions finished. It can be resumed
+	with the resume option.
+	"""
+	options = ('install', 'personalize', 'create_config', 'resume')
+
+	def __init__(self, socket_path, workers=4, xen_config_dir='/etc/xen'):
+		super(BootstrapDaemon, self).__init__([], workers=workers, xen_config_dir=xen_config_dir)
+		self.socket_path = socket_path
+		self._executor = ThreadPoolExecutor(max_workers=workers)
+		self._futures = {}
+		self._ids = itertools.count(1)
+		self._jobs_lock = threading.Lock()
+		self.server = None
+
+	def submit(self, name, fqdn, config, xen_config_dir=None, **options):
+		"""Queues a bootstrap. xen_config_dir overrides the directory of the daemon for the xen configuration."""
+		if not os.path.exists(config):
+			raise Exception("Configuration file %s doesn't exist" % config)
+		if xen_config_dir is not None and not os.path.isabs(xen_config_dir):
+			raise Exception("The xen configuration directory must be an absolute path: %s" % xen_config_dir)
+
+		unknown = set(options) - set(self.options)
+		if unknown:
+			raise Exception("Unknown option(s): %s" % ', '.join(sorted(unknown)))
+		options = dict((option, bool(options.get(option, option != 'resume'))) for option in self.options)
+
+		with self._jobs_lock:
+			if any(job.name == name and job.status not in FINISHED for job in self.jobs):
+				raise Exception("%s is being bootstrapped already" % name)
+
+			job = DaemonJob(next(self._ids), name, fqdn, config, options, xen_config_dir)
+			self.jobs.append(job)
+			self._futures[job.id] = self._executor.submit(self._run, job, options['install'], options['personalize'],
+														  options['create_config'], options['resume'])
+
+		logging.info("Job %s: bootstrapping %s (%s) with %s" % (job.id, name, fqdn, config))
+		return job
+
+	def job(self, id):
+		job = next((job for job in self.jobs if job.id == id), None)
+		if job is None:
+			raise Exception("No job with id %s" % id)
+		return job
+
+	def cancel(self, id):
+		job = self.job(id)
+		if job.status in FINISHED:
+			return job
+
+		job.cancel.set()
+		if self._futures[id].cancel():
+			job.status = 'cancelled'
+		logging.info("Job %s: cancelling %s" % (id, job.name))
+		return job
+
+	def handle(self, request):
+		"""Handles a request of the job API and returns the response"""
+		try:
+			command = request.get('command')
+
+			if command == 'submit':
+				missing = [x for x in ['name', 'fqdn', 'config'] if not request.get(x)]
+				if missing:
+					raise Exception("Missing argument(s): %s" % ', '.join(missing))
+				args = dict((k, v) for k, v in request.items() if k not in ('command', 'name', 'fqdn', 'config'))
+				job = self.submit(request['name'], request['fqdn'], request['config'], **args)
+				return {'ok': True, 'job': job.as_dict()}
+			elif command == 'query':
+				if request.get('id') is not None:
+					return {'ok': True, 'job': self.job(request['id']).as_dict()}
+				return {'ok': True, 'jobs': [job.as_dict(report=False) for job in list(self.jobs)]}
+			elif command == 'cancel':
+				return {'ok': True, 'job': self.cancel(request.get('id')).as_dict()}
+
+			raise Exception("Unknown command '%s'" % command)
+		except Exception as ex:
+			return {'ok': False, 'error': str(ex)}
+
+	def serve_forever(self):
+		self.server = JobServer(self.socket_path, self.handle)
+		logging.info("Listening on %s, running up to %s bootstrap(s) at once" % (self.socket_path, self.workers))
+
+		try:
+			self.server.serve_forever()
+		finally:
+			self.server.server_close()
+			self.shutdown()
+
+	def shutdown(self):
+		"""Cancels the queued and running jobs and waits for the running ones"""
+		for job in list(self.jobs):
+			if job.status not in FINISHED:
+				self.cancel(job.id)
+		self._executor.shutdown(wait=True)
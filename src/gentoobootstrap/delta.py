@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import datetime
+import re
+
+
+# the daily portage snapshots and the patches between them, relative to a mirror (see emerge-delta-webrsync)
+SNAPSHOT_PATH = 'snapshots/portage-%s.tar.bz2'
+DELTA_PATH = 'snapshots/deltas/snapshot-%s-%s.patch.bz2'
+
+# how many days back the latest dated snapshot is searched for if there is no base snapshot
+MAX_AGE = 7
+
+
+def _format(date):
+	return date.strftime('%Y%m%d')
+
+
+def snapshot_path(date):
+	return SNAPSHOT_PATH % _format(date)
+
+
+def snapshot_date(path):
+	"""Returns the date of a dated snapshot path (e.g. a cache key) or None"""
+	m = re.match(r'^snapshots/portage-(\d{8})\.tar\.bz2$', path)
+	return datetime.datetime.strptime(m.group(1), '%Y%m%d').date() if m else None
+
+
+def delta_paths(base, target):
+	"""Returns the paths of the daily patches which turn the snapshot from base into the one from target"""
+	days = (target - base).days
+	return [DELTA_PATH % (_format(base + datetime.timedelta(days=i)), _format(base + datetime.timedelta(days=i + 1)))
+			for i in range(days)]
+
+
+def candidate_dates(base=None, today=None):
+	"""Returns the dates the latest snapshot may be from, newest first: today back to the day after base"""
+	today = today or datetime.date.today()
+	earliest = base + datetime.timedelta(days=1) if base else today - datetime.timedelta(days=MAX_AGE)
+	return [today - datetime.timedelta(days=i) for i in range((today - earliest).days + 1)]
+
+
+def latest_base(keys):
+	"""Returns the newest (date, key) of the dated snapshots in keys or None"""
+	dated = [(snapshot_date(key), key) for key in keys if snapshot_date(key)]
+	return max(dated) if dated else None
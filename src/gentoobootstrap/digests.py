@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import re
+
+
+# algorithms in order of preference. The names are the ones used in hashlib.
+ALGORITHMS = ['sha512', 'blake2b', 'sha256', 'sha1', 'md5']
+
+
+def parse_digests(content, filename):
+	"""
+	Parses the content of a catalyst .DIGESTS file and returns the strongest (algorithm, hexdigest) for filename
+	or None, if filename is not listed.
+
+	A .DIGESTS file contains blocks of a '# <ALGORITHM> HASH' line followed by '<hexdigest>  <filename>' lines.
+	"""
+	found = {}
+	algorithm = None
+
+	for line in content.split('\n'):
+		line = line.strip()
+		m = re.match(r'^#\s*(\w+)\s+HASH$', line, re.IGNORECASE)
+		if m:
+			algorithm = m.group(1).lower()
+			continue
+
+		m = re.match(r'^([0-9a-f]+)\s+\*?(\S+)$', line, re.IGNORECASE)
+		if m and algorithm in ALGORITHMS and m.group(2) == filename:
+			found[algorithm] = m.group(1).lower()
+
+	return next(((a, found[a]) for a in ALGORITHMS if a in found), None)
+
+
+def parse_md5sum(content, filename):
+	"""
+	Parses the output of md5sum and returns ('md5', hexdigest) for filename or None. If the file contains a single
+	checksum, it is used regardless of the file name (snapshots may list their dated name).
+	"""
+	found = {}
+	for line in content.split('\n'):
+		m = re.match(r'^([0-9a-f]{32})\s+\*?(\S+)$', line.strip(), re.IGNORECASE)
+		if m:
+			found[m.group(2)] = m.group(1).lower()
+
+	if filename in found:
+		return 'md5', found[filename]
+	if len(found) == 1:
+		return 'md5', list(found.values())[0]
+	return None
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from sh import cp
+
+from gentoobootstrap.loader import CHUNK_SIZE
+
+
+# the DISTDIR inside the chroot
+CHROOT_DISTDIR = '/var/cache/distfiles'
+
+# the distfiles are group-writable, so the portage user of every chroot can fetch into them
+DISTDIR_MODE = 0o2775
+
+
+def blake2b_file(filename):
+	h = hashlib.blake2b()
+	with open(filename, 'rb') as f:
+		for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+			h.update(chunk)
+	return h.hexdigest()
+
+
+def is_distfile(name):
+	"""False for the lock directory and the temporary and broken files portage leaves in DISTDIR"""
+	return not (name.startswith('.') or name.endswith('.__download__') or '._checksum_failure_.' in name)
+
+
+class DistfilesIndex(object):
+	"""
+	Shared DISTDIR of all chroots with an index of the files in it. The index keeps the size, mtime and BLAKE2B hash
+	of every complete distfile; a file whose content no longer matches its hash is reported by verify().
+
+	Portage's distlocks (a .locks directory in DISTDIR) keep concurrent chroots from fetching the same file twice.
+	"""
+
+	def __init__(self, directory):
+		self.directory = directory
+		self._lock = threading.Lock()
+
+		if not os.path.exists(self.directory):
+			os.makedirs(self.directory)
+			os.chmod(self.directory, DISTDIR_MODE)
+
+		self.db = sqlite3.connect(os.path.join(self.directory, '.index.sqlite'), timeout=60, check_same_thread=False)
+		with self.db:
+			self.db.execute("CREATE TABLE IF NOT EXISTS distfiles ("
+							"name TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, blake2b TEXT NOT NULL)")
+
+	def _query(self, sql, *args):
+		with self._lock, self.db:
+			return self.db.execute(sql, args).fetchall()
+
+	def path(self, name):
+		return os.path.join(self.directory, name)
+
+	def entries(self):
+		"""Returns (name, size, mtime, blake2b) of all indexed distfiles"""
+		return self._query("SELECT * FROM distfiles ORDER BY name")
+
+	def _add(self, name):
+		stat = os.stat(self.path(name))
+		self._query("INSERT OR REPLACE INTO distfiles VALUES (?, ?, ?, ?)",
+					name, stat.st_size, stat.st_mtime, blake2b_file(self.path(name)))
+
+	def scan(self):
+		"""Adds new and changed distfiles to the index and drops vanished ones. Returns the names of the added files."""
+		indexed = dict((name, (size, mtime)) for name, size, mtime, _ in self.entries())
+		added = []
+
+		for name in os.listdir(self.directory):
+			if not is_distfile(name) or not os.path.isfile(self.path(name)):
+				continue
+
+			stat = os.stat(self.path(name))
+			if indexed.pop(name, None) != (stat.st_size, stat.st_mtime):
+				logging.debug("Indexing distfile %s" % name)
+				self._add(name)
+				added.append(name)
+
+		for name in indexed:
+			logging.debug("Distfile %s vanished" % name)
+			self._query("DELETE FROM distfiles WHERE name = ?", name)
+
+		return added
+
+	def verify(self, remove=False):
+		"""Returns the names of the distfiles which don't match the index. If remove is True, they are removed."""
+		broken = []
+		for name, size, mtime, digest in self.entries():
+			if not os.path.exists(self.path(name)) or os.path.getsize(self.path(name)) != size \
+					or blake2b_file(self.path(name)) != digest:
+				logging.warning("Distfile %s doesn't match the index" % name)
+				broken.append(name)
+
+				if remove:
+					if os.path.exists(self.path(name)):
+						os.remove(self.path(name))
+					self._query("DELETE FROM distfiles WHERE name = ?", name)
+
+		return broken
+
+	def missing(self, names):
+		"""Returns the names which are not in the index"""
+		indexed = set(row[0] for row in self._query("SELECT name FROM distfiles"))
+		return [name for name in names if name not in indexed]
+
+	def add(self, name, filename):
+		"""Adds the file filename (e.g. from the download cache) as distfile name"""
+		tmp = self.path('.%s.tmp' % name)
+		# the distfile must not share the inode of the cache file, which the chmod would change, too. Reflinks
+		# don't need space, but the download cache may be on another filesystem.
+		cp('--reflink=auto', '--', filename, tmp)
+		os.chmod(tmp, 0o664)
+		os.rename(tmp, self.path(name))
+		self._add(name)
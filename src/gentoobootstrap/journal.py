@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Journal(object):
+	"""
+	Checkpoint journal of a bootstrap. It records the phases which have been completed (with optional data) and
+	values which must stay the same when the bootstrap is resumed (e.g. the root password). The journal is
+	written after every change, so it survives a failed run.
+	"""
+
+	def __init__(self, filename, load=True):
+		self.filename = filename
+		self.phases = {}
+		self.values = {}
+		self._lock = threading.Lock()
+
+		# a new bootstrap doesn't load the journal, it is overwritten with the first checkpoint
+		if load and os.path.exists(filename):
+			with open(filename) as f:
+				content = json.load(f)
+			self.phases = content.get('phases', {})
+			self.values = content.get('values', {})
+
+	def is_done(self, phase):
+		return phase in self.phases
+
+	def get(self, phase):
+		"""Returns the data recorded with phase or None, if phase hasn't been completed"""
+		return self.phases.get(phase)
+
+	def completed(self, prefix=''):
+		"""Returns the completed phases starting with prefix (without it) in the order they were completed"""
+		return [phase[len(prefix):] for phase in self.phases if phase.startswith(prefix)]
+
+	def mark(self, phase, **data):
+		"""Records phase as completed"""
+		logging.debug("Checkpoint: %s" % phase)
+		with self._lock:
+			self.phases[phase] = dict(data, time=time.time())
+			self._save()
+
+	def value(self, key):
+		return self.values.get(key)
+
+	def set(self, **values):
+		with self._lock:
+			self.values.update(values)
+			self._save()
+
+	def _save(self):
+		directory = os.path.dirname(self.filename)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory, exist_ok=True)
+
+		# the journal contains the root password
+		tmp = "%s.tmp" % self.filename
+		fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+		with os.fdopen(fd, 'w') as f:
+			json.dump({'phases': self.phases, 'values': self.values}, f, indent=4)
+		os.rename(tmp, self.filename)
+
+	def remove(self):
+		with self._lock:
+			self.phases, self.values = {}, {}
+			if os.path.exists(self.filename):
+				os.remove(self.filename)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from gentoobootstrap.config.file import FileConfig
+
+
+# the name and fqdn the configurations are read with (they may use %(name)s and %(fqdn)s)
+LINT_DEFAULTS = {'name': 'lint', 'fqdn': 'lint.example.com'}
+
+
+def find_configs(paths):
+	"""Returns the configuration files in paths. Directories are searched recursively for *.cfg files."""
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			for root, dirs, names in os.walk(path):
+				files.extend(os.path.join(root, name) for name in names if name.endswith('.cfg'))
+		else:
+			files.append(path)
+	return sorted(os.path.abspath(f) for f in files)
+
+
+def _read(filename):
+	try:
+		return FileConfig(filename, **LINT_DEFAULTS), None
+	except Exception as ex:
+		return None, str(ex)
+
+
+def lint(files, workers=None):
+	"""
+	Validates the configuration files in parallel and returns a dict with the list of errors of each file. Files
+	inherited by other files in the list are partial configurations, which may miss required options.
+	"""
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		configs = dict(zip(files, executor.map(_read, files)))
+
+		inherited = set()
+		for config, error in configs.values():
+			if config:
+				inherited.update(os.path.normpath(f) for f in config.files[:-1])
+
+		def validate(filename):
+			config, error = configs[filename]
+			if error:
+				return [error]
+			if not os.path.exists(filename):
+				return ["No such file"]
+			errors = ["inherited file %s doesn't exist" % f for f in config.files[:-1] if not os.path.exists(f)]
+			return errors + config.validate(partial=filename in inherited)
+
+		results = dict(zip(files, executor.map(validate, files)))
+
+	logging.debug("Validated %s file(s), %s inherited by others" % (len(files), len(inherited & set(files))))
+	return results
@@ -1,80 +1,596 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import json
 import logging
 import os
-from urllib.error import HTTPError
+import re
+import threading
+import time
+import traceback
+from http.client import HTTPException
+from queue import Queue, Empty
+from urllib.error import HTTPError, URLError
 from urllib.request import Request, build_opener
-import json
+from gentoobootstrap import report
+from gentoobootstrap.cache import DownloadCache
 
 
-class Loader(object):
+CHUNK_SIZE = 64 * 1024
 
-	def __init__(self, cache_dir="/tmp"):
-		self.cache_dir = cache_dir
 
-	def load_meta(self, f):
+def split_segments(offset, total, segment_size):
+	"""
+	Splits the byte range [offset, total) into a list of (start, end) tuples with an inclusive end, suitable for
+	HTTP Range headers.
+	"""
+	return [(start, min(start + segment_size, total) - 1) for start in range(offset, total, segment_size)]
+
+
+class SegmentError(Exception):
+	"""The source can't deliver segments (e.g. it ignores range requests). Retrying the source doesn't help."""
+	pass
+
+
+class SlowSegmentError(Exception):
+	"""The source fell behind the minimum throughput for a segment. written bytes of the segment have been written."""
+
+	def __init__(self, message, written):
+		super(SlowSegmentError, self).__init__(message)
+		self.written = written
+
+
+class ChecksumError(Exception):
+	pass
+
+
+def is_network_error(error):
+	"""
+	Returns True if error comes from the connection to the server or the HTTP exchange (e.g. a refused connection, a
+	timeout or a 404) rather than from the local system or the content of the file.
+	"""
+	return isinstance(error, (URLError, HTTPException, ConnectionError, TimeoutError, SegmentError, SlowSegmentError))
+
+
+def hash_file(filename, algorithm):
+	h = hashlib.new(algorithm)
+	with open(filename, 'rb') as f:
+		for x in iter(lambda: f.read(CHUNK_SIZE), b''):
+			h.update(x)
+	return h.hexdigest()
+
+
+class DownloadProgress(object):
+	"""
+	Tracks which bytes of a download have been written. Segments arrive out of order, so the progress is the
+	watermark up to which the file is complete.
+	"""
+
+	def __init__(self):
+		self._cond = threading.Condition()
+		self._pieces = {}
+		self.watermark = 0
+		self.finished = False
+		self.error = None
+
+	def add(self, offset, length):
+		with self._cond:
+			self._pieces[offset] = offset + length
+			while self.watermark in self._pieces:
+				self.watermark = self._pieces.pop(self.watermark)
+			self._cond.notify_all()
+
+	def finish(self, error=None):
+		with self._cond:
+			self.finished = True
+			self.error = error
+			self._cond.notify_all()
+
+	def wait(self, position):
+		"""Blocks until the bytes at position are available. Returns the watermark or None at the end of the file."""
+		with self._cond:
+			while self.watermark <= position and not self.finished:
+				self._cond.wait()
+
+			if self.error:
+				raise Exception("Download failed: %s" % self.error)
+			return self.watermark if self.watermark > position else None
+
+
+class StreamReader(object):
+	"""Reads a file in order while it is being downloaded"""
+
+	def __init__(self, filename, progress):
+		self.filename = filename
+		self.progress = progress
+
+	def __iter__(self):
+		position = 0
+		with open(self.filename, 'rb') as f:
+			while True:
+				available = self.progress.wait(position)
+				if available is None:
+					return
+
+				f.seek(position)
+				x = f.read(min(CHUNK_SIZE, available - position))
+				position += len(x)
+				yield x
+
+
+class PartialDownload(object):
+	"""
+	A download into a .part file. The byte ranges which have been written are kept in a state file next to it,
+	so an interrupted download can be resumed.
+	"""
+
+	def __init__(self, part_file):
+		self.part_file = part_file
+		self.state_file = "%s.state" % part_file
+		self._lock = threading.Lock()
+		self.etag = None
+		self.last_modified = None
+		self.total = None
+		self.done = []
+
+	@property
+	def validator(self):
+		"""The value for the If-Range header. Weak ETags must not be used with If-Range."""
+		if self.etag and not self.etag.startswith('W/'):
+			return self.etag
+		return self.last_modified
+
+	def load(self):
+		"""Loads the state of an interrupted download. Returns False if there is nothing to resume."""
 		try:
-			with open(f, 'r') as i:
-				return json.load(i)
+			with open(self.state_file, 'r') as i:
+				state = json.load(i)
 		except:
-			return {
-				'last-modified': None,
-				'etag': None
-			}
+			return False
 
-	def save_meta(self, meta, f):
-		with open(f, 'w') as o:
-			json.dump(meta, o)
+		if not os.path.exists(self.part_file) or os.path.getsize(self.part_file) != state['total']:
+			return False
 
-	def download(self, url):
-		cache_file = os.path.join(self.cache_dir, os.path.basename(url))
-		meta_file = "%s.meta" % cache_file
-		logging.debug("Cache file: %s" % cache_file)
+		self.etag = state['etag']
+		self.last_modified = state['last_modified']
+		self.total = state['total']
+		self.done = [tuple(x) for x in state['done']]
+		return bool(self.validator)
 
-		if os.path.exists(meta_file) and not os.path.exists(cache_file):
-			os.remove(meta_file)
+	def start(self, etag, last_modified, total):
+		self.etag = etag
+		self.last_modified = last_modified
+		self.total = total
+		self.done = []
+		self.save()
 
-		meta = self.load_meta(meta_file)
+	def add(self, start, end):
+		with self._lock:
+			self.done.append((start, end))
+			self.save()
 
-		request = Request(url)
-		if meta.get('last-modified', None):
-			logging.debug("Last-Modified: %s" % meta['last-modified'])
-			request.add_header('If-Modified-Since', meta['last-modified'])
+	def save(self):
+		tmp_file = "%s.tmp" % self.state_file
+		with open(tmp_file, 'w') as o:
+			json.dump({
+				'etag': self.etag,
+				'last_modified': self.last_modified,
+				'total': self.total,
+				'done': self.done,
+			}, o)
+		os.rename(tmp_file, self.state_file)
+
+	def missing(self):
+		"""Returns the byte ranges (start, end) which have not been written yet"""
+		missing = []
+		position = 0
+		for start, end in sorted(self.done):
+			if start > position:
+				missing.append((position, start - 1))
+			position = max(position, end + 1)
+		if position < self.total:
+			missing.append((position, self.total - 1))
+		return missing
 
-		if meta.get('etag', None):
-			logging.debug("Etag: %s" % meta['etag'])
-			request.add_header('If-None-Match', meta['etag'])
+	def remove(self, keep_part=False):
+		for f in [self.state_file] if keep_part else [self.state_file, self.part_file]:
+			if os.path.exists(f):
+				os.remove(f)
 
 
+class Loader(object):
+
+	def __init__(self, cache_dir="/tmp", connections=4, segment_size=8 * 1024 * 1024, timeout=30, cache_size=None,
+				 retries=3, retry_delay=1.0, min_throughput=64 * 1024):
+		self.cache_dir = cache_dir
+		self.cache = DownloadCache(cache_dir, cache_size)
+		self.connections = max(1, connections)
+		self.segment_size = segment_size
+		self.timeout = timeout
+		# number of failed segments after which a source is given up and the delay before the first retry,
+		# which doubles with each further failure
+		self.retries = retries
+		self.retry_delay = retry_delay
+		# bytes per second below which a segment is given back to the queue if other sources are available
+		# (None never gives segments back)
+		self.min_throughput = min_throughput
+
+	def report_throughput(self, source, bytes_read, seconds):
+		"""Called after bytes_read bytes have been fetched from source. Sub-classes may override this method."""
+		pass
+
+	def report_failure(self, source):
+		"""Called when fetching from source failed. Sub-classes may override this method."""
+		pass
+
+	def _request(self, url, headers=None):
+		request = Request(url)
 		request.add_header('Accept', 'application/octect-stream')
 		request.add_header('User-Agent', 'gentoo-bootstrap/0.1')
+		for k, v in (headers or {}).items():
+			request.add_header(k, v)
+		return request
+
+	def _open(self, url, headers=None):
+		return build_opener().open(self._request(url, headers), timeout=self.timeout)
+
+	def _total_size(self, response):
+		"""Returns the full size of the resource from a 206 response or None if unknown"""
+		m = re.match(r'^bytes\s+\d+-\d+/(\d+)$', response.headers.get('Content-Range', '').strip())
+		return int(m.group(1)) if m else None
+
+	def _copy(self, response, fd, offset, length=None, progress=None, stop=None):
+		"""
+		Copies the body of response to fd starting at offset and returns the number of bytes written. stop is called
+		with the number of bytes written after each chunk; the copy ends early if it returns True.
+		"""
+		written = 0
+		while length is None or written < length:
+			x = response.read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length - written))
+			if not x:
+				break
+			os.pwrite(fd, x, offset + written)
+			if progress:
+				progress.add(offset + written, len(x))
+			written += len(x)
+			if stop and (length is None or written < length) and stop(written):
+				break
+		return written
+
+	def _fetch_segment(self, source, fd, start, end, total, progress=None, alternatives=None):
+		"""
+		Fetches the bytes start-end from source. If the source falls behind min_throughput and alternatives() returns
+		True (i.e. other sources are available), the segment is aborted with a SlowSegmentError.
+		"""
+		headers = {'Range': 'bytes=%s-%s' % (start, end)}
+		started = time.time()
+		length = end - start + 1
+		deadline = started + length / float(self.min_throughput) if self.min_throughput and alternatives else None
+
+		def too_slow(written):
+			return time.time() > deadline and alternatives()
+
+		with self._open(source, headers) as response:
+			if response.status != 206 or self._total_size(response) != total:
+				raise SegmentError("%s did not honor the range request for bytes %s-%s" % (source, start, end))
+
+			written = self._copy(response, fd, start, length, progress, too_slow if deadline else None)
+			if written != length:
+				if deadline and time.time() > deadline:
+					raise SlowSegmentError("%s is too slow for bytes %s-%s (%s bytes in %.1fs)" % (
+											source, start, end, written, time.time() - started), written)
+				raise IOError("Short read from %s for bytes %s-%s" % (source, start, end))
+		self.report_throughput(source, length, time.time() - started)
+
+	def _is_permanent(self, error):
+		"""Returns True if a source which failed with error won't deliver on a retry"""
+		if isinstance(error, SegmentError):
+			return True
+		# client errors (e.g. 404) are permanent, server errors (e.g. 503) are not
+		return isinstance(error, HTTPError) and 400 <= error.code < 500 and error.code not in (408, 429)
+
+	def _fetch_segments(self, sources, fd, segments, total, progress=None, partial=None):
+		"""
+		Fetches all segments in parallel. Each worker is bound to one source and pulls segments from a shared queue,
+		so a fast mirror takes more segments than a slow one. A worker that fails puts its segment back into the queue
+		and retries after a delay, which doubles with each failure of the source. After retries failures (or a
+		permanent error), the source is given up and its segments are picked up by the workers of the other mirrors.
+		A segment which is fetched slower than min_throughput counts as a failure, too, and its remaining bytes are
+		put back into the queue for the other mirrors, unless the source is the last one.
+		"""
+		pending = Queue()
+		for segment in segments:
+			pending.put(segment)
+
+		live_sources = list(sources)
+		failures = dict((source, 0) for source in sources)
+		lock = threading.Lock()
+
+		def others_live():
+			with lock:
+				return len(live_sources) > 1
+
+		def worker(source):
+			while True:
+				with lock:
+					if source not in live_sources:
+						return
+				try:
+					start, end = pending.get_nowait()
+				except Empty:
+					return
+
+				try:
+					self._fetch_segment(source, fd, start, end, total, progress, alternatives=others_live)
+					if partial:
+						partial.add(start, end)
+				except Exception as ex:
+					logging.warning("Fetching bytes %s-%s from %s failed: %s" % (start, end, source, ex))
+					# a slow source has written the beginning of the segment already
+					written = getattr(ex, 'written', 0)
+					if written and partial:
+						partial.add(start, start + written - 1)
+					pending.put((start + written, end))
+
+					with lock:
+						failures[source] += 1
+						failed = failures[source]
+						retry = failed <= self.retries and not self._is_permanent(ex)
+						# the other workers of the source may have given it up already
+						give_up = not retry and source in live_sources
+						if give_up:
+							live_sources.remove(source)
+
+					if give_up:
+						logging.warning("Giving up %s after %s failure(s)" % (source, failed))
+						self.report_failure(source)
+					if not retry:
+						return
+
+					time.sleep(self.retry_delay * 2 ** (failed - 1))
+
+		while not pending.empty():
+			if not live_sources:
+				raise Exception("All sources failed to deliver the remaining %s segment(s)" % pending.qsize())
+
+			workers = [threading.Thread(target=worker, args=(live_sources[i % len(live_sources)], ), daemon=True)
+						for i in range(min(self.connections, pending.qsize()))]
+			for t in workers:
+				t.start()
+			for t in workers:
+				t.join()
+
+	def _start_consumer(self, consumer, cache_file, progress):
+		"""Runs consumer in a separate thread and returns a function which waits for it to finish"""
+		errors = []
+
+		def run():
+			try:
+				consumer(StreamReader(cache_file, progress))
+			except Exception as ex:
+				errors.append(ex)
+				logging.debug(traceback.format_exc())
+
+		t = threading.Thread(target=run, daemon=True)
+		t.start()
+
+		def join():
+			t.join()
+			if errors:
+				raise errors[0]
+		return join
+
+	def _feed(self, consumer, cache_file):
+		"""Passes an already complete cache file to consumer"""
+		progress = DownloadProgress()
+		progress.add(0, os.path.getsize(cache_file))
+		progress.finish()
+		consumer(StreamReader(cache_file, progress))
+
+	def _cached(self, key, checksum):
+		"""
+		Returns the cache entry for key. If checksum is given, the entry is checked against it: files which have been
+		verified against the checksum before are trusted, files which have never been verified are verified now and
+		files which don't match are dropped from the cache.
+		"""
+		entry = self.cache.lookup(key)
+		if not (entry and checksum):
+			return entry
+
+		verified = "%s:%s" % checksum
+		if entry.verified is None:
+			logging.debug("Verifying %s" % entry.path)
+			if hash_file(entry.path, checksum[0]) == checksum[1]:
+				self.cache.set_verified(key, verified)
+				entry.verified = verified
+
+		if entry.verified != verified:
+			logging.info("Cache file for %s does not match the checksum. Downloading it again" % key)
+			self.cache.remove(key)
+			return None
+
+		return entry
+
+	def download(self, url, alternatives=None, consumer=None, key=None, checksum=None):
+		"""
+		Downloads url into the cache and returns the name of the cache file.
+
+		If the server supports range requests, the file is split into segments which are fetched in parallel from
+		url and all alternatives. Alternatives must point to the same immutable file on other mirrors. The download
+		is written to a .part file which is moved into the cache when it is complete; an interrupted download is
+		resumed with If-Range requests.
+
+		If consumer is given, it is called with an iterable over the bytes of the file in order while the download is
+		still running (or with the cache file if it is still valid). The download returns when the consumer is done.
+
+		The cache entry is looked up by key, which defaults to url. Concurrent downloads of the same key wait for
+		the first one to finish.
+
+		checksum is an optional (algorithm, hexdigest) tuple. The checksum of the file is calculated while the file is
+		written and a mismatch raises a ChecksumError. Cache files which have been verified against the same checksum
+		are used without asking the server.
+		"""
+		key = key or url
+		with self.cache.lock(key):
+			return self._download(url, alternatives, consumer, key, checksum)
+
+	def _use_cached(self, entry, consumer):
+		report.count('cache_hits')
+		self.cache.touch(entry.key)
+		if consumer:
+			self._feed(consumer, entry.path)
+		return entry.path
+
+	def _download(self, url, alternatives, consumer, key, checksum):
+		entry = self._cached(key, checksum)
+
+		if entry and checksum:
+			logging.debug("Cache file %s matches the checksum" % entry.path)
+			return self._use_cached(entry, consumer)
+
+		partial = PartialDownload(self.cache.part_file(key))
+		resume = partial.load()
+		headers = {}
+
+		if resume:
+			# resume with the first missing segment. If-Range makes the server send the whole file if it has changed.
+			segments = [x for start, end in partial.missing() for x in split_segments(start, end + 1, self.segment_size)]
+			logging.info("Resuming the download of %s (%s of %s bytes missing)" % (
+						url, sum(end - start + 1 for start, end in segments), partial.total))
+			headers['If-Range'] = partial.validator
+		else:
+			if entry and entry.last_modified:
+				logging.debug("Last-Modified: %s" % entry.last_modified)
+				headers['If-Modified-Since'] = entry.last_modified
+
+			if entry and entry.etag:
+				logging.debug("Etag: %s" % entry.etag)
+				headers['If-None-Match'] = entry.etag
+
+			# the first segment doubles as the probe for range support
+			segments = [(0, self.segment_size - 1)]
+
+		response = None
+		started = time.time()
+		if segments:
+			headers['Range'] = 'bytes=%s-%s' % segments[0]
+			try:
+				response = self._open(url, headers)
+			except HTTPError as he:
+				if not (he.getcode() == 304 and entry):
+					raise he
+				logging.debug("Not modified. Cache file %s is valid" % entry.path)
+				return self._use_cached(entry, consumer)
 
 		try:
-			opener = build_opener()
-			response = opener.open(request)
+			if response:
+				total = self._total_size(response) if response.status == 206 else None
+
+				if resume and total != partial.total:
+					logging.info("%s has changed since the download was interrupted. Starting over" % url)
+					if total is not None:
+						# the body is the first missing segment of the new file, so start with a fresh request
+						response.close()
+						partial.remove()
+						return self._download(url, alternatives, consumer, key, checksum)
+					resume = False
+
+				if not resume and total is not None:
+					partial.start(response.headers.get('Etag', None), response.headers.get('Last-Modified', None), total)
+					segments = split_segments(0, total, self.segment_size)
+			else:
+				# everything has been written before the download was interrupted
+				total = partial.total
+
+			flags = os.O_WRONLY | os.O_CREAT | (0 if resume else os.O_TRUNC)
+			fd = os.open(partial.part_file, flags, 0o644)
+			progress = DownloadProgress()
+			resumed = 0
+			if resume:
+				for start, end in partial.done:
+					progress.add(start, end - start + 1)
+					resumed += end - start + 1
+
+			# the content hash and the checksum are calculated in order while the segments are written
+			content_hash = hashlib.sha256()
+			hashes = [content_hash]
+			if checksum:
+				hashes.append(hashlib.new(checksum[0]))
+
+			def hash_content(reader):
+				for x in reader:
+					for h in hashes:
+						h.update(x)
+
+			consumers = [self._start_consumer(hash_content, partial.part_file, progress)]
+			if consumer:
+				consumers.append(self._start_consumer(consumer, partial.part_file, progress))
+
+			try:
+				if total is None:
+					logging.debug("Server does not support range requests. Falling back to a single stream")
+					partial.remove(keep_part=True)
+					self.report_throughput(url, self._copy(response, fd, 0, progress=progress), time.time() - started)
+				else:
+					os.ftruncate(fd, total)
+					if response:
+						start, end = segments.pop(0)
+						bytes_read = self._copy(response, fd, start, end - start + 1, progress)
+						self.report_throughput(url, bytes_read, time.time() - started)
+						if bytes_read == end - start + 1:
+							partial.add(start, end)
+						else:
+							segments = split_segments(start + bytes_read, end + 1, self.segment_size) + segments
+
+					if segments:
+						sources = [url] + [x for x in (alternatives or []) if x != url]
+						logging.debug("Fetching %s segment(s) from %s source(s)" % (len(segments), len(sources)))
+						self._fetch_segments(sources, fd, segments, total, progress, partial)
+			except Exception as ex:
+				os.close(fd)
+				progress.finish(ex)
+				for join in consumers:
+					try:
+						join()
+					except Exception:
+						# the consumers fail because of the aborted download. Report the original error
+						pass
+
+				# downloads without range support can't be resumed
+				if total is None:
+					partial.remove()
+				raise
+			os.close(fd)
+		finally:
+			if response:
+				response.close()
 
-			last_modified = None
+		logging.debug("Downloaded %s" % url)
+		progress.finish()
 
-			if 'Last-Modified' in response.headers:
-				meta['last-modified'] = response.headers['Last-Modified']
-			if 'Etag' in response.headers:
-				meta['etag'] = response.headers['etag']
+		join_hash, consumers = consumers[0], consumers[1:]
+		join_hash()
 
-			bytes_read = 0
-			with open(cache_file, 'wb') as o:
-				x = response.read(1024)
-				bytes_read += len(x)
-				while x:
-					o.write(x)
-					x = response.read(1024)
-					bytes_read += len(x)
+		consumer_error = None
+		for join in consumers:
+			try:
+				join()
+			except Exception as ex:
+				consumer_error = ex
 
-			logging.debug("Downloaded %s bytes to %s" % (bytes_read, cache_file))
-		except HTTPError as he:
-			logging.debug("Not modified. Cache file is valid")
-			if not he.getcode() == 304:
-				raise he
+		if checksum and hashes[-1].hexdigest() != checksum[1]:
+			partial.remove()
+			raise ChecksumError("%s checksum of %s does not match" % (checksum[0], url))
 
-		self.save_meta(meta, meta_file)
+		etag, last_modified = (partial.etag, partial.last_modified) if total is not None else \
+							(response.headers.get('Etag', None), response.headers.get('Last-Modified', None))
+		partial.remove(keep_part=True)
+		entry = self.cache.store(key, partial.part_file, content_hash.hexdigest(), etag, last_modified,
+								"%s:%s" % checksum if checksum else None)
+		logging.debug("Cache file: %s" % entry.path)
+		report.count('cache_misses')
+		report.count('bytes_downloaded', entry.size - resumed)
 
-		return cache_file
+		if consumer_error:
+			raise consumer_error
 
+		return entry.path
@@ -3,94 +3,336 @@
 
 import sys
 import os
-import tempfile
+import json
 import logging
 from argparse import ArgumentParser
-import traceback
+import time
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../../cfgio/src'))
 
-from gentoobootstrap.actions.cfgchk import CheckConfigAction
-from gentoobootstrap.actions.gentoo import InstallGentooAction
-from gentoobootstrap.actions.domuconfig import CreateDomUConfig
-from gentoobootstrap.actions.storage import CreateStorageAction
-from gentoobootstrap.config.file import FileConfig
+# the commands import what they need, so submitting a job to the daemon doesn't load the bootstrap modules
+from gentoobootstrap.api import DaemonClient, DEFAULT_SOCKET
+from gentoobootstrap.size import Size
 
-class Bootstrap(object):
 
-	def __init__(self, config):
-		self.config = config
+def setup_logging(verbose, no_color, thread_names=False):
+	logging.basicConfig(level=logging.FATAL - (10 * verbose),
+						format='%(asctime)s %(levelname)-7s ' + ('[%(threadName)s] ' if thread_names else '') + '%(message)s')
 
-	def check(self, actions):
-		logging.debug("Executing pre-flight checks...")
+	if not no_color:
+		import gentoobootstrap.log
+
+
+def read_config(args):
+	"""
+	Reads the configuration file of a cache command. Configurations may use %(name)s and %(fqdn)s, so they are read
+	with the name and fqdn given on the command line or with placeholders.
+	"""
+	from gentoobootstrap.config.file import FileConfig
+
+	name = args.name or 'warm'
+	return FileConfig(args.config, name=name, fqdn=args.fqdn or '%s.example.com' % name)
+
+
+def cache_main(argv):
+	parser = ArgumentParser(prog='gentoo-bootstrap cache', description="Manage the download cache")
+
+	parser.add_argument('action', choices=['list', 'prune', 'warm'],
+						help="list the cached files, prune the cache down to its maximum size or pre-warm it "
+							 "with the archives needed by CONFIG")
+	parser.add_argument('-c', '--config', help="Take the cache settings and mirrors from this configuration file")
+	parser.add_argument('-n', '--name', help="The name of the domU CONFIG is read with (default: a placeholder)")
+	parser.add_argument('-f', '--fqdn', help="The full-qualified domain name CONFIG is read with (default: a placeholder)")
+	parser.add_argument('--cache-dir', help="The cache directory (default: cache_dir from CONFIG or /var/cache/gentoo-bootstrap)")
+	parser.add_argument('--max-size', help="Prune the cache to SIZE (default: cache_size from CONFIG)")
+	parser.add_argument('-v', '--verbose', action="count", default=3)
+	parser.add_argument('--no-color', action='store_true', help='Do not colorize log output')
+
+	args = parser.parse_args(argv)
+	setup_logging(args.verbose, args.no_color)
+
+	from gentoobootstrap.actions.gentoo import GentooLoader
+	from gentoobootstrap.cache import DownloadCache
+
+	cfg = read_config(args) if args.config else None
+	if args.action == 'warm' and not cfg:
+		parser.error("warm requires a configuration file")
+
+	cache_dir = args.cache_dir or (cfg.cache_dir if cfg else '/var/cache/gentoo-bootstrap')
+	max_size = Size(args.max_size).bytes if args.max_size else (cfg.cache_size if cfg else None)
+
+	if args.action == 'list':
+		cache = DownloadCache(cache_dir)
+		for entry in cache.entries():
+			print("{:>12}  {}  {}  {}".format(entry.size, time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.last_access)),
+											entry.digest[:12], entry.key))
+		print("{:>12}  total".format(cache.size))
+	elif args.action == 'prune':
+		evicted = DownloadCache(cache_dir).prune(max_size)
+		logging.info("Evicted %s file(s)" % len(evicted))
+	elif args.action == 'warm':
+		loader = GentooLoader(cfg.gentoo_mirrors, cache_dir=cache_dir, cache_size=max_size,
+							  connections=cfg.download_connections)
+		failed = False
+		if not loader.fetch_stage3(cfg.arch, cfg.subarch):
+			logging.error("Could not load the stage3 archive")
+			failed = True
+		if cfg.portage in ('fetch', 'squashfs') and not loader.fetch_portage():
+			logging.error("Could not load the portage snapshot")
+			failed = True
+		return 1 if failed else 0
+
+
+def distfiles_main(argv):
+	parser = ArgumentParser(prog='gentoo-bootstrap distfiles', description="Manage the shared distfiles")
+
+	parser.add_argument('action', choices=['list', 'scan', 'verify', 'warm'],
+						help="list the indexed distfiles, index new distfiles, check the distfiles against the index "
+							 "or pre-warm the distfiles with NAMEs")
+	parser.add_argument('names', nargs='*', metavar='NAME', help="The distfiles to pre-warm")
+	parser.add_argument('-f', '--file', help="Pre-warm the distfiles listed in FILE (one per line)")
+	parser.add_argument('-c', '--config', help="Take the directories and mirrors from this configuration file")
+	parser.add_argument('-n', '--name', help="The name of the domU CONFIG is read with (default: a placeholder)")
+	parser.add_argument('--fqdn', help="The full-qualified domain name CONFIG is read with (default: a placeholder)")
+	parser.add_argument('--dir', help="The distfiles directory (default: distfiles_dir from CONFIG or /var/cache/gentoo-bootstrap/distfiles)")
+	parser.add_argument('--remove', action='store_true', help="Remove the distfiles which fail verify")
+	parser.add_argument('-v', '--verbose', action="count", default=3)
+	parser.add_argument('--no-color', action='store_true', help='Do not colorize log output')
+
+	args = parser.parse_args(argv)
+	setup_logging(args.verbose, args.no_color)
+
+	from gentoobootstrap.actions.gentoo import GentooLoader
+	from gentoobootstrap.distfiles import DistfilesIndex
+
+	cfg = read_config(args) if args.config else None
+	if args.action == 'warm' and not cfg:
+		parser.error("warm requires a configuration file")
+
+	index = DistfilesIndex(args.dir or (cfg.distfiles_dir if cfg else '/var/cache/gentoo-bootstrap/distfiles'))
+
+	if args.action == 'list':
+		for name, size, mtime, digest in index.entries():
+			print("{:>12}  {}  {}".format(size, digest[:12], name))
+	elif args.action == 'scan':
+		logging.info("Indexed %s new distfile(s)" % len(index.scan()))
+	elif args.action == 'verify':
+		broken = index.verify(remove=args.remove)
+		for name in broken:
+			print(name)
+		return 1 if broken else 0
+	elif args.action == 'warm':
+		names = list(args.names)
+		if args.file:
+			with open(args.file) as f:
+				names.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+
+		index.scan()
+		loader = GentooLoader.from_config(cfg)
+		failed = 0
+		for name in index.missing(names):
+			filename = loader.fetch_distfile(name)
+			if filename:
+				index.add(name, filename)
+			else:
+				logging.error("Could not load distfile %s" % name)
+				failed += 1
+		return 1 if failed else 0
+
+
+def batch_main(argv):
+	parser = ArgumentParser(prog='gentoo-bootstrap batch', description="Bootstrap all domUs listed in a manifest")
+
+	parser.add_argument('-m', '--manifest', required=True,
+						help="The manifest with one '<name> <fqdn> <config>' line per domU")
+	parser.add_argument('-j', '--jobs', type=int, default=4, help="Bootstrap N domUs at once (default: %(default)s)")
+	parser.add_argument('-d', '--xen-config-dir', default='/etc/xen', help="Place the xen domU configurations in DIR (default: %(default)s)")
+	parser.add_argument('--report', help="Write the result and the timings of each domU as JSON to FILE")
+	parser.add_argument('--resume', action='store_true', help="Continue the failed bootstraps after their last completed phase")
+	parser.add_argument('-v', '--verbose', action="count", default=3)
+	parser.add_argument('--no-install', action='store_true', help="Only create the volumes and configs. Do not install Gentoo.")
+	parser.add_argument('--no-personalize', action="store_true", help="Only install Gentoo, but skip personalization")
+	parser.add_argument('--no-config', action='store_true', help="Do not create xen configurations")
+	parser.add_argument('--no-color', action='store_true', help='Do not colorize log output')
+
+	args = parser.parse_args(argv)
+	setup_logging(args.verbose, args.no_color, thread_names=True)
+
+	from gentoobootstrap.batch import BatchBootstrap, parse_manifest
 
-		for action in actions:
-			if not action.test():
-				logging.error("Action '%s' failed to pass pre-execution tests" % action.__class__.__name__)
-				return False
+	batch = BatchBootstrap(parse_manifest(args.manifest), workers=args.jobs, xen_config_dir=args.xen_config_dir,
+						   resume=args.resume)
+	ok = batch.execute(install=not args.no_install,
+					   personalize=not args.no_personalize,
+					   create_config=not args.no_config)
 
-		return True
+	for result in batch.report():
+		print("{:<20} {:<8} {:>8}s  {}".format(result['name'], result['status'], result['duration'], result['error'] or ''))
 
-	def execute(self, install=True, personalize=True, create_config=True):
-		base_dir = tempfile.mkdtemp()
-		logging.debug("Base directory: %s" % base_dir)
+	if args.report:
+		batch.write_report(args.report)
 
-		try:
-			actions = [
-						CheckConfigAction(self.config),
-						CreateStorageAction(self.config)
-			]
+	return 0 if ok else 1
 
-			if install:
-				actions.append(InstallGentooAction(self.config, personalize=personalize))
 
-			if create_config:
-				actions.append(CreateDomUConfig(self.config))
+def lint_main(argv):
+	parser = ArgumentParser(prog='gentoo-bootstrap lint', description="Validate configuration files")
 
-			if not self.check(actions):
-				return
+	parser.add_argument('paths', nargs='*', default=['/etc/gentoo-bootstrap'],
+						help="Configuration files or directories with *.cfg files (default: /etc/gentoo-bootstrap)")
+	parser.add_argument('-j', '--jobs', type=int, default=None, help="Validate N files at once (default: number of cores)")
+	parser.add_argument('-v', '--verbose', action="count", default=3)
+	parser.add_argument('--no-color', action='store_true', help='Do not colorize log output')
+
+	args = parser.parse_args(argv)
+	setup_logging(args.verbose, args.no_color)
+
+	from gentoobootstrap.lint import find_configs, lint
+
+	files = find_configs(args.paths)
+	results = lint(files, workers=args.jobs)
 
-			logging.info("Pre-execution tests passed. Starting bootstrapping")
-			logging.info("Actions: %s" % (', '.join([x.__class__.__name__ for x in actions])))
+	broken = 0
+	for filename in files:
+		for error in results[filename]:
+			print("%s: %s" % (filename, error))
+		broken += 1 if results[filename] else 0
 
-			for action in actions:
-				action.execute()
+	logging.info("%s of %s file(s) have errors" % (broken, len(files)))
+	return 1 if broken else 0
 
-		except Exception as e:
-			logging.error(e)
-			logging.error(traceback.format_exc())
-		finally:
-			if os.path.exists(base_dir):
-				os.rmdir(base_dir)
+
+def daemon_main(argv):
+	parser = ArgumentParser(prog='gentoo-bootstrap daemon', description="Run the bootstraps submitted over a Unix socket")
+
+	parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET, help="Listen on SOCKET (default: %(default)s)")
+	parser.add_argument('-j', '--jobs', type=int, default=4, help="Bootstrap N domUs at once (default: %(default)s)")
+	parser.add_argument('-d', '--xen-config-dir', default='/etc/xen', help="Place the xen domU configurations in DIR (default: %(default)s)")
+	parser.add_argument('-v', '--verbose', action="count", default=3)
+	parser.add_argument('--no-color', action='store_true', help='Do not colorize log output')
+
+	args = parser.parse_args(argv)
+	setup_logging(args.verbose, args.no_color, thread_names=True)
+
+	from gentoobootstrap.daemon import BootstrapDaemon
+
+	daemon = BootstrapDaemon(args.socket, workers=args.jobs, xen_config_dir=args.xen_config_dir)
+	try:
+		daemon.serve_forever()
+	except KeyboardInterrupt:
+		logging.info("Shutting down")
+
+
+def jobs_main(argv):
+	parser = ArgumentParser(prog='gentoo-bootstrap jobs', description="Manage the jobs of the daemon")
+
+	parser.add_argument('action', choices=['list', 'show', 'cancel'],
+						help="list all jobs, show the details and the run report of the job ID or cancel it")
+	parser.add_argument('id', nargs='?', type=int, metavar='ID', help="The id of the job")
+	parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET, help="The socket of the daemon (default: %(default)s)")
+	parser.add_argument('-v', '--verbose', action="count", default=3)
+	parser.add_argument('--no-color', action='store_true', help='Do not colorize log output')
+
+	args = parser.parse_args(argv)
+	setup_logging(args.verbose, args.no_color)
+
+	if args.action != 'list' and args.id is None:
+		parser.error("%s requires a job id" % args.action)
+
+	client = DaemonClient(args.socket)
+	if not client.available():
+		logging.error("No daemon is listening on %s" % args.socket)
+		return 1
+
+	if args.action == 'list':
+		for job in client.query():
+			print("{:>5}  {:<20} {:<10} {:>8}s  {}".format(job['id'], job['name'], job['status'], job['duration'] or '-',
+														  job['error'] or ''))
+	elif args.action == 'show':
+		print(json.dumps(client.query(args.id), indent=4))
+	elif args.action == 'cancel':
+		job = client.cancel(args.id)
+		logging.info("Job %s (%s): %s" % (job['id'], job['name'], job['status']))
+
+
+commands = {
+	'cache': cache_main,
+	'batch': batch_main,
+	'distfiles': distfiles_main,
+	'lint': lint_main,
+	'daemon': daemon_main,
+	'jobs': jobs_main,
+}
 
 
 def main():
+	if len(sys.argv) > 1 and sys.argv[1] in commands:
+		return commands[sys.argv[1]](sys.argv[2:])
+
 	parser = ArgumentParser()
 
 	parser.add_argument('-c', '--config', required=True)
 	parser.add_argument('-n', '--name', required=True, help="The name of the domU")
 	parser.add_argument('-f', '--fqdn', required=True, help="The full-qualified domain name")
-	parser.add_argument('-d', '--xen-config-dir', default='/etc/xen', help="Place the xen domU configuration in DIR (default: %(default)s)")
+	parser.add_argument('-d', '--xen-config-dir', help="Place the xen domU configuration in DIR (default: /etc/xen or, if the bootstrap is submitted to the daemon, its directory)")
 	parser.add_argument('-v', '--verbose', action="count", default=3)
 	parser.add_argument('--no-install', action='store_true', help="Only create the volume and config. Do not install Gentoo.")
 	parser.add_argument('--no-personalize', action="store_true", help="Only install Gentoo, but skip personalization")
 	parser.add_argument('--no-config', action='store_true', help="Do not create a xen configuration")
 	parser.add_argument('--no-color', action='store_true', help='Do not colorize log output')
+	parser.add_argument('--report', help="Write the timings of all phases and the download counters as JSON to FILE")
+	parser.add_argument('--resume', action='store_true', help="Continue a failed bootstrap after its last completed phase")
+	parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET, help="Submit the bootstrap to the daemon listening on SOCKET, if any (default: %(default)s)")
+	parser.add_argument('--no-daemon', action='store_true', help="Bootstrap in this process even if a daemon is running")
 
 	args = parser.parse_args()
+	setup_logging(args.verbose, args.no_color)
 
-	logging.basicConfig(level=logging.FATAL - (10 * args.verbose),
-						format='%(asctime)s %(levelname)-7s %(message)s')
+	client = DaemonClient(args.socket)
+	if not args.no_daemon and client.available():
+		return submit(client, args)
 
-	if not args.no_color:
-		import gentoobootstrap.log
+	from gentoobootstrap.bootstrap import Bootstrap
+	from gentoobootstrap.config.file import FileConfig
 
-	cfg = FileConfig(args.config, name=args.name, fqdn=args.fqdn, xen_config_dir=args.xen_config_dir)
-	Bootstrap(cfg).execute(install=not args.no_install,
+	cfg = FileConfig(args.config, name=args.name, fqdn=args.fqdn, xen_config_dir=args.xen_config_dir or '/etc/xen')
+	bootstrap = Bootstrap(cfg, resume=args.resume)
+	ok = bootstrap.execute(install=not args.no_install,
 						   personalize=not args.no_personalize,
 						   create_config=not args.no_config)
 
+	if args.report:
+		bootstrap.report.write(args.report)
+
+	return 0 if ok else 1
+
+
+def submit(client, args):
+	"""Submits the bootstrap to the daemon and waits until it finished. Ctrl-C cancels the job."""
+	options = dict(install=not args.no_install, personalize=not args.no_personalize, create_config=not args.no_config,
+				   resume=args.resume)
+	if args.xen_config_dir:
+		options['xen_config_dir'] = os.path.abspath(args.xen_config_dir)
+
+	job = client.submit(args.name, args.fqdn, args.config, **options)
+	logging.info("Submitted job %s to the daemon at %s" % (job['id'], client.socket_path))
+
+	try:
+		job = client.wait(job['id'])
+	except KeyboardInterrupt:
+		logging.info("Cancelling job %s" % job['id'])
+		client.cancel(job['id'])
+		job = client.wait(job['id'])
+
+	if job['error']:
+		logging.error(job['error'])
+	if args.report and job['report']:
+		with open(args.report, 'w') as f:
+			json.dump(job['report'], f, indent=4)
+
+	return 0 if job['status'] == 'ok' else 1
+
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	sys.exit(main())
\ No newline at end of file
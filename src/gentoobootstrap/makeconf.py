@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import re
+
+
+MARKER = '# added by gentoo-bootstrap while bootstrapping'
+
+
+def parse_make_conf(content):
+	"""Returns the variables assigned in a make.conf. Values referencing other variables are kept as they are."""
+	values = {}
+	for line in content.split('\n'):
+		m = re.match(r'^\s*(?:export\s+)?(\w+)\s*=\s*(["\']?)(.*)\2\s*$', line)
+		if m:
+			values[m.group(1)] = m.group(3)
+	return values
+
+
+def append_settings(make_conf, settings):
+	"""
+	Appends the (variable, value) settings to make_conf. Returns the appended lines, which are removed again with
+	restore().
+	"""
+	lines = [MARKER] + ['%s="%s"' % (k, v) for k, v in settings]
+
+	content = None
+	if os.path.exists(make_conf):
+		with open(make_conf) as f:
+			content = f.read()
+
+	with open(make_conf, 'a') as f:
+		if content and not content.endswith('\n'):
+			f.write('\n')
+		f.write(''.join('%s\n' % line for line in lines))
+
+	return lines
+
+
+def restore(make_conf, lines):
+	"""
+	Removes the lines returned by append_settings() from make_conf. Everything else is kept, including the changes
+	made to make_conf after the settings were appended (e.g. by the chroot).
+	"""
+	with open(make_conf) as f:
+		content = f.read().splitlines(True)
+
+	markers = [i for i, line in enumerate(content) if line.rstrip('\n') == lines[0]]
+	if not markers:
+		logging.warning("The settings added to %s have been removed already" % make_conf)
+		return
+
+	start = markers[0]
+	end = start + 1
+	# the settings follow the marker, unless they have been changed in the meantime
+	while end < len(content) and end - start < len(lines) and content[end].rstrip('\n') == lines[end - start]:
+		end += 1
+	content = content[:start] + content[end:]
+
+	if content:
+		with open(make_conf, 'w') as f:
+			f.write(''.join(content))
+	else:
+		# make_conf has been created by append_settings()
+		os.remove(make_conf)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+from urllib.request import Request, build_opener
+
+
+class MirrorRanking(object):
+	"""
+	Persistent ranking of mirrors by their observed latency (time to first byte) and throughput.
+
+	Mirrors are ranked by the estimated time to download a reference file. Mirrors which fail are put into an
+	exponential backoff and are ranked last until the backoff expires.
+	"""
+
+	# size of the file used to estimate the download time of a mirror
+	reference_size = 256 * 1024 * 1024
+	# throughput assumed for mirrors without any measurement
+	default_throughput = 1024 * 1024
+	# weight of a new measurement in the moving averages
+	smoothing = 0.3
+	# transfers smaller than this are dominated by latency and say nothing about throughput
+	min_sample_size = 1024 * 1024
+	backoff_base = 60
+	backoff_max = 24 * 60 * 60
+
+	def __init__(self, store_file=None, probe_timeout=5):
+		self.store_file = store_file
+		self.probe_timeout = probe_timeout
+		self._lock = threading.Lock()
+		self.stats = self._load()
+
+	def _load(self):
+		try:
+			with open(self.store_file, 'r') as i:
+				return json.load(i)
+		except:
+			return {}
+
+	def save(self):
+		if not self.store_file:
+			return
+
+		with self._lock:
+			tmp_file = "%s.tmp" % self.store_file
+			with open(tmp_file, 'w') as o:
+				json.dump(self.stats, o)
+			os.rename(tmp_file, self.store_file)
+
+	def _entry(self, mirror):
+		return self.stats.setdefault(mirror, {
+			'ttfb': None,
+			'throughput': None,
+			'failures': 0,
+			'retry_after': 0,
+		})
+
+	def _average(self, old, new):
+		return new if old is None else (1 - self.smoothing) * old + self.smoothing * new
+
+	def record_latency(self, mirror, seconds):
+		with self._lock:
+			entry = self._entry(mirror)
+			entry['ttfb'] = self._average(entry['ttfb'], seconds)
+			entry['failures'] = 0
+			entry['retry_after'] = 0
+
+	def record_throughput(self, mirror, bytes_read, seconds):
+		if bytes_read < self.min_sample_size or seconds <= 0:
+			return
+
+		with self._lock:
+			entry = self._entry(mirror)
+			entry['throughput'] = self._average(entry['throughput'], bytes_read / seconds)
+			entry['failures'] = 0
+			entry['retry_after'] = 0
+
+	def record_failure(self, mirror, now=None):
+		with self._lock:
+			entry = self._entry(mirror)
+			entry['failures'] += 1
+			backoff = min(self.backoff_base * 2 ** (entry['failures'] - 1), self.backoff_max)
+			entry['retry_after'] = (now or time.time()) + backoff
+			logging.debug("Backing off mirror %s for %ss" % (mirror, backoff))
+
+	def is_backed_off(self, mirror, now=None):
+		return self.stats.get(mirror, {}).get('retry_after', 0) > (now or time.time())
+
+	def estimated_time(self, mirror):
+		"""Returns the estimated number of seconds to download reference_size bytes from mirror"""
+		entry = self.stats.get(mirror, {})
+		throughputs = sorted(x['throughput'] for x in self.stats.values() if x.get('throughput'))
+		# mirrors we've never downloaded from are assumed to be as fast as the median mirror
+		default = throughputs[len(throughputs) // 2] if throughputs else self.default_throughput
+
+		return (entry.get('ttfb') or self.probe_timeout) + self.reference_size / (entry.get('throughput') or default)
+
+	def rank(self, mirrors, now=None):
+		"""Returns mirrors sorted from best to worst. The sort is stable, so the configured order breaks ties."""
+		return sorted(mirrors, key=lambda m: (self.is_backed_off(m, now), self.estimated_time(m)))
+
+	def probe(self, urls):
+		"""
+		Measures the time to first byte for all urls (a dict of mirror -> url) concurrently.
+		Mirrors in backoff are not probed.
+		"""
+		def _probe(mirror, url):
+			request = Request(url)
+			request.add_header('User-Agent', 'gentoo-bootstrap/0.1')
+			start = time.time()
+			try:
+				with build_opener().open(request, timeout=self.probe_timeout) as response:
+					response.read(1)
+				self.record_latency(mirror, time.time() - start)
+			except Exception as ex:
+				logging.debug("Probing %s failed: %s" % (url, ex))
+				self.record_failure(mirror)
+
+		threads = [threading.Thread(target=_probe, args=(mirror, url), daemon=True)
+					for mirror, url in urls.items() if not self.is_backed_off(mirror)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import os
+import threading
+import time
+
+
+def decode(line):
+	"""sh passes the chunks which aren't valid UTF-8 as bytes"""
+	if isinstance(line, bytes):
+		return line.decode('utf-8', errors='replace')
+	return line
+
+
+class OutputCapture(object):
+	"""
+	Receives the output of a command line by line (e.g. as the _out callback of sh). The lines are appended to
+	log_file with buffered writes and only the last tail lines are kept in memory, so a command can produce any
+	amount of output.
+	"""
+
+	def __init__(self, log_file=None, tail=200, buffer_size=64 * 1024):
+		self.log_file = log_file
+		self.tail = collections.deque(maxlen=tail)
+		self.lines = 0
+		self._lock = threading.Lock()
+		self._f = None
+
+		if log_file:
+			if not os.path.exists(os.path.dirname(log_file)):
+				os.makedirs(os.path.dirname(log_file), exist_ok=True)
+			self._f = open(log_file, 'a', buffering=buffer_size, encoding='utf-8', errors='replace')
+
+	def __call__(self, line):
+		line = decode(line).rstrip('\n')
+
+		with self._lock:
+			self.tail.append(line)
+			self.lines += 1
+			if self._f:
+				self._f.write(line + '\n')
+		logging.debug(line)
+
+	def header(self, text):
+		"""Starts a new section in the log file, e.g. for the next command"""
+		with self._lock:
+			self.tail.clear()
+			if self._f:
+				self._f.write("### %s %s\n" % (time.strftime('%Y-%m-%d %H:%M:%S'), text))
+
+	def log_tail(self, level=logging.ERROR):
+		"""Logs the last lines, e.g. after the command failed"""
+		logging.log(level, "Last %s of %s line(s) of output%s:" % (
+					len(self.tail), self.lines, (" (see %s for all)" % self.log_file) if self.log_file else ''))
+		for line in list(self.tail):
+			logging.log(level, line)
+
+	def close(self):
+		with self._lock:
+			if self._f:
+				self._f.close()
+				self._f = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+
+
+class MarkerOutput(object):
+	"""
+	Passes the lines starting with one of the prefixes in markers to the callback of the prefix (with the rest of the
+	line) and all other lines to output. Used for the '@@stage <name>' lines of the chroot script.
+	"""
+
+	def __init__(self, output, markers):
+		self.output = output
+		self.markers = markers
+
+	def __call__(self, line):
+		line = decode(line)
+		for prefix, callback in self.markers.items():
+			if line.startswith(prefix):
+				callback(line[len(prefix):].strip())
+				return
+		self.output(line)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+_local = threading.local()
+
+
+class RunReport(object):
+	"""
+	Collects the duration of the phases of a bootstrap and counters (e.g. downloaded bytes, cache hits). Phases are
+	named by their path, e.g. 'InstallGentooAction.execute/stage3/download'.
+
+	The report of a bootstrap is activated in the thread running it with activate(); the module-level phase() and
+	count() functions record into the active report and do nothing if there is none. Work handed to other threads
+	is wrapped with bind(), so it records into the same report below the same phase.
+	"""
+
+	def __init__(self, name=None):
+		self.name = name
+		self.started = time.time()
+		self.duration = None
+		self.status = None
+		self.phases = []
+		self.counters = {}
+		self._lock = threading.Lock()
+
+	def record(self, name, start, duration, status='ok'):
+		with self._lock:
+			self.phases.append({
+				'name': name,
+				'start': start - self.started,
+				'duration': duration,
+				'status': status,
+			})
+
+	def count(self, counter, value=1):
+		with self._lock:
+			self.counters[counter] = self.counters.get(counter, 0) + value
+
+	def finish(self, status):
+		self.status = status
+		self.duration = round(time.time() - self.started, 3)
+
+	def as_dict(self):
+		with self._lock:
+			return {
+				'name': self.name,
+				'started': self.started,
+				'duration': self.duration,
+				'status': self.status,
+				'phases': [dict(p, start=round(p['start'], 3), duration=round(p['duration'], 3))
+						   for p in sorted(self.phases, key=lambda p: (p['start'], p['name'].count('/')))],
+				'counters': dict(self.counters),
+			}
+
+	def write(self, filename):
+		with open(filename, 'w') as f:
+			json.dump(self.as_dict(), f, indent=4)
+
+
+def current():
+	"""Returns the report active in the current thread or None"""
+	return getattr(_local, 'report', None)
+
+
+def _path():
+	return getattr(_local, 'path', ())
+
+
+@contextmanager
+def activate(report, path=()):
+	"""Makes report the active report of the current thread"""
+	previous = current(), _path()
+	_local.report, _local.path = report, path
+	try:
+		yield report
+	finally:
+		_local.report, _local.path = previous
+
+
+@contextmanager
+def phase(name):
+	"""Records the duration of the block as phase name (below the current phase) in the active report"""
+	report = current()
+	if report is None:
+		yield
+		return
+
+	path = _path() + (name, )
+	_local.path = path
+	start = time.time()
+	status = 'ok'
+	try:
+		yield
+	except BaseException:
+		status = 'failed'
+		raise
+	finally:
+		_local.path = path[:-1]
+		report.record('/'.join(path), start, time.time() - start, status)
+
+
+def count(counter, value=1):
+	"""Adds value to counter in the active report"""
+	report = current()
+	if report is not None:
+		report.count(counter, value)
+
+
+def bind(func):
+	"""Returns func wrapped to record into the report and below the phase active in the current thread"""
+	report, path = current(), _path()
+
+	def wrapper(*args, **kwargs):
+		with activate(report, path):
+			return func(*args, **kwargs)
+	return wrapper
+
+
+class Stages(object):
+	"""
+	Records consecutive stages as phases, e.g. the stages a script announces in its output. Each stage ends when
+	the next one starts or finish() is called.
+	"""
+
+	def __init__(self):
+		self.report = current()
+		self.path = _path()
+		self.stage = None
+		self.start = None
+
+	def switch(self, name):
+		self.finish()
+		self.stage, self.start = name, time.time()
+
+	def finish(self, status='ok'):
+		if self.stage is not None and self.report is not None:
+			self.report.record('/'.join(self.path + (self.stage, )), self.start, time.time() - self.start, status)
+		self.stage = None
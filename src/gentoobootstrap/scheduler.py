@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from gentoobootstrap import report
+
+
+class ActionScheduler(object):
+	"""
+	Executes actions as soon as the resources they require are available. An action requires the resources listed
+	in its 'requires' attribute and makes the resources in 'provides' available when it finished. A resource which
+	no action provides is available from the start. Independent actions run in parallel.
+
+	If the cancel event is set, no further actions are started; the running ones finish.
+	"""
+
+	def __init__(self, actions, workers=4, cancel=None):
+		self.actions = actions
+		self.workers = workers
+		self.cancel = cancel
+
+	def _providers(self):
+		providers = {}
+		for action in self.actions:
+			for resource in getattr(action, 'provides', ()):
+				providers.setdefault(resource, []).append(action)
+		return providers
+
+	def _run(self, action):
+		start = time.time()
+		logging.debug("Starting %s" % action.__class__.__name__)
+		with report.phase("%s.execute" % action.__class__.__name__):
+			action.execute()
+		logging.debug("%s finished after %.1fs" % (action.__class__.__name__, time.time() - start))
+
+	def execute(self):
+		"""Executes all actions. The first error stops scheduling new actions and is raised after the running ones finished."""
+		providers = self._providers()
+		# the actions record into the report of the current thread
+		run = report.bind(self._run)
+		pending = list(self.actions)
+		done = set()
+		running = {}
+		error = None
+
+		def ready(action):
+			return all(all(provider in done for provider in providers.get(resource, []))
+					   for resource in getattr(action, 'requires', ()))
+
+		# keep the name of the current thread (e.g. the domU in a batch) in the log messages of the actions
+		with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=threading.current_thread().name) as executor:
+			while pending or running:
+				if error is None and self.cancel is not None and self.cancel.is_set():
+					error = Exception("Cancelled")
+
+				if error is None:
+					for action in [a for a in pending if ready(a)]:
+						pending.remove(action)
+						running[executor.submit(run, action)] = action
+
+				if not running:
+					if pending and error is None:
+						error = Exception("Unresolvable dependencies of %s" % ', '.join(a.__class__.__name__ for a in pending))
+					break
+
+				finished, _ = wait(running, return_when=FIRST_COMPLETED)
+				for future in finished:
+					action = running.pop(future)
+					if future.exception():
+						logging.error("%s failed: %s" % (action.__class__.__name__, future.exception()))
+						error = error or future.exception()
+					else:
+						done.add(action)
+
+		if error is not None:
+			raise error
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import email.utils
+import fcntl
+import logging
+import os
+import shutil
+
+from sh import mksquashfs
+
+
+def snapshot_date(entry):
+	"""
+	Returns the date of the portage snapshot in the cache entry (YYYYMMDD from its Last-Modified header) or the
+	beginning of its hash, if the mirror didn't send a Last-Modified header.
+	"""
+	if entry.last_modified:
+		try:
+			return email.utils.parsedate_to_datetime(entry.last_modified).strftime('%Y%m%d')
+		except (TypeError, ValueError):
+			pass
+	return entry.digest[:12]
+
+
+class SquashfsStore(object):
+	"""
+	Keeps each portage snapshot as a SquashFS image in directory/portage-<date>.sqfs. The image is built once per
+	snapshot and mounted read-only (with an overlay for writes) into the chroots instead of extracting the snapshot
+	into every domU.
+	"""
+
+	def __init__(self, directory, keep=2):
+		self.directory = directory
+		# number of images kept
+		self.keep = keep
+
+	def path(self, date):
+		return os.path.join(self.directory, 'portage-%s.sqfs' % date)
+
+	def get(self, date, snapshot, extractor, threads=None):
+		"""Returns the image of the portage snapshot from date. The image is created if it doesn't exist."""
+		image = self.path(date)
+		if not os.path.exists(self.directory):
+			os.makedirs(self.directory, exist_ok=True)
+
+		with open("%s.lock" % image, 'a') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+
+			if os.path.exists(image):
+				logging.debug("Using portage image %s" % image)
+				return image
+
+			logging.info("Creating portage image %s" % image)
+			tmp_dir = "%s.tmp" % image
+			if os.path.exists(tmp_dir):
+				shutil.rmtree(tmp_dir)
+			os.makedirs(tmp_dir)
+
+			try:
+				extractor.extract(snapshot, tmp_dir, preserve=False)
+				args = [os.path.join(tmp_dir, 'portage'), "%s.new" % image, '-noappend', '-no-progress']
+				if threads:
+					args.extend(['-processors', str(threads)])
+				mksquashfs(*args)
+				os.rename("%s.new" % image, image)
+			finally:
+				shutil.rmtree(tmp_dir)
+				if os.path.exists("%s.new" % image):
+					os.remove("%s.new" % image)
+
+		self.prune()
+		return image
+
+	def prune(self):
+		"""Removes all but the newest images"""
+		images = sorted((os.path.join(self.directory, x) for x in os.listdir(self.directory) if x.endswith('.sqfs')),
+						key=os.path.getmtime, reverse=True)
+
+		for image in images[self.keep:]:
+			with open("%s.lock" % image, 'a') as lock:
+				try:
+					fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				except BlockingIOError:
+					continue
+
+				# a mounted image stays readable for the chroots using it
+				logging.info("Removing old portage image %s" % image)
+				os.remove(image)
+			os.remove("%s.lock" % image)
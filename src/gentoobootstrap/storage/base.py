@@ -4,7 +4,26 @@ import os
 from sh import Command
 
 
+# mkfs options per format profile and filesystem. The 'fast' profile skips the work which isn't needed on a fresh
+# volume: the inode tables and the journal are initialized lazily by the kernel and the device isn't discarded.
+FORMAT_PROFILES = {
+	'default': {},
+	'fast': {
+		'ext2': ['-E', 'lazy_itable_init=1,nodiscard'],
+		'ext3': ['-E', 'lazy_itable_init=1,lazy_journal_init=1,nodiscard'],
+		'ext4': ['-E', 'lazy_itable_init=1,lazy_journal_init=1,nodiscard'],
+		# -f overwrites stale signatures, which are left when the LV isn't wiped
+		'xfs': ['-K', '-f'],
+		'btrfs': ['-K', '-f'],
+		# mkswap only writes the header
+		'swap': [],
+	},
+}
+
+
 class StorageBase(object):
+	# True if the storage has been cloned from a base which already contains the stage3
+	cloned = False
 
 	def __init__(self, **kwargs):
 		for k, v in kwargs.items():
@@ -13,6 +32,10 @@ class StorageBase(object):
 	def create(self):
 		raise NotImplementedError()
 
+	def remove(self):
+		"""Removes the storage again. Used to roll back a failed bootstrap."""
+		raise NotImplementedError()
+
 	def exists(self):
 		e = os.path.exists(self.device)
 
@@ -23,6 +46,18 @@ class StorageBase(object):
 
 		return e
 
+	@property
+	def profile(self):
+		"""The format profile ('format_profile' in the storage config)"""
+		profile = getattr(self, 'format_profile', 'default')
+		if profile not in FORMAT_PROFILES:
+			raise Exception("Unknown format profile '%s'" % profile)
+		return profile
+
+	def format_options(self):
+		"""Returns the mkfs options of the format profile"""
+		return list(FORMAT_PROFILES[self.profile].get(self.fs, []))
+
 	def format(self):
 		cmd = None
 
@@ -31,12 +66,16 @@ class StorageBase(object):
 		else:
 			cmd = Command("mkfs.%s" % self.fs)
 
-		logging.info("Formatting %s using %s" % (self.device, cmd))
+		args = self.format_options() + [self.device]
 		if hasattr(self, 'opts'):
-			logging.debug("Formatting with opts: %s" % self.opts)
-			cmd(self.device, self.opts)
-		else:
-			cmd(self.device)
+			args.append(self.opts)
+
+		logging.info("Formatting %s using %s %s (profile %s)" % (self.device, cmd, ' '.join(args), self.profile))
+		cmd(*args)
 
 	def is_block_storage(self):
-		return True
\ No newline at end of file
+		return True
+
+	def can_clone(self):
+		"""Returns True if the storage can be cloned from a base instead of being created and formatted"""
+		return False
\ No newline at end of file
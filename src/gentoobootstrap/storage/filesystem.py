@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import logging
 import os
+import shutil
 from gentoobootstrap.storage.base import StorageBase
 
 
@@ -10,6 +11,11 @@ class FilesystemStorage(StorageBase):
 		if not os.path.exists(self.device):
 			os.makedirs(self.device, mode=0o700)
 
+	def remove(self):
+		if os.path.exists(self.device):
+			logging.info("Removing %s" % self.device)
+			shutil.rmtree(self.device)
+
 	def format(self):
 		pass
 
@@ -1,23 +1,166 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import os
+import re
+import threading
 from gentoobootstrap.size import Size
 
 from gentoobootstrap.storage.base import StorageBase
 import logging
-from sh import lvcreate
+from sh import lvcreate, lvextend, lvremove, lvs
+
+
+# one lock per base LV ('<volume group>/<base>'), so the domUs of a batch don't create or remove it at the same time
+_base_locks = {}
+_base_locks_lock = threading.Lock()
+
+# the date in the name of a stage3 archive, e.g. 20150101 or 20230101T170151Z
+_STAGE3_DATE = re.compile(r'\d{8}(T\d{6}Z)?')
+
+
+def _base_lock(volume_group, base):
+	with _base_locks_lock:
+		return _base_locks.setdefault("%s/%s" % (volume_group, base), threading.Lock())
+
 
 class LVMStorage(StorageBase):
 
 	def __init__(self, **kwargs):
 		super(LVMStorage, self).__init__(**kwargs)
 		self.volume_group = kwargs.pop('volume_group')
+		self.thin_pool = kwargs.get('thin_pool', None)
 		self.size = Size(self.size)
 		self.device = os.path.join("/dev", self.volume_group, self.name)
 
+	@property
+	def zero(self):
+		"""
+		True if new (thick) LVs are zeroed and wiped of old signatures. Defaults to False for the fast format profile,
+		which overwrites stale signatures with mkfs.
+		"""
+		value = getattr(self, 'zero_lv', None)
+		if value is None:
+			return self.profile != 'fast'
+		return str(value).lower() in ('1', 'yes', 'true', 'on')
+
 	def create(self):
-		logging.info("Creating the LV '%s' with %s on volume group %s" % (self.name, self.size, self.volume_group))
-		for line in lvcreate("-L", str(self.size), "-d", "-n", self.name, self.volume_group, _in="y"):
+		if self.thin_pool:
+			logging.info("Creating the thin LV '%s' with %s in pool %s/%s" % (self.name, self.size, self.volume_group, self.thin_pool))
+			for line in lvcreate("-V", str(self.size), "-T", "%s/%s" % (self.volume_group, self.thin_pool), "-n", self.name, _in="y"):
+				logging.info(line)
+		else:
+			# thin LVs are never zeroed here: the thin pool decides whether new blocks are zeroed
+			zero_args = [] if self.zero else ["-Z", "n", "-W", "n"]
+			logging.info("Creating the LV '%s' with %s on volume group %s (options: %s)" % (
+				self.name, self.size, self.volume_group, ' '.join(zero_args) or 'none'))
+			for line in lvcreate("-L", str(self.size), "-d", *zero_args, "-n", self.name, self.volume_group, _in="y"):
+				logging.info(line)
+
+	def remove(self):
+		logging.info("Removing the LV '%s' from volume group %s" % (self.name, self.volume_group))
+		for line in lvremove("-f", "%s/%s" % (self.volume_group, self.name)):
 			logging.info(line)
 
+	def can_clone(self):
+		"""Thin LVs with a filesystem can be cloned from a base LV"""
+		return bool(self.thin_pool) and self.fs != 'swap'
+
+	def base_name(self, tag):
+		"""
+		Returns the name of the base LV for tag (e.g. the name of the stage3 archive) and the way the filesystem is
+		created: the format profile, a short hash of the mkfs options (if any) and the filesystem.
+		"""
+		name = "base-%s-%s" % (re.sub(r'[^\w.+-]', '_', tag), self.profile)
+		if getattr(self, 'opts', None):
+			name += "-%s" % hashlib.sha1(self.opts.encode('utf-8')).hexdigest()[:8]
+		return "%s-%s" % (name, self.fs)
+
+	def _lv_size(self, name):
+		out = lvs("--noheadings", "--nosuffix", "--units", "b", "-o", "lv_size", "%s/%s" % (self.volume_group, name))
+		return int(str(out).strip())
+
+	def _bases(self):
+		# base LVs are thin snapshots which are not activated, so they don't show up in /dev
+		return [name for name in str(lvs("--noheadings", "-o", "lv_name", self.volume_group)).split()
+				if name.startswith('base-') and name.endswith('-%s' % self.fs)]
+
+	def has_base(self, tag):
+		return self.base_name(tag) in self._bases()
+
+	def clone(self, tag):
+		"""
+		Creates the LV as a thin snapshot of the base LV for tag and grows it to the configured size. Returns False,
+		if the base LV doesn't exist (anymore) or is larger than the configured size.
+		"""
+		base = self.base_name(tag)
+
+		with _base_lock(self.volume_group, base):
+			if not self.has_base(tag):
+				logging.warning("Base LV %s has been removed. Not cloning it" % base)
+				return False
+
+			base_size = self._lv_size(base)
+			if base_size > self.size.bytes:
+				logging.warning("Base LV %s is larger than %s. Not cloning it" % (base, self.size))
+				return False
+
+			logging.info("Cloning the LV '%s' from %s/%s" % (self.name, self.volume_group, base))
+			for line in lvcreate("-s", "-k", "n", "-n", self.name, "%s/%s" % (self.volume_group, base)):
+				logging.info(line)
+
+		if base_size < self.size.bytes:
+			# -r resizes the filesystem, too
+			for line in lvextend("-r", "-L", str(self.size), "%s/%s" % (self.volume_group, self.name)):
+				logging.info(line)
+
+		self.cloned = True
+		return True
+
+	def save_base(self, tag):
+		"""
+		Keeps the current state of the LV as the base LV for tag and removes the bases of older stage3 archives of
+		the same kind. Returns False, if the base LV for tag exists already (e.g. saved by another domU of a batch).
+		"""
+		base = self.base_name(tag)
+
+		with _base_lock(self.volume_group, base):
+			if self.has_base(tag):
+				logging.info("Base %s/%s exists already" % (self.volume_group, base))
+				return False
+
+			logging.info("Saving the LV '%s' as base %s/%s" % (self.name, self.volume_group, base))
+			try:
+				for line in lvcreate("-s", "-n", base, "%s/%s" % (self.volume_group, self.name)):
+					logging.info(line)
+			except Exception:
+				# saved by another process in the meantime
+				if not self.has_base(tag):
+					raise
+				logging.info("Base %s/%s exists already" % (self.volume_group, base))
+				return False
+
+		self.prune_bases(tag)
+		return True
+
+	def prune_bases(self, tag):
+		"""Removes the base LVs of older stage3 archives of the same kind as tag (e.g. stage3-amd64-<date>)"""
+		current = self.base_name(tag)
+		kind = _STAGE3_DATE.sub('', current)
+		if kind == current:
+			return
+
+		for base in self._bases():
+			# the dates are at the same position, so older bases sort first
+			if base >= current or _STAGE3_DATE.sub('', base) != kind:
+				continue
+
+			with _base_lock(self.volume_group, base):
+				logging.info("Removing the old base %s/%s" % (self.volume_group, base))
+				try:
+					for line in lvremove("-f", "%s/%s" % (self.volume_group, base)):
+						logging.info(line)
+				except Exception as ex:
+					logging.warning("Could not remove the old base %s/%s: %s" % (self.volume_group, base, ex))
+
 	def __repr__(self):
-		return "%s (%s), type %s" % (self.name, self.size, self.fs)
\ No newline at end of file
+		return "%s (%s), type %s" % (self.name, self.size, self.fs)
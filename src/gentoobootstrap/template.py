@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from sh import cp
+
+
+class TemplateStore(object):
+	"""
+	Keeps extracted stage3 archives as templates in directory/<arch>/<subarch>/<stage3 name>. A new root is
+	filled by cloning a template instead of extracting the archive again.
+	"""
+
+	def __init__(self, directory, keep=2):
+		self.directory = directory
+		# number of templates kept per arch/subarch
+		self.keep = keep
+
+	def path(self, arch, subarch, name):
+		return os.path.join(self.directory, arch, subarch or arch, name)
+
+	def get(self, arch, subarch, name, stage3, extractor):
+		"""Returns the template directory for the stage3 archive name. The template is created if it doesn't exist."""
+		template = self.path(arch, subarch, name)
+		if not os.path.exists(os.path.dirname(template)):
+			os.makedirs(os.path.dirname(template))
+
+		with open("%s.lock" % template, 'a') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+
+			if os.path.exists(template):
+				logging.debug("Using template %s" % template)
+				return template
+
+			logging.info("Creating template %s" % template)
+			tmp_dir = "%s.tmp" % template
+			if os.path.exists(tmp_dir):
+				shutil.rmtree(tmp_dir)
+			os.makedirs(tmp_dir)
+
+			extractor.extract(stage3, tmp_dir)
+			os.rename(tmp_dir, template)
+
+		self.prune(arch, subarch)
+		return template
+
+	def prune(self, arch, subarch):
+		"""Removes all but the newest templates of arch/subarch"""
+		base = os.path.dirname(self.path(arch, subarch, 'x'))
+		templates = sorted((os.path.join(base, x) for x in os.listdir(base)
+							if os.path.isdir(os.path.join(base, x)) and not x.endswith('.tmp')),
+							key=os.path.getmtime, reverse=True)
+
+		for template in templates[self.keep:]:
+			with open("%s.lock" % template, 'a') as lock:
+				try:
+					fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				except BlockingIOError:
+					continue
+
+				logging.info("Removing old template %s" % template)
+				shutil.rmtree(template)
+			os.remove("%s.lock" % template)
+
+	def hold(self, template):
+		"""
+		Keeps prune() from removing template while it's used (e.g. as the lower layer of an overlay) until the
+		returned file is closed
+		"""
+		lock = open("%s.lock" % template, 'a')
+		fcntl.flock(lock, fcntl.LOCK_SH)
+		return lock
+
+	def clone(self, template, target, threads=None, depth=3):
+		"""
+		Copies template into target. The copy uses reflinks if the filesystem of target supports them and runs
+		threads copies in parallel.
+		"""
+		with self.hold(template):
+			copy_tree(template, target, threads, depth)
+
+
+def _units(source, depth):
+	"""
+	Yields the paths (relative to source) which are copied as a whole. Directories are split into their
+	entries up to depth levels, so that the copies can run in parallel.
+	"""
+	for name in os.listdir(source):
+		path = os.path.join(source, name)
+		if depth > 1 and os.path.isdir(path) and not os.path.islink(path) and os.listdir(path):
+			for x in _units(path, depth - 1):
+				yield os.path.join(name, x)
+		else:
+			yield name
+
+
+def _link_groups(source, units):
+	"""
+	Groups the units which contain hardlinks to the same files (e.g. a binary in /usr/bin and in the gcc-bin
+	directory). cp keeps the hardlinks between the sources of one call, so each group is copied by one cp.
+	"""
+	group = list(range(len(units)))
+
+	def find(i):
+		while group[i] != i:
+			group[i] = group[group[i]]
+			i = group[i]
+		return i
+
+	inodes = {}
+	for i, unit in enumerate(units):
+		path = os.path.join(source, unit)
+		if os.path.isdir(path) and not os.path.islink(path):
+			files = (os.path.join(root, name) for root, dirs, names in os.walk(path) for name in names)
+		else:
+			files = [path]
+
+		for f in files:
+			stat = os.lstat(f)
+			if stat.st_nlink < 2:
+				continue
+			first = inodes.setdefault((stat.st_dev, stat.st_ino), i)
+			group[find(i)] = find(first)
+
+	groups = {}
+	for i, unit in enumerate(units):
+		groups.setdefault(find(i), []).append(unit)
+	return list(groups.values())
+
+
+def copy_tree(source, target, threads=None, depth=3):
+	"""
+	Copies the content of source into the directory target with threads parallel cp -a --reflink=auto. Hardlinks
+	are kept, also between the units copied in parallel.
+	"""
+	threads = threads or os.cpu_count() or 1
+	logging.info("Copying %s to %s with %s thread(s)" % (source, target, threads))
+
+	units = list(_units(source, depth))
+	groups = _link_groups(source, units)
+	logging.debug("Copying %s unit(s) in %s group(s)" % (len(units), len(groups)))
+
+	# create the directories which have been split into units
+	skeleton = set()
+	for unit in units:
+		parent = os.path.dirname(unit)
+		while parent:
+			skeleton.add(parent)
+			parent = os.path.dirname(parent)
+	skeleton = [''] + sorted(skeleton)
+
+	for d in skeleton:
+		src, dst = os.path.join(source, d), os.path.join(target, d)
+		if not os.path.exists(dst):
+			os.mkdir(dst)
+		stat = os.lstat(src)
+		os.chown(dst, stat.st_uid, stat.st_gid)
+
+	def copy(group):
+		# --parents copies each unit to the same relative path below target
+		cp('-a', '--reflink=auto', '--parents', '--', *group + [os.path.join(os.path.abspath(target), '')], _cwd=source)
+
+	with ThreadPoolExecutor(max_workers=threads) as executor:
+		# list() re-raises the first exception of a copy
+		list(executor.map(copy, groups))
+
+	# set the permissions and timestamps after the copies changed the directories
+	for d in reversed(skeleton):
+		shutil.copystat(os.path.join(source, d), os.path.join(target, d))
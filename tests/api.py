@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.api import DaemonClient, JobServer
+
+
+class TestJobServer(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+		self.socket_path = os.path.join(self.directory, 'daemon.sock')
+		self.jobs = {}
+		self.server = JobServer(self.socket_path, self.handle)
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+	def teardown_method(self, method):
+		self.server.shutdown()
+		self.server.server_close()
+		shutil.rmtree(self.directory)
+
+	def handle(self, request):
+		if request['command'] == 'submit':
+			job = dict(id=len(self.jobs) + 1, name=request['name'], status='ok', resume=request['resume'])
+			self.jobs[job['id']] = job
+			return {'ok': True, 'job': job}
+		if request['command'] == 'query' and request.get('id') in self.jobs:
+			return {'ok': True, 'job': self.jobs[request['id']]}
+		return {'ok': False, 'error': "No job with id %s" % request.get('id')}
+
+	def test_requests(self):
+		client = DaemonClient(self.socket_path)
+		assert client.available()
+		assert oct(os.stat(self.socket_path).st_mode & 0o777) == oct(0o600)
+
+		job = client.submit('domu', 'domu.example.com', 'domu.cfg', resume=True)
+		assert job == {'id': 1, 'name': 'domu', 'status': 'ok', 'resume': True}
+		assert client.wait(1, interval=0.01) == job
+
+		with pytest.raises(Exception) as ex:
+			client.query(2)
+		assert str(ex.value) == 'No job with id 2'
+
+	def test_one_daemon(self):
+		with pytest.raises(Exception):
+			JobServer(self.socket_path, self.handle)
+
+		self.server.shutdown()
+		self.server.server_close()
+		assert not os.path.exists(self.socket_path)
+		assert not DaemonClient(self.socket_path).available()
+		# teardown shuts the server down again
+		self.server = JobServer(self.socket_path, self.handle)
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
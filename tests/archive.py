@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap import archive
+from gentoobootstrap.archive import ArchiveExtractor, Compression, detect
+
+
+def tar_bytes(mode='w'):
+	f = io.BytesIO()
+	with tarfile.open(fileobj=f, mode=mode, format=tarfile.USTAR_FORMAT) as t:
+		info = tarfile.TarInfo('etc/hostname')
+		info.size = 5
+		t.addfile(info, io.BytesIO(b'domu\n'))
+	return f.getvalue()
+
+
+class TestDetect(object):
+
+	def test_magic(self):
+		assert detect(b'BZh91AY&SY').name == 'bzip2'
+		assert detect(b'\xfd7zXZ\x00\x00\x04').name == 'xz'
+		assert detect(b'\x28\xb5\x2f\xfd\x04\x58').name == 'zstd'
+		assert detect(b'\x1f\x8b\x08\x00').name == 'gzip'
+
+	def test_tarfile(self):
+		assert detect(tar_bytes('w:gz')[:archive.HEADER_SIZE]).name == 'gzip'
+		assert detect(tar_bytes('w:bz2')[:archive.HEADER_SIZE]).name == 'bzip2'
+		assert detect(tar_bytes('w:xz')[:archive.HEADER_SIZE]).name == 'xz'
+
+	def test_ustar(self):
+		assert detect(tar_bytes()[:archive.HEADER_SIZE]) is None
+
+	def test_unknown(self):
+		with pytest.raises(Exception):
+			detect(b'PK\x03\x04' + b'\x00' * 258)
+
+
+class TestCompression(object):
+
+	def compression(self, monkeypatch, installed):
+		monkeypatch.setattr(archive.shutil, 'which', lambda binary: '/usr/bin/%s' % binary if binary in installed else None)
+		return Compression('bzip2', b'BZh', [('lbzip2', '-n %s'), ('pbzip2', '-p%s'), ('bzip2', None)])
+
+	def test_preference(self, monkeypatch):
+		assert self.compression(monkeypatch, ['lbzip2', 'pbzip2', 'bzip2']).program(8) == 'lbzip2 -n 8'
+		assert self.compression(monkeypatch, ['pbzip2', 'bzip2']).program(8) == 'pbzip2 -p8'
+
+	def test_single_thread(self, monkeypatch):
+		assert self.compression(monkeypatch, ['bzip2']).program(8) == 'bzip2'
+		assert self.compression(monkeypatch, ['lbzip2']).program(1) == 'lbzip2'
+
+	def test_missing(self, monkeypatch):
+		with pytest.raises(Exception) as ex:
+			self.compression(monkeypatch, []).program(4)
+		assert 'lbzip2, pbzip2, bzip2' in str(ex.value)
+
+
+class TestArchiveExtractor(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def test_extract_stream(self):
+		content = tar_bytes('w:gz')
+		chunks = [content[i:i + 100] for i in range(0, len(content), 100)]
+
+		ArchiveExtractor(threads=2).extract_stream(chunks, self.directory, preserve=False)
+		with open(os.path.join(self.directory, 'etc/hostname')) as f:
+			assert f.read() == 'domu\n'
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+# the bootstraps need cfgio and the tools sh looks up on import
+batch = pytest.importorskip('gentoobootstrap.batch', exc_type=ImportError)
+
+
+class Config(object):
+	gentoo_mirrors = ['http://mirror.example.com/gentoo']
+	cache_dir = '/var/cache/gentoo-bootstrap'
+	cache_size = None
+	download_connections = 4
+	verify_digests = True
+	portage_deltas = False
+
+	def __init__(self, filename, name, fqdn, xen_config_dir):
+		self.filename = filename
+		self.name = name
+		self.fqdn = fqdn
+		self.xen_config_dir = xen_config_dir
+
+
+class GentooLoader(object):
+
+	@classmethod
+	def from_config(cls, config):
+		return cls()
+
+
+class Bootstrap(object):
+	"""Fails the bootstrap of the configs named fail.cfg and raises for the configs named raise.cfg"""
+
+	def __init__(self, config, loader=None, resume=False, cancel=None):
+		self.config = config
+		self.loader = loader
+		self.error = None
+		self.report = self
+
+	def execute(self, install=True, personalize=True, create_config=True):
+		if os.path.basename(self.config.filename) == 'fail.cfg':
+			self.error = "Action 'CheckConfigAction' failed to pass pre-execution tests"
+			return False
+		if os.path.basename(self.config.filename) == 'raise.cfg':
+			raise Exception("lvcreate failed")
+		return True
+
+	def as_dict(self):
+		return {'name': self.config.name, 'loader': id(self.loader)}
+
+
+class TestParseManifest(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+		self.manifest = os.path.join(self.directory, 'manifest')
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def parse(self, content):
+		with open(self.manifest, 'w') as f:
+			f.write(content)
+		return batch.parse_manifest(self.manifest)
+
+	def test_parse(self):
+		jobs = self.parse("# domUs\n\nweb web.example.com web.cfg\n  db db.example.com /etc/gentoo-bootstrap/db.cfg\n")
+
+		assert [(job.name, job.fqdn, job.config) for job in jobs] == [
+			('web', 'web.example.com', os.path.join(self.directory, 'web.cfg')),
+			('db', 'db.example.com', '/etc/gentoo-bootstrap/db.cfg'),
+		]
+		assert all(job.status == 'pending' and job.xen_config_dir is None for job in jobs)
+
+	def test_bad_lines(self):
+		with pytest.raises(Exception) as ex:
+			self.parse("web web.example.com\n")
+		assert "manifest:1: expected '<name> <fqdn> <config>'" in str(ex.value)
+
+		with pytest.raises(Exception) as ex:
+			self.parse("web web.example.com web.cfg\n# again\nweb www.example.com web.cfg\n")
+		assert "manifest:3: duplicate domU name web" in str(ex.value)
+
+
+class TestBatchBootstrap(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def execute(self, monkeypatch, *configs):
+		monkeypatch.setattr(batch, 'FileConfig', Config)
+		monkeypatch.setattr(batch, 'Bootstrap', Bootstrap)
+		monkeypatch.setattr(batch, 'GentooLoader', GentooLoader)
+
+		jobs = [batch.BatchJob('domu%s' % i, 'domu%s.example.com' % i, os.path.join(self.directory, config))
+				for i, config in enumerate(configs)]
+		bootstrap = batch.BatchBootstrap(jobs, workers=2, xen_config_dir=self.directory)
+		return bootstrap, bootstrap.execute()
+
+	def test_shared_loader(self, monkeypatch):
+		bootstrap, ok = self.execute(monkeypatch, 'a.cfg', 'b.cfg', 'c.cfg')
+		assert ok
+
+		# the jobs with the same mirrors and cache settings share one loader
+		assert len(set(result['report']['loader'] for result in bootstrap.report())) == 1
+		assert len(bootstrap._loaders) == 1
+
+		other = Config('d.cfg', 'domu3', 'domu3.example.com', None)
+		other.cache_dir = os.path.join(self.directory, 'cache')
+		assert bootstrap.loader(other) is not bootstrap.loader(Config('a.cfg', 'domu0', 'domu0.example.com', None))
+
+	def test_failed(self, monkeypatch):
+		bootstrap, ok = self.execute(monkeypatch, 'a.cfg', 'fail.cfg', 'raise.cfg')
+		assert not ok
+
+		report = os.path.join(self.directory, 'report.json')
+		bootstrap.write_report(report)
+		with open(report) as f:
+			results = json.load(f)
+
+		assert [(result['name'], result['status']) for result in results] == [
+			('domu0', 'ok'), ('domu1', 'failed'), ('domu2', 'failed')]
+		assert results[1]['error'] == "Action 'CheckConfigAction' failed to pass pre-execution tests"
+		assert results[2]['error'] == "lvcreate failed"
+		assert all(result['duration'] is not None for result in results)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.binpkg import fingerprint
+from gentoobootstrap import makeconf
+
+
+class TestBinaryPackages(object):
+
+	def setup_method(self, method):
+		self.root = tempfile.mkdtemp()
+		os.makedirs(os.path.join(self.root, 'etc/portage'))
+		os.symlink('../../usr/portage/profiles/default/linux/amd64/13.0', os.path.join(self.root, 'etc/portage/make.profile'))
+		self.write('etc/portage/make.conf', 'CFLAGS="-O2 -pipe"\nCXXFLAGS="${CFLAGS}"\nUSE="bindist mmx"\n')
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.root)
+
+	def write(self, name, content):
+		with open(os.path.join(self.root, name), 'w') as f:
+			f.write(content)
+
+	def test_parse_make_conf(self):
+		assert makeconf.parse_make_conf('CFLAGS="-O2 -pipe"\n# USE="x"\nexport CHOST=\'x86_64-pc-linux-gnu\'') == {
+			'CFLAGS': '-O2 -pipe',
+			'CHOST': 'x86_64-pc-linux-gnu',
+		}
+
+	def test_fingerprint(self):
+		fp = fingerprint(self.root, 'amd64')
+		assert fp.startswith('amd64-')
+		assert fingerprint(self.root, 'amd64') == fp
+		assert fingerprint(self.root, 'x86', 'i686') != fp
+
+		# comments don't change the packages
+		self.write('etc/portage/make.conf', '# comment\nCFLAGS="-O2 -pipe"\nCXXFLAGS="${CFLAGS}"\nUSE="bindist mmx"\n')
+		assert fingerprint(self.root, 'amd64') == fp
+
+		self.write('etc/portage/package.use', 'dev-lang/python sqlite\n')
+		assert fingerprint(self.root, 'amd64') != fp
+
+	def test_append_and_restore(self):
+		make_conf = os.path.join(self.root, 'etc/portage/make.conf')
+		with open(make_conf) as f:
+			original = f.read()
+
+		content = makeconf.append_settings(make_conf, [('FEATURES', '${FEATURES} buildpkg')])
+		with open(make_conf) as f:
+			assert 'FEATURES="${FEATURES} buildpkg"' in f.read()
+
+		makeconf.restore(make_conf, content)
+		with open(make_conf) as f:
+			assert f.read() == original
+
+	def test_restore_keeps_later_changes(self):
+		make_conf = os.path.join(self.root, 'etc/portage/make.conf')
+		with open(make_conf) as f:
+			original = f.read()
+
+		lines = makeconf.append_settings(make_conf, [('FEATURES', '${FEATURES} buildpkg'), ('PKGDIR', '/var/binpkgs')])
+		# the chroot appends to make.conf, too
+		with open(make_conf, 'a') as f:
+			f.write('source /var/lib/layman/make.conf\n')
+
+		makeconf.restore(make_conf, lines)
+		with open(make_conf) as f:
+			assert f.read() == original + 'source /var/lib/layman/make.conf\n'
+
+	def test_restore_created(self):
+		make_conf = os.path.join(self.root, 'etc/make.conf')
+		makeconf.restore(make_conf, makeconf.append_settings(make_conf, [('PKGDIR', '/var/binpkgs')]))
+		assert not os.path.exists(make_conf)
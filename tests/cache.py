@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.cache import DownloadCache
+
+
+class TestDownloadCache(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def store(self, cache, key, content):
+		f = cache.part_file(key)
+		with open(f, 'wb') as o:
+			o.write(content)
+		return cache.store(key, f, hashlib.sha256(content).hexdigest(), etag='"x"')
+
+	def test_store_and_lookup(self):
+		cache = DownloadCache(self.directory)
+		entry = self.store(cache, 'http://a/amd64/stage3.tar', b'amd64')
+		self.store(cache, 'http://a/x86/stage3.tar', b'x86')
+
+		# same basename, different urls
+		assert cache.lookup('http://a/amd64/stage3.tar').path == entry.path
+		assert cache.lookup('http://a/amd64/stage3.tar').etag == '"x"'
+		with open(cache.lookup('http://a/x86/stage3.tar').path, 'rb') as f:
+			assert f.read() == b'x86'
+		assert cache.lookup('http://b/') is None
+
+	def test_deduplication(self):
+		cache = DownloadCache(self.directory)
+		self.store(cache, 'http://a/file', b'content')
+		self.store(cache, 'http://b/file', b'content')
+		assert cache.size == len(b'content')
+
+		cache.remove('http://a/file')
+		assert os.path.exists(cache.lookup('http://b/file').path)
+
+	def test_replaced_content(self):
+		cache = DownloadCache(self.directory)
+		old = self.store(cache, 'http://a/latest', b'old')
+		self.store(cache, 'http://a/latest', b'new')
+		assert not os.path.exists(old.path)
+		assert cache.size == 3
+
+	def test_lru_eviction(self):
+		cache = DownloadCache(self.directory, max_size=10)
+		self.store(cache, 'a', b'aaaa')
+		self.store(cache, 'b', b'bbbb')
+		cache.touch('a')
+		self.store(cache, 'c', b'cccc')
+
+		assert cache.lookup('b') is None
+		assert cache.lookup('a') and cache.lookup('c')
+		assert cache.size == 8
+
+	def test_prune(self):
+		cache = DownloadCache(self.directory)
+		entry = self.store(cache, 'a', b'aaaa')
+		self.store(cache, 'b', b'bbbb')
+		os.remove(entry.path)
+
+		assert cache.prune(max_size=0) == ['b']
+		assert cache.entries() == []
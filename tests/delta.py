@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap import delta
+
+
+class TestDeltas(object):
+
+	def test_snapshot_paths(self):
+		date = datetime.date(2015, 1, 2)
+		assert delta.snapshot_path(date) == 'snapshots/portage-20150102.tar.bz2'
+		assert delta.snapshot_date('snapshots/portage-20150102.tar.bz2') == date
+		assert delta.snapshot_date('snapshots/portage-latest.tar.bz2') is None
+
+	def test_delta_paths(self):
+		assert delta.delta_paths(datetime.date(2014, 12, 30), datetime.date(2015, 1, 1)) == [
+			'snapshots/deltas/snapshot-20141230-20141231.patch.bz2',
+			'snapshots/deltas/snapshot-20141231-20150101.patch.bz2',
+		]
+		assert delta.delta_paths(datetime.date(2015, 1, 1), datetime.date(2015, 1, 1)) == []
+
+	def test_candidate_dates(self):
+		today = datetime.date(2015, 1, 3)
+		assert delta.candidate_dates(datetime.date(2015, 1, 1), today) == [today, datetime.date(2015, 1, 2)]
+		assert delta.candidate_dates(today, today) == []
+		assert len(delta.candidate_dates(None, today)) == delta.MAX_AGE + 1
+
+	def test_latest_base(self):
+		keys = ['snapshots/portage-latest.tar.bz2', 'snapshots/portage-20150101.tar.bz2',
+				'snapshots/portage-20150103.tar.bz2', 'releases/amd64/stage3.tar.bz2']
+		assert delta.latest_base(keys) == (datetime.date(2015, 1, 3), 'snapshots/portage-20150103.tar.bz2')
+		assert delta.latest_base(['snapshots/portage-latest.tar.bz2']) is None
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.digests import parse_digests, parse_md5sum
+
+
+DIGESTS = """# BLAKE2B HASH
+0a1b  stage3-amd64-20150101.tar.bz2
+# SHA512 HASH
+ab12  stage3-amd64-20150101.tar.bz2
+cd34  stage3-amd64-20150101.tar.bz2.CONTENTS
+# WHIRLPOOL HASH
+ef56  stage3-amd64-20150101.tar.bz2
+"""
+
+
+class TestDigests(object):
+
+	def test_digests(self):
+		assert parse_digests(DIGESTS, 'stage3-amd64-20150101.tar.bz2') == ('sha512', 'ab12')
+		assert parse_digests(DIGESTS, 'stage3-amd64-20150101.tar.bz2.CONTENTS') == ('sha512', 'cd34')
+		assert parse_digests(DIGESTS, 'stage3-x86-20150101.tar.bz2') is None
+
+	def test_digests_preference(self):
+		# whirlpool is not supported, blake2b is the next best one
+		assert parse_digests(DIGESTS.replace('# SHA512', '# RMD160'), 'stage3-amd64-20150101.tar.bz2') == ('blake2b', '0a1b')
+
+	def test_md5sum(self):
+		md5 = 'd41d8cd98f00b204e9800998ecf8427e'
+		assert parse_md5sum('%s  portage-latest.tar.bz2\n' % md5, 'portage-latest.tar.bz2') == ('md5', md5)
+		assert parse_md5sum('%s  portage-20150101.tar.bz2\n' % md5, 'portage-latest.tar.bz2') == ('md5', md5)
+		assert parse_md5sum('', 'portage-latest.tar.bz2') is None
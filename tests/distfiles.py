@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.distfiles import DistfilesIndex
+
+
+class TestDistfilesIndex(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def write(self, name, content):
+		with open(os.path.join(self.directory, name), 'wb') as f:
+			f.write(content)
+
+	def test_scan(self):
+		index = DistfilesIndex(self.directory)
+		self.write('a-1.tar.gz', b'a')
+		self.write('b-1.tar.gz.__download__', b'b')
+		os.mkdir(os.path.join(self.directory, '.locks'))
+
+		assert index.scan() == ['a-1.tar.gz']
+		assert index.scan() == []
+		assert index.missing(['a-1.tar.gz', 'b-1.tar.gz']) == ['b-1.tar.gz']
+
+		os.remove(os.path.join(self.directory, 'a-1.tar.gz'))
+		index.scan()
+		assert index.entries() == []
+
+	def test_verify(self):
+		index = DistfilesIndex(self.directory)
+		self.write('a-1.tar.gz', b'aaaa')
+		self.write('b-1.tar.gz', b'bbbb')
+		index.scan()
+
+		self.write('a-1.tar.gz', b'xxxx')
+		assert index.verify(remove=True) == ['a-1.tar.gz']
+		assert not os.path.exists(os.path.join(self.directory, 'a-1.tar.gz'))
+		assert index.missing(['a-1.tar.gz', 'b-1.tar.gz']) == ['a-1.tar.gz']
+
+	def test_add(self):
+		index = DistfilesIndex(self.directory)
+		source = os.path.join(self.directory, '.source')
+		with open(source, 'wb') as f:
+			f.write(b'content')
+		os.chmod(source, 0o644)
+
+		index.add('c-1.tar.gz', source)
+		assert index.missing(['c-1.tar.gz']) == []
+		assert index.verify() == []
+
+		# the cache file is left alone
+		distfile = os.stat(os.path.join(self.directory, 'c-1.tar.gz'))
+		assert distfile.st_ino != os.stat(source).st_ino
+		assert distfile.st_mode & 0o777 == 0o664
+		assert os.stat(source).st_mode & 0o777 == 0o644
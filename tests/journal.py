@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.journal import Journal
+
+
+class TestJournal(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+		self.filename = os.path.join(self.directory, 'journal', 'domu.json')
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def test_resume(self):
+		journal = Journal(self.filename)
+		journal.set(root_password='secret')
+		journal.mark('storage', cloned=True)
+		journal.mark('chroot/locales')
+		journal.mark('chroot/portage')
+
+		assert stat.S_IMODE(os.stat(self.filename).st_mode) == 0o600
+
+		resumed = Journal(self.filename)
+		assert resumed.is_done('storage')
+		assert not resumed.is_done('stage3')
+		assert resumed.get('storage')['cloned']
+		assert resumed.value('root_password') == 'secret'
+		assert resumed.completed('chroot/') == ['locales', 'portage']
+
+	def test_new_bootstrap(self):
+		Journal(self.filename).mark('storage')
+
+		journal = Journal(self.filename, load=False)
+		assert not journal.is_done('storage')
+
+		journal.mark('stage3')
+		journal.remove()
+		assert not os.path.exists(self.filename)
+		assert journal.completed() == []
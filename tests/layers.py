@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.config import layers
+
+
+class TestLayers(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def write(self, name, content):
+		path = os.path.join(self.directory, name)
+		if not os.path.exists(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		with open(path, 'w') as f:
+			f.write(content)
+		return path
+
+	def test_chain(self):
+		self.write('base.cfg', "[system]\narch = amd64\ntimezone = UTC\n")
+		self.write('site/site.cfg', "[DEFAULT]\ninherit = ../base.cfg\n\n[system]\ntimezone = Europe/Berlin\n")
+		domu = self.write('domu.cfg', "[DEFAULT]\ninherit = site/site.cfg base.cfg missing.cfg\n\n"
+									  "[storage]\nvolume = %(name)s-root\n")
+
+		chain = layers.chain(domu)
+		assert [os.path.relpath(l.path, self.directory) for l in chain] == \
+			['base.cfg', 'site/site.cfg', 'missing.cfg', 'domu.cfg']
+
+		parser = layers.merge(chain, {'name': 'web01'})
+		assert parser.get('system', 'arch') == 'amd64'
+		assert parser.get('system', 'timezone') == 'Europe/Berlin'
+		assert parser.get('storage', 'volume') == 'web01-root'
+
+	def test_cache(self):
+		path = self.write('base.cfg', "[system]\narch = amd64\n")
+		layer = layers.load(path)
+		assert layers.load(path) is layer
+
+		self.write('base.cfg', "[system]\narch = x86\n")
+		os.utime(path, (layer.mtime + 1, layer.mtime + 1))
+		assert layers.load(path).sections == {'system': {'arch': 'x86'}}
+
+	def test_cycle(self):
+		self.write('a.cfg', "[DEFAULT]\ninherit = b.cfg\n")
+		self.write('b.cfg', "[DEFAULT]\ninherit = a.cfg\n")
+
+		with pytest.raises(Exception) as ex:
+			layers.chain(os.path.join(self.directory, 'a.cfg'))
+		assert 'Cyclic inherit' in str(ex.value)
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import re
+import sys
+import shutil
+import tempfile
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap import loader as loader_module
+from gentoobootstrap.loader import Loader, PartialDownload, ChecksumError, split_segments
+
+
+PAYLOAD = os.urandom(100 * 1024 + 17)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+	ranges = True
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		if self.headers.get('If-None-Match') == '"v1"':
+			self.send_response(304)
+			self.end_headers()
+			return
+
+		m = re.match(r'^bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+		if self.ranges and m and self.headers.get('If-Range', '"v1"') == '"v1"':
+			start, end = int(m.group(1)), min(int(m.group(2)), len(PAYLOAD) - 1)
+			self.send_response(206)
+			self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, end, len(PAYLOAD)))
+			body = PAYLOAD[start:end + 1]
+		else:
+			self.send_response(200)
+			body = PAYLOAD
+		self.send_header('Etag', '"v1"')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class NoRangeHandler(RangeHandler):
+	ranges = False
+
+
+class FlakyHandler(RangeHandler):
+	"""Answers the segment requests after the probe with 503 until failures requests failed"""
+	failures = 0
+	lock = threading.Lock()
+
+	def do_GET(self):
+		with self.lock:
+			fail = not self.headers.get('Range', '').startswith('bytes=0-') and FlakyHandler.failures > 0
+			if fail:
+				FlakyHandler.failures -= 1
+
+		if fail:
+			self.send_response(503)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+		else:
+			RangeHandler.do_GET(self)
+
+
+class SlowWriter(object):
+
+	def __init__(self, wfile):
+		self.wfile = wfile
+
+	def write(self, data):
+		for i in range(0, len(data), 1024):
+			self.wfile.write(data[i:i + 1024])
+			self.wfile.flush()
+			time.sleep(0.02)
+
+	def flush(self):
+		self.wfile.flush()
+
+
+class SlowHandler(RangeHandler):
+	"""Sends the segments after the probe with about 50 KiB/s"""
+
+	def do_GET(self):
+		if not self.headers.get('Range', '').startswith('bytes=0-'):
+			self.wfile = SlowWriter(self.wfile)
+		RangeHandler.do_GET(self)
+
+
+class RecordingLoader(Loader):
+
+	def __init__(self, *args, **kwargs):
+		super(RecordingLoader, self).__init__(*args, **kwargs)
+		self.failed = []
+
+	def report_failure(self, source):
+		self.failed.append(source)
+
+
+class TestLoader(object):
+
+	def serve(self, handler):
+		server = HTTPServer(('127.0.0.1', 0), handler)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		return server, "http://127.0.0.1:%s/file.bin" % server.server_port
+
+	def download(self, handler, alternatives=None, consumer=None):
+		server, url = self.serve(handler)
+		cache_dir = tempfile.mkdtemp()
+		try:
+			loader = Loader(cache_dir, segment_size=8192, retry_delay=0.01)
+			with open(loader.download(url, alternatives, consumer), 'rb') as f:
+				return f.read()
+		finally:
+			server.shutdown()
+			shutil.rmtree(cache_dir)
+
+	def test_split_segments(self):
+		assert split_segments(0, 10, 4) == [(0, 3), (4, 7), (8, 9)]
+		assert split_segments(4, 8, 4) == [(4, 7)]
+		assert split_segments(8, 8, 4) == []
+
+	def test_segmented(self):
+		assert self.download(RangeHandler) == PAYLOAD
+
+	def test_single_stream_fallback(self):
+		assert self.download(NoRangeHandler) == PAYLOAD
+
+	def test_failing_mirror(self):
+		# segments assigned to the dead mirror must be picked up by the working one
+		assert self.download(RangeHandler, ['http://127.0.0.1:1/file.bin']) == PAYLOAD
+
+	def test_retry(self):
+		# a single source must not be given up after one failed segment
+		FlakyHandler.failures = 3
+		assert self.download(FlakyHandler) == PAYLOAD
+		assert FlakyHandler.failures == 0
+
+	def test_retries_exhausted(self):
+		FlakyHandler.failures = 1000
+		try:
+			self.download(FlakyHandler)
+			assert False, "Failing source not given up"
+		except Exception as ex:
+			assert 'All sources failed' in str(ex)
+		finally:
+			FlakyHandler.failures = 0
+
+	def slow_download(self, monkeypatch, fast):
+		# read the segments in small chunks, so the throughput is checked while a segment is being read
+		monkeypatch.setattr(loader_module, 'CHUNK_SIZE', 1024)
+		slow_server, slow_url = self.serve(SlowHandler)
+		fast_server, fast_url = self.serve(RangeHandler)
+		cache_dir = tempfile.mkdtemp()
+		try:
+			loader = RecordingLoader(cache_dir, segment_size=8192, retry_delay=0.01, min_throughput=128 * 1024)
+			with open(loader.download(slow_url, [fast_url] if fast else None), 'rb') as f:
+				assert f.read() == PAYLOAD
+			return loader.failed, slow_url
+		finally:
+			slow_server.shutdown()
+			fast_server.shutdown()
+			shutil.rmtree(cache_dir)
+
+	def test_slow_segments(self, monkeypatch):
+		# the segments of the slow mirror are given back to the fast one
+		failed, slow_url = self.slow_download(monkeypatch, fast=True)
+		assert failed == [slow_url]
+
+	def test_slow_last_source(self, monkeypatch):
+		# a slow source is better than none
+		failed, slow_url = self.slow_download(monkeypatch, fast=False)
+		assert failed == []
+
+	def test_consumer(self):
+		# the consumer must see the bytes in order, although the segments arrive out of order
+		for handler in [RangeHandler, NoRangeHandler]:
+			streamed = []
+			assert self.download(handler, consumer=lambda reader: streamed.extend(reader)) == PAYLOAD
+			assert b''.join(streamed) == PAYLOAD
+
+	def test_not_modified(self):
+		server, url = self.serve(RangeHandler)
+		cache_dir = tempfile.mkdtemp()
+		try:
+			loader = Loader(cache_dir, segment_size=8192)
+			cache_file = loader.download(url)
+			streamed = []
+			assert loader.download(url, consumer=lambda reader: streamed.extend(reader)) == cache_file
+			assert b''.join(streamed) == PAYLOAD
+		finally:
+			server.shutdown()
+			shutil.rmtree(cache_dir)
+
+	def test_checksum(self):
+		server, url = self.serve(RangeHandler)
+		cache_dir = tempfile.mkdtemp()
+		checksum = ('sha512', hashlib.sha512(PAYLOAD).hexdigest())
+		try:
+			loader = Loader(cache_dir, segment_size=8192)
+			try:
+				loader.download(url, checksum=('sha512', '00'))
+				assert False, "Checksum mismatch not detected"
+			except ChecksumError:
+				pass
+
+			cache_file = loader.download(url, checksum=checksum)
+			server.shutdown()
+
+			# verified files are used without asking the server
+			assert loader.download(url, checksum=checksum) == cache_file
+		finally:
+			server.shutdown()
+			shutil.rmtree(cache_dir)
+
+	def resume(self, etag):
+		server, url = self.serve(RangeHandler)
+		cache_dir = tempfile.mkdtemp()
+		try:
+			loader = Loader(cache_dir, segment_size=8192)
+
+			# a download which has been interrupted after the first and the third segment
+			partial = PartialDownload(loader.cache.part_file(url))
+			with open(partial.part_file, 'wb') as f:
+				f.write(PAYLOAD[:8192] + bytes(8192) + PAYLOAD[16384:24576] + bytes(len(PAYLOAD) - 24576))
+			partial.start(etag, None, len(PAYLOAD))
+			partial.add(0, 8191)
+			partial.add(16384, 24575)
+			assert partial.missing() == [(8192, 16383), (24576, len(PAYLOAD) - 1)]
+
+			with open(loader.download(url), 'rb') as f:
+				assert f.read() == PAYLOAD
+			assert not os.path.exists(partial.part_file)
+			assert not os.path.exists(partial.state_file)
+		finally:
+			server.shutdown()
+			shutil.rmtree(cache_dir)
+
+	def test_resume(self):
+		self.resume('"v1"')
+
+	def test_resume_changed(self):
+		# the server sends the whole file if the validator does not match
+		self.resume('"v0"')
+
+	def test_resume_size_changed(self):
+		# the server answers the resumed range with the new size, so the body must not be written at offset 0
+		server, url = self.serve(RangeHandler)
+		cache_dir = tempfile.mkdtemp()
+		try:
+			loader = Loader(cache_dir, segment_size=8192)
+
+			partial = PartialDownload(loader.cache.part_file(url))
+			with open(partial.part_file, 'wb') as f:
+				f.write(PAYLOAD[:8192] + bytes(8192))
+			partial.start('"v1"', None, 16384)
+			partial.add(0, 8191)
+
+			with open(loader.download(url), 'rb') as f:
+				assert f.read() == PAYLOAD
+			assert not os.path.exists(partial.state_file)
+		finally:
+			server.shutdown()
+			shutil.rmtree(cache_dir)
+
+	def test_concurrent(self):
+		server, url = self.serve(RangeHandler)
+		cache_dir = tempfile.mkdtemp()
+		try:
+			results = []
+			threads = [threading.Thread(target=lambda: results.append(Loader(cache_dir, segment_size=8192).download(url)))
+						for _ in range(3)]
+			for t in threads:
+				t.start()
+			for t in threads:
+				t.join()
+
+			assert len(results) == 3 and len(set(results)) == 1
+		finally:
+			server.shutdown()
+			shutil.rmtree(cache_dir)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+# sh looks the LVM tools up on import
+lvm = pytest.importorskip('gentoobootstrap.storage.lvm', exc_type=ImportError)
+
+from gentoobootstrap.storage import base as storage_base
+
+
+class VolumeGroup(object):
+	"""Records the lvcreate/lvremove calls and answers lvs like a volume group with the LVs in self.lvs"""
+
+	def __init__(self, monkeypatch, *lvs):
+		self.lvs = set(lvs)
+		self.calls = []
+		self.lock = threading.Lock()
+		monkeypatch.setattr(lvm, 'lvcreate', self.lvcreate)
+		monkeypatch.setattr(lvm, 'lvremove', self.lvremove)
+		monkeypatch.setattr(lvm, 'lvs', self.lvs_)
+
+	def lvcreate(self, *args, **kwargs):
+		name = args[list(args).index('-n') + 1]
+		time.sleep(0.01)
+		with self.lock:
+			self.calls.append(('lvcreate', ) + args)
+			if name in self.lvs:
+				raise Exception("Logical Volume \"%s\" already exists in volume group \"vg\"" % name)
+			self.lvs.add(name)
+		return []
+
+	def lvremove(self, *args):
+		with self.lock:
+			self.calls.append(('lvremove', ) + args)
+			self.lvs.discard(args[-1].split('/')[1])
+		return []
+
+	def lvs_(self, *args):
+		if '-o' in args and 'lv_size' in args:
+			return '  1073741824\n'
+		return '\n'.join('  %s' % lv for lv in sorted(self.lvs))
+
+
+def storage(name='domu', **kwargs):
+	return lvm.LVMStorage(**dict(dict(name=name, size='10G', fs='ext4', volume_group='vg', thin_pool='pool'), **kwargs))
+
+
+class TestBases(object):
+
+	def test_save_base_once(self, monkeypatch):
+		vg = VolumeGroup(monkeypatch, 'domu1', 'domu2')
+		results = []
+
+		# two domUs of a batch extracted the same stage3
+		threads = [threading.Thread(target=lambda name: results.append(storage(name).save_base('stage3-amd64-20150101')),
+									args=(name, )) for name in ['domu1', 'domu2']]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		assert sorted(results) == [False, True]
+		assert len([c for c in vg.calls if c[0] == 'lvcreate']) == 1
+		assert 'base-stage3-amd64-20150101-default-ext4' in vg.lvs
+
+	def test_save_base_created_elsewhere(self, monkeypatch):
+		vg = VolumeGroup(monkeypatch, 'domu')
+		s = storage()
+		has_base = [False, True]
+		monkeypatch.setattr(s, 'has_base', lambda tag: has_base.pop(0))
+		vg.lvs.add('base-stage3-amd64-20150101-default-ext4')
+
+		assert s.save_base('stage3-amd64-20150101') is False
+
+	def test_prune_bases(self, monkeypatch):
+		vg = VolumeGroup(monkeypatch, 'domu',
+						 'base-stage3-amd64-20141201-default-ext4',
+						 'base-stage3-amd64-20141201-fast-ext4',
+						 'base-stage3-amd64-20141201-default-xfs',
+						 'base-stage3-x86-20141201-default-ext4',
+						 'base-stage3-amd64-20150201-default-ext4')
+
+		assert storage().save_base('stage3-amd64-20150101')
+		assert vg.lvs == {'domu', 'base-stage3-amd64-20150101-default-ext4',
+						  # another profile, another filesystem, another stage3 and a newer stage3
+						  'base-stage3-amd64-20141201-fast-ext4', 'base-stage3-amd64-20141201-default-xfs',
+						  'base-stage3-x86-20141201-default-ext4', 'base-stage3-amd64-20150201-default-ext4'}
+
+	def test_base_name(self):
+		tag = 'stage3-amd64-20150101'
+		assert storage().base_name(tag) == 'base-stage3-amd64-20150101-default-ext4'
+		assert storage(format_profile='fast').base_name(tag) == 'base-stage3-amd64-20150101-fast-ext4'
+
+		# the filesystems created with other mkfs options are not interchangeable
+		with_opts = storage(opts='-O ^has_journal').base_name(tag)
+		assert with_opts.startswith('base-stage3-amd64-20150101-default-') and with_opts.endswith('-ext4')
+		assert with_opts != storage(opts='-O metadata_csum').base_name(tag)
+		assert with_opts == storage(opts='-O ^has_journal').base_name(tag)
+
+	def test_clone_removed_base(self, monkeypatch):
+		vg = VolumeGroup(monkeypatch)
+		s = storage()
+		assert s.clone('stage3-amd64-20150101') is False
+		assert not s.cloned
+		assert vg.calls == []
+
+
+class TestFormatProfiles(object):
+
+	def lvcreate_args(self, monkeypatch, **kwargs):
+		vg = VolumeGroup(monkeypatch)
+		storage(**kwargs).create()
+		return vg.calls[0][1:]
+
+	def test_zero(self, monkeypatch):
+		assert self.lvcreate_args(monkeypatch, thin_pool=None) == ('-L', '10G', '-d', '-n', 'domu', 'vg')
+		assert self.lvcreate_args(monkeypatch, thin_pool=None, format_profile='fast') == (
+			'-L', '10G', '-d', '-Z', 'n', '-W', 'n', '-n', 'domu', 'vg')
+		assert self.lvcreate_args(monkeypatch, thin_pool=None, format_profile='fast', zero_lv='yes') == (
+			'-L', '10G', '-d', '-n', 'domu', 'vg')
+		assert self.lvcreate_args(monkeypatch, thin_pool=None, zero_lv='no') == (
+			'-L', '10G', '-d', '-Z', 'n', '-W', 'n', '-n', 'domu', 'vg')
+		# the thin pool decides about zeroing
+		assert self.lvcreate_args(monkeypatch, format_profile='fast') == ('-V', '10G', '-T', 'vg/pool', '-n', 'domu')
+
+	def test_format(self, monkeypatch):
+		commands = []
+
+		class Command(object):
+			def __init__(self, name):
+				self.name = name
+
+			def __call__(self, *args):
+				commands.append((self.name, ) + args)
+
+		monkeypatch.setattr(storage_base, 'Command', Command)
+
+		storage(format_profile='fast').format()
+		storage(fs='xfs', format_profile='fast', opts='-L root').format()
+		storage(fs='swap').format()
+
+		assert commands == [
+			('mkfs.ext4', '-E', 'lazy_itable_init=1,lazy_journal_init=1,nodiscard', '/dev/vg/domu'),
+			('mkfs.xfs', '-K', '-f', '/dev/vg/domu', '-L root'),
+			('mkswap', '/dev/vg/domu'),
+		]
+
+	def test_unknown_profile(self):
+		with pytest.raises(Exception) as ex:
+			storage(format_profile='turbo').format_options()
+		assert str(ex.value) == "Unknown format profile 'turbo'"
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.api import JobServer
+
+
+MAIN = os.path.join(os.path.dirname(__file__), '../src/gentoobootstrap/main.py')
+
+
+def run(*args):
+	return subprocess.run([sys.executable, MAIN] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode
+
+
+class TestExitStatus(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+		self.socket_path = os.path.join(self.directory, 'daemon.sock')
+		self.config = os.path.join(self.directory, 'domu.cfg')
+		open(self.config, 'w').close()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def test_batch(self):
+		# the bootstraps need cfgio and the tools sh looks up on import
+		pytest.importorskip('gentoobootstrap.batch', exc_type=ImportError)
+
+		manifest = os.path.join(self.directory, 'manifest')
+		with open(manifest, 'w') as f:
+			f.write("domu domu.example.com %s\n" % self.config)
+
+		# the empty configuration fails the pre-flight checks
+		assert run('batch', '-m', manifest, '-d', self.directory) == 1
+
+	def test_distfiles_verify(self):
+		pytest.importorskip('gentoobootstrap.actions.gentoo', exc_type=ImportError)
+
+		distfiles = os.path.join(self.directory, 'distfiles')
+		os.mkdir(distfiles)
+		with open(os.path.join(distfiles, 'foo-1.0.tar.gz'), 'w') as f:
+			f.write('foo')
+
+		assert run('distfiles', 'scan', '--dir', distfiles) == 0
+		assert run('distfiles', 'verify', '--dir', distfiles) == 0
+
+		with open(os.path.join(distfiles, 'foo-1.0.tar.gz'), 'w') as f:
+			f.write('bar')
+		assert run('distfiles', 'verify', '--dir', distfiles) == 1
+
+	def test_lint(self):
+		pytest.importorskip('gentoobootstrap.lint', exc_type=ImportError)
+
+		configs = os.path.join(self.directory, 'configs')
+		os.mkdir(configs)
+		assert run('lint', configs) == 0
+
+		with open(os.path.join(configs, 'domu.cfg'), 'w') as f:
+			f.write("[unknown]\nfoo = bar\n")
+		assert run('lint', configs) == 1
+
+	def serve(self, status):
+		self.requests = []
+
+		def handle(request):
+			self.requests.append(request)
+			job = dict(id=1, name=request.get('name', 'domu'), status=status, error=None, report=None)
+			return {'ok': True, 'job': job, 'jobs': [job]}
+
+		server = JobServer(self.socket_path, handle)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		return server
+
+	def test_no_daemon(self):
+		assert run('jobs', 'list', '-s', self.socket_path) == 1
+
+	def test_submit(self):
+		for status, code in [('ok', 0), ('failed', 1)]:
+			server = self.serve(status)
+			try:
+				assert run('-c', self.config, '-n', 'domu', '-f', 'domu.example.com', '-s', self.socket_path) == code
+			finally:
+				server.shutdown()
+				server.server_close()
+
+	def test_submit_xen_config_dir(self):
+		server = self.serve('ok')
+		try:
+			assert run('-c', self.config, '-n', 'domu', '-f', 'domu.example.com', '-s', self.socket_path) == 0
+			assert run('-c', self.config, '-n', 'domu', '-f', 'domu.example.com', '-s', self.socket_path,
+					   '-d', self.directory) == 0
+		finally:
+			server.shutdown()
+			server.server_close()
+
+		submits = [r for r in self.requests if r['command'] == 'submit']
+		assert 'xen_config_dir' not in submits[0]
+		assert submits[1]['xen_config_dir'] == self.directory
+
+	def test_cache_config_placeholders(self):
+		# the cache commands need cfgio and the tools sh looks up on import
+		pytest.importorskip('gentoobootstrap.actions.gentoo', exc_type=ImportError)
+
+		with open(self.config, 'w') as f:
+			f.write("[bootstrap]\ncache_dir = %s/%%(name)s-%%(fqdn)s\n\n[system]\narch = amd64\n" % self.directory)
+
+		assert run('cache', 'list', '-c', self.config) == 0
+		assert run('distfiles', 'list', '-c', self.config, '-n', 'web', '--fqdn', 'web.example.com') == 0
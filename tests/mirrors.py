@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.mirrors import MirrorRanking
+
+
+MB = 1024 * 1024
+
+
+class TestMirrorRanking(object):
+
+	def test_rank_by_throughput(self):
+		r = MirrorRanking()
+		r.record_throughput('http://a/', 10 * MB, 10)
+		r.record_throughput('http://b/', 10 * MB, 1)
+		assert r.rank(['http://a/', 'http://b/']) == ['http://b/', 'http://a/']
+
+	def test_rank_by_latency(self):
+		r = MirrorRanking()
+		r.record_latency('http://a/', 2)
+		r.record_latency('http://b/', 0.1)
+		assert r.rank(['http://a/', 'http://b/', 'http://c/']) == ['http://b/', 'http://a/', 'http://c/']
+
+	def test_small_transfers_ignored(self):
+		r = MirrorRanking()
+		r.record_throughput('http://a/', 100, 1)
+		assert 'http://a/' not in r.stats
+
+	def test_backoff(self):
+		r = MirrorRanking()
+		r.record_throughput('http://a/', 10 * MB, 1)
+		r.record_failure('http://a/', now=1000)
+		assert r.stats['http://a/']['retry_after'] == 1000 + r.backoff_base
+		r.record_failure('http://a/', now=1000)
+		assert r.stats['http://a/']['retry_after'] == 1000 + 2 * r.backoff_base
+
+		assert r.is_backed_off('http://a/', now=1000)
+		assert r.rank(['http://a/', 'http://b/'], now=1000) == ['http://b/', 'http://a/']
+		assert not r.is_backed_off('http://a/', now=1000 + 3 * r.backoff_base)
+
+		# a successful transfer resets the backoff
+		r.record_throughput('http://a/', 10 * MB, 1)
+		assert not r.is_backed_off('http://a/', now=1000)
+
+	def test_persistence(self):
+		store = os.path.join(tempfile.mkdtemp(), 'mirrors.json')
+		r = MirrorRanking(store)
+		r.record_latency('http://a/', 0.5)
+		r.save()
+		assert MirrorRanking(store).stats['http://a/']['ttfb'] == 0.5
+		os.remove(store)
+
+
+class TestTryMirrors(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def test_failures(self):
+		# the loader needs cfgio and the tools sh looks up on import
+		gentoo = pytest.importorskip('gentoobootstrap.actions.gentoo', exc_type=ImportError)
+		loader = gentoo.GentooLoader(['http://a/', 'http://b/', 'http://c/', 'http://d/'], cache_dir=self.directory)
+		errors = {
+			'http://a/': URLError('Connection refused'),
+			'http://b/': HTTPError('http://b/', 404, 'Not Found', {}, None),
+			# a full disk isn't the fault of the mirror
+			'http://c/': OSError(28, 'No space left on device'),
+		}
+
+		def fetch(mirror):
+			if mirror in errors:
+				raise errors[mirror]
+			return mirror
+
+		assert loader._try_mirrors('the file', fetch) == 'http://d/'
+		assert dict((mirror, stats['failures']) for mirror, stats in loader.ranking.stats.items()) == {
+			'http://a/': 1, 'http://b/': 1}
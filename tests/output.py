@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.output import MarkerOutput, OutputCapture
+
+
+class TestOutputCapture(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def test_tail(self):
+		log_file = os.path.join(self.directory, 'logs', 'domu.log')
+		with OutputCapture(log_file, tail=3) as output:
+			output.header('emerge')
+			for i in range(1000):
+				output("line %s\n" % i)
+			output(b"bytes \xff\n")
+
+			assert list(output.tail) == ['line 998', 'line 999', 'bytes �']
+			assert output.lines == 1001
+
+		with open(log_file) as f:
+			lines = f.read().split('\n')
+		assert lines[0].startswith('### ') and lines[0].endswith(' emerge')
+		assert lines[1] == 'line 0'
+		assert len(lines) == 1003
+
+	def test_no_log_file(self):
+		output = OutputCapture(tail=2)
+		output("a")
+		output.header('post_setup')
+		assert list(output.tail) == []
+		output.close()
+
+
+class TestMarkerOutput(object):
+
+	def test_markers(self):
+		output = OutputCapture(tail=10)
+		stages = []
+		marker_output = MarkerOutput(output, {'@@stage ': lambda s: stages.append(('stage', s)),
+											  '@@done ': lambda s: stages.append(('done', s))})
+
+		marker_output('@@stage emerge\n')
+		# emerge output which isn't valid UTF-8
+		marker_output(b'>>> Emerging \xff\xfe\n')
+		marker_output(b'@@done emerge\n')
+
+		assert stages == [('stage', 'emerge'), ('done', 'emerge')]
+		assert list(output.tail) == ['>>> Emerging ��']
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.journal import Journal
+from gentoobootstrap.storage.filesystem import FilesystemStorage
+
+# the actions need cfgio and the tools sh looks up on import
+gentoo = pytest.importorskip('gentoobootstrap.actions.gentoo', exc_type=ImportError)
+
+
+class Config(object):
+	name = 'domu'
+	root_overlay = True
+	flatten_root = False
+	threads = 2
+
+	def __init__(self, directory, **kwargs):
+		self.cache_dir = os.path.join(directory, 'cache')
+		self.working_directory = os.path.join(directory, 'chroot')
+		self.root_storage = FilesystemStorage(device=os.path.join(directory, 'root'), fs='ext4')
+		self.storage = [(self.root_storage, '/')]
+		os.makedirs(self.working_directory)
+		os.makedirs(self.root_storage.device)
+		for k, v in kwargs.items():
+			setattr(self, k, v)
+
+
+class TestRootOverlay(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+		self.template = os.path.join(self.directory, 'cache/templates/amd64/amd64/stage3-amd64-20150101')
+		os.makedirs(os.path.join(self.template, 'etc'))
+		self.mounts = []
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def action(self, monkeypatch, **kwargs):
+		monkeypatch.setattr(gentoo, 'mount', lambda *args: self.mounts.append(args))
+		return gentoo.InstallGentooAction(Config(self.directory, **kwargs))
+
+	def test_storage_below_root(self, monkeypatch):
+		action = self.action(monkeypatch)
+		assert action.test()
+
+		action.config.storage.append((FilesystemStorage(device=os.path.join(self.directory, 'home')), '/home'))
+		assert not action.test()
+
+	def test_prepare(self, monkeypatch):
+		action = self.action(monkeypatch)
+		action._prepare_overlay(self.template)
+
+		root = action.config.root_storage.device
+		assert sorted(os.listdir(root)) == ['upper', 'work']
+		assert self.mounts == [('-t', 'overlay', 'overlay', '-o', 'lowerdir=%s,upperdir=%s/upper,workdir=%s/work' % (
+								self.template, root, root), action.config.working_directory)]
+		# the template is held while it's the lower layer
+		assert action.template_lock is not None
+		action.template_lock.close()
+
+	def test_flatten(self, monkeypatch):
+		action = self.action(monkeypatch, flatten_root=True)
+		action.journal = Journal(os.path.join(self.directory, 'journal.json'))
+		monkeypatch.setattr(action, '_unmount_below', lambda path, include=True: None)
+
+		action._prepare_overlay(self.template)
+		layers = os.path.join(self.directory, 'cache/overlays/domu')
+		assert action.layers == layers
+		assert sorted(os.listdir(layers)) == ['upper', 'work']
+		assert os.listdir(action.config.root_storage.device) == []
+		action.template_lock.close()
+
+		# the merged tree
+		os.makedirs(os.path.join(action.config.working_directory, 'etc'))
+		with open(os.path.join(action.config.working_directory, 'etc/hostname'), 'w') as f:
+			f.write('domu')
+
+		action._flatten()
+		with open(os.path.join(action.config.root_storage.device, 'etc/hostname')) as f:
+			assert f.read() == 'domu'
+
+	def test_resumed_template(self, monkeypatch):
+		action = self.action(monkeypatch)
+		action.journal = Journal(os.path.join(self.directory, 'journal.json'))
+		action.journal.mark('stage3', template=self.template)
+		assert action._resumed_template() == self.template
+
+		shutil.rmtree(self.template)
+		with pytest.raises(Exception) as ex:
+			action._resumed_template()
+		assert "doesn't exist anymore" in str(ex.value)
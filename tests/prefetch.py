@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+# the actions need cfgio and the tools sh looks up on import
+gentoo = pytest.importorskip('gentoobootstrap.actions.gentoo', exc_type=ImportError)
+
+
+class Config(object):
+	arch = 'amd64'
+	subarch = None
+	can_clone_root = False
+	stage3_template = False
+	root_overlay = False
+	stream_extract = False
+	portage = 'fetch'
+
+	def __init__(self, **kwargs):
+		for k, v in kwargs.items():
+			setattr(self, k, v)
+
+
+class Loader(object):
+
+	def __init__(self):
+		self.fetched = []
+
+	def fetch_stage3(self, arch, subarch):
+		self.fetched.append('stage3')
+
+	def fetch_portage(self):
+		self.fetched.append('portage')
+
+
+class TestPrefetchAction(object):
+
+	def prefetch(self, **kwargs):
+		loader = Loader()
+		gentoo.PrefetchAction(Config(**kwargs), loader=loader).execute()
+		return loader.fetched
+
+	def test_prefetch(self):
+		assert self.prefetch() == ['stage3', 'portage']
+		assert self.prefetch(can_clone_root=True, portage='inherit') == []
+
+	def test_streaming(self):
+		# the install extracts the archives while downloading them
+		assert self.prefetch(stream_extract=True) == []
+		# templates and squashfs images need the whole archive
+		assert self.prefetch(stream_extract=True, stage3_template=True, portage='squashfs') == ['stage3', 'portage']
+		assert self.prefetch(stream_extract=True, root_overlay=True) == ['stage3']
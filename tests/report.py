@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap import report
+
+
+class TestRunReport(object):
+
+	def test_phases(self):
+		r = report.RunReport('domu')
+		with report.activate(r):
+			with report.phase('install'):
+				with report.phase('stage3'):
+					report.count('cache_hits')
+				with pytest.raises(ValueError):
+					with report.phase('portage'):
+						raise ValueError()
+		r.finish('failed')
+
+		phases = dict((p['name'], p['status']) for p in r.as_dict()['phases'])
+		assert phases == {'install': 'ok', 'install/stage3': 'ok', 'install/portage': 'failed'}
+		assert r.as_dict()['counters'] == {'cache_hits': 1}
+
+	def test_inactive(self):
+		with report.phase('install'):
+			report.count('cache_hits')
+		assert report.current() is None
+
+	def test_bind(self):
+		r = report.RunReport()
+
+		def format_disk():
+			with report.phase('format'):
+				report.count('disks')
+
+		with report.activate(r):
+			with report.phase('storage'):
+				t = threading.Thread(target=report.bind(format_disk))
+				t.start()
+				t.join()
+
+		assert r.counters == {'disks': 1}
+		assert sorted(p['name'] for p in r.phases) == ['storage', 'storage/format']
+
+	def test_stages(self):
+		r = report.RunReport()
+		with report.activate(r):
+			with report.phase('chroot'):
+				stages = report.Stages()
+				stages.switch('locales')
+				stages.switch('emerge')
+				stages.finish()
+
+		assert [p['name'] for p in r.as_dict()['phases']] == ['chroot', 'chroot/locales', 'chroot/emerge']
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.config import resolved
+from gentoobootstrap.config.base import NetworkSettings
+from gentoobootstrap.config.resolved import ResolvedConfig, SnapshotConfig
+
+
+class TestResolvedConfig(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+		self.file = os.path.join(self.directory, 'domu.cfg')
+		with open(self.file, 'w') as f:
+			f.write('[system]\n')
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def snapshot(self):
+		return ResolvedConfig(
+			name='domu', fqdn='domu.example.com', arch='amd64', locales=['en_US.UTF-8 UTF-8'],
+			storage_specs=[('lvm', {'vg': 'vg0', 'size': '10G'}, '/')],
+			network=('br0', NetworkSettings('10.0.0.2/24', '10.0.0.1', ['10.0.0.1'], None, None)),
+			make_conf_settings=(x for x in [('USE', 'bindist')]),
+			sources=[(self.file, os.path.getmtime(self.file))])
+
+	def test_frozen(self):
+		snapshot = self.snapshot()
+		assert snapshot.locales == ('en_US.UTF-8 UTF-8', )
+		assert snapshot.storage_specs == (('lvm', (('size', '10G'), ('vg', 'vg0')), '/'), )
+		assert snapshot.make_conf_settings == (('USE', 'bindist'), )
+		assert snapshot.network[1].dns_servers == ('10.0.0.1', )
+		assert snapshot.vcpu is None
+
+		with pytest.raises(AttributeError):
+			snapshot.arch = 'x86'
+		with pytest.raises(AttributeError):
+			snapshot.foo = 'bar'
+
+	def test_serialize(self):
+		snapshot = self.snapshot()
+		restored = ResolvedConfig.from_dict(json.loads(json.dumps(snapshot.as_dict())))
+
+		assert restored.as_dict() == snapshot.as_dict()
+		assert restored.network[1].gateway == '10.0.0.1'
+
+	def test_cache(self):
+		snapshot = self.snapshot()
+		resolved.store(('domu', ), snapshot)
+		assert resolved.lookup(('domu', )) is snapshot
+
+		os.utime(self.file, (0, 0))
+		assert resolved.lookup(('domu', )) is None
+
+	def test_snapshot_config(self):
+		config = SnapshotConfig(self.snapshot())
+		assert config.arch == 'amd64'
+		assert config.hostname == 'domu'
+		assert config.host_bridge == 'br0'
+
+		config.root_pwd = 'secret'
+		assert config.root_password == 'secret'
+		with pytest.raises(AttributeError):
+			config.unknown
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.scheduler import ActionScheduler
+
+
+class Action(object):
+
+	def __init__(self, name, log, requires=(), provides=(), fail=False, wait_for=None):
+		self.name = name
+		self.log = log
+		self.requires = requires
+		self.provides = provides
+		self.fail = fail
+		self.wait_for = wait_for
+		self.started = threading.Event()
+
+	def execute(self):
+		self.started.set()
+		if self.wait_for:
+			# blocks until the other action runs at the same time
+			assert self.wait_for.started.wait(5)
+		if self.fail:
+			raise Exception("%s failed" % self.name)
+		self.log.append(self.name)
+
+
+class TestActionScheduler(object):
+
+	def test_order(self):
+		log = []
+		install = Action('install', log, requires=('storage', 'downloads'))
+		storage = Action('storage', log, provides=('storage',))
+		config = Action('config', log, requires=('storage',))
+		ActionScheduler([install, config, storage]).execute()
+
+		assert log.index('storage') < log.index('install')
+		assert log.index('storage') < log.index('config')
+
+	def test_parallel(self):
+		log = []
+		storage = Action('storage', log, provides=('storage',))
+		prefetch = Action('prefetch', log, provides=('downloads',), wait_for=storage)
+		storage.wait_for = prefetch
+		ActionScheduler([storage, prefetch]).execute()
+
+		assert sorted(log) == ['prefetch', 'storage']
+
+	def test_failure(self):
+		log = []
+		storage = Action('storage', log, provides=('storage',), fail=True)
+		install = Action('install', log, requires=('storage',))
+
+		with pytest.raises(Exception) as ex:
+			ActionScheduler([storage, install]).execute()
+		assert str(ex.value) == 'storage failed'
+		assert log == []
+
+	def test_cycle(self):
+		log = []
+		a = Action('a', log, requires=('b',), provides=('a',))
+		b = Action('b', log, requires=('a',), provides=('b',))
+
+		with pytest.raises(Exception):
+			ActionScheduler([a, b]).execute()
+		assert log == []
+
+	def test_cancel(self):
+		log = []
+		cancel = threading.Event()
+		storage = Action('storage', log, provides=('storage',))
+		storage.execute = lambda: (cancel.set(), log.append('storage'))
+		install = Action('install', log, requires=('storage',))
+
+		with pytest.raises(Exception) as ex:
+			ActionScheduler([storage, install], cancel=cancel).execute()
+		assert str(ex.value) == 'Cancelled'
+		assert log == ['storage']
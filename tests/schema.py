@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import sys
+from configparser import ConfigParser
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.config.schema import FILESYSTEMS, validate
+
+
+def parser(content=None, filename=None):
+	p = ConfigParser(defaults={'name': 'domu', 'fqdn': 'domu.example.com'})
+	p.optionxform = lambda option: option
+	if filename:
+		p.read(filename)
+	else:
+		p.read_string(content)
+	return p
+
+
+class TestValidate(object):
+
+	def test_samples(self):
+		for filename in glob.glob(os.path.join(os.path.dirname(__file__), '../doc/configs/*.cfg')):
+			assert validate(parser(filename=filename)) == [], filename
+
+	def test_all_errors(self):
+		errors = validate(parser("""
+[bootstrap]
+portage = git
+verify = maybe
+cache_size = lots
+colour = blue
+
+[system]
+memory = 1G
+
+[storage]
+type = lvm
+layout = simple
+
+[storage_simple]
+disks = 1
+disk0_size = ten
+disk1_mount = /home
+
+[network]
+config = 10.0.0.2/24
+
+[typo]
+"""))
+
+		assert errors == [
+			"[bootstrap] portage: invalid value 'git' (one of fetch, squashfs, inherit)",
+			"[bootstrap] verify: invalid value 'maybe' (not a boolean: maybe)",
+			"[bootstrap] cache_size: invalid value 'lots' (Illegal size specification: lots)",
+			"[bootstrap] colour: unknown option",
+			"[system] memory: invalid value '1G' (invalid literal for int() with base 10: '1G')",
+			"[typo]: unknown section",
+			"[system] arch: missing",
+			"[network] bridge: missing",
+			"[network] gateway: missing (required for a static network configuration)",
+			"[storage_simple] disk0_size: invalid value 'ten' (Illegal size specification: ten)",
+			"[storage_simple] disk1_mount: unknown option (expected disk0_ to disk0_<option>)",
+			"[storage_simple] disk0_mount: missing",
+			"[storage_simple] disk0_name: missing (required for lvm)",
+			"[storage_simple] disk0_volume_group: missing (or volume_group in [storage])",
+		]
+
+	def test_partial(self):
+		content = """
+[bootstrap]
+template = yes
+
+[storage]
+type = lvm
+layout = simple
+volume_group = vg0
+"""
+		assert validate(parser(content), partial=True) == []
+		assert validate(parser(content)) == ["[system]: missing", "[storage_simple]: missing (storage layout 'simple')"]
+
+	def test_storage(self):
+		errors = validate(parser("""
+[system]
+arch = amd64
+
+[storage]
+type = lvm
+layout = simple
+format_profile = turbo
+zero_lv = maybe
+volme_group = vg0
+
+[storage_simple]
+disks = 2
+disk0_mount = /
+disk0_size = 10G
+disk0_name = domu-root
+disk0_fs = ext5
+disk0_volume_group = vg0
+disk1_mount =
+disk1_size = 512M
+disk1_name = domu-swap
+disk1_fs = swap
+disk1_format_profile = fast
+disk1_volume_group = vg1
+disk1_zero_lv = no
+disk1_domu_device = /dev/xvda2
+disk1_colour = blue
+"""))
+
+		assert errors == [
+			"[storage] format_profile: invalid value 'turbo' (one of default, fast)",
+			"[storage] zero_lv: invalid value 'maybe' (not a boolean: maybe)",
+			"[storage] volme_group: unknown option",
+			"[storage_simple] disk0_fs: invalid value 'ext5' (one of %s)" % ', '.join(FILESYSTEMS),
+			"[storage_simple] disk1_colour: unknown option",
+		]
+
+	def test_required_disk_options(self):
+		content = """
+[system]
+arch = amd64
+
+[storage]
+type = %s
+layout = simple
+volume_group = vg0
+
+[storage_simple]
+disks = 1
+disk0_mount = /
+"""
+		assert validate(parser(content % 'lvm')) == [
+			"[storage_simple] disk0_size: missing (required for lvm)",
+			"[storage_simple] disk0_name: missing (required for lvm)",
+		]
+		assert validate(parser(content % 'lvm' + "disk0_size = 10G\ndisk0_name = domu-root\n")) == []
+
+		assert validate(parser(content % 'filesystem')) == [
+			"[storage_simple] disk0_device: missing (required for filesystem)",
+		]
+		assert validate(parser(content % 'filesystem' + "disk0_device = /tmp/domu\n")) == []
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+# sh looks mksquashfs up on import
+squashfs = pytest.importorskip('gentoobootstrap.squashfs', exc_type=ImportError)
+
+
+class Extractor(object):
+	"""Writes the name of the snapshot to portage/snapshot instead of extracting it"""
+
+	def __init__(self):
+		self.extracted = []
+
+	def extract(self, archive, target, preserve=True):
+		self.extracted.append(archive)
+		os.makedirs(os.path.join(target, 'portage'))
+		with open(os.path.join(target, 'portage/snapshot'), 'w') as f:
+			f.write(archive)
+
+
+class Mksquashfs(object):
+	"""Copies the snapshot file of the source directory to the image"""
+
+	def __init__(self, fail=False):
+		self.calls = []
+		self.fail = fail
+
+	def __call__(self, source, image, *args):
+		self.calls.append((source, image) + args)
+		shutil.copyfile(os.path.join(source, 'snapshot'), image)
+		if self.fail:
+			raise Exception("mksquashfs failed")
+
+
+class Entry(object):
+	"""A cache entry of the portage snapshot"""
+	digest = 'a1b2c3d4e5f6a7b8c9d0'
+
+	def __init__(self, last_modified):
+		self.last_modified = last_modified
+
+
+class TestSnapshotDate(object):
+
+	def test_last_modified(self):
+		assert squashfs.snapshot_date(Entry('Sat, 03 Jan 2015 00:45:01 GMT')) == '20150103'
+
+	def test_fallback(self):
+		assert squashfs.snapshot_date(Entry(None)) == 'a1b2c3d4e5f6'
+		assert squashfs.snapshot_date(Entry('yesterday')) == 'a1b2c3d4e5f6'
+
+
+class TestSquashfsStore(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+		self.store = squashfs.SquashfsStore(os.path.join(self.directory, 'squashfs'), keep=2)
+		self.extractor = Extractor()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def test_get(self, monkeypatch):
+		mksquashfs = Mksquashfs()
+		monkeypatch.setattr(squashfs, 'mksquashfs', mksquashfs)
+
+		image = self.store.get('20150103', 'portage-20150103.tar.xz', self.extractor, threads=4)
+		assert image == os.path.join(self.directory, 'squashfs/portage-20150103.sqfs')
+		assert mksquashfs.calls[0][2:] == ('-noappend', '-no-progress', '-processors', '4')
+		with open(image) as f:
+			assert f.read() == 'portage-20150103.tar.xz'
+		assert sorted(os.listdir(os.path.join(self.directory, 'squashfs'))) == [
+			'portage-20150103.sqfs', 'portage-20150103.sqfs.lock']
+
+		# the existing image is reused
+		assert self.store.get('20150103', 'portage-20150103.tar.xz', self.extractor) == image
+		assert self.extractor.extracted == ['portage-20150103.tar.xz']
+		assert len(mksquashfs.calls) == 1
+
+	def test_failed(self, monkeypatch):
+		monkeypatch.setattr(squashfs, 'mksquashfs', Mksquashfs(fail=True))
+
+		with pytest.raises(Exception):
+			self.store.get('20150103', 'portage-20150103.tar.xz', self.extractor)
+		assert os.listdir(os.path.join(self.directory, 'squashfs')) == ['portage-20150103.sqfs.lock']
+
+	def test_prune(self, monkeypatch):
+		monkeypatch.setattr(squashfs, 'mksquashfs', Mksquashfs())
+
+		for i, date in enumerate(['20150101', '20150102', '20150103']):
+			image = self.store.get(date, 'portage-%s.tar.xz' % date, self.extractor)
+			os.utime(image, (time.time() - 100 + i, time.time() - 100 + i))
+		self.store.prune()
+
+		assert sorted(os.listdir(os.path.join(self.directory, 'squashfs'))) == [
+			'portage-20150102.sqfs', 'portage-20150102.sqfs.lock',
+			'portage-20150103.sqfs', 'portage-20150103.sqfs.lock',
+		]
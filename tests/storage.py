@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.storage.filesystem import FilesystemStorage
+
+# the actions need cfgio and the tools sh looks up on import
+storage_actions = pytest.importorskip('gentoobootstrap.actions.storage', exc_type=ImportError)
+
+
+class Storage(FilesystemStorage):
+	"""Waits until all disks are being created, so the test fails unless they are created in parallel"""
+
+	def __init__(self, barrier, fail=False, **kwargs):
+		super(Storage, self).__init__(**kwargs)
+		self.barrier = barrier
+		self.fail = fail
+
+	def create(self):
+		self.barrier.wait(timeout=5)
+		super(Storage, self).create()
+
+	def format(self):
+		if self.fail:
+			raise Exception("mkfs failed")
+
+
+class Config(object):
+	has_storage = True
+	can_clone_root = False
+	storage_workers = 4
+
+	def __init__(self, storage):
+		self.storage = storage
+		self.root_storage = storage[0][0]
+
+
+class TestCreateStorageAction(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def config(self, fail=()):
+		barrier = threading.Barrier(3)
+		return Config([(Storage(barrier, fail=name in fail, device=os.path.join(self.directory, name), fs='ext4'), mount)
+					   for name, mount in [('root', '/'), ('home', '/home'), ('var', '/var')]])
+
+	def test_create(self):
+		config = self.config()
+		action = storage_actions.CreateStorageAction(config)
+		assert action.test()
+
+		action.execute()
+		assert sorted(os.listdir(self.directory)) == ['home', 'root', 'var']
+
+	def test_rollback(self):
+		action = storage_actions.CreateStorageAction(self.config(fail=['home']))
+
+		with pytest.raises(Exception) as ex:
+			action.execute()
+		assert str(ex.value) == "Creating storage failed (%s: mkfs failed)" % os.path.join(self.directory, 'home')
+		# the disks created in parallel to the failed one are removed, too
+		assert os.listdir(self.directory) == []
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/'))
+
+from gentoobootstrap.template import TemplateStore, _link_groups, _units, copy_tree
+
+
+class Extractor(object):
+	"""Writes the name of the archive to etc/stage3 instead of extracting it"""
+
+	def __init__(self):
+		self.extracted = []
+
+	def extract(self, archive, target, preserve=True):
+		self.extracted.append(archive)
+		os.makedirs(os.path.join(target, 'etc'))
+		os.makedirs(os.path.join(target, 'usr/lib/modules'))
+		os.symlink('lib', os.path.join(target, 'usr/lib64'))
+		with open(os.path.join(target, 'etc/stage3'), 'w') as f:
+			f.write(archive)
+
+
+class TestTemplateStore(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+		self.store = TemplateStore(os.path.join(self.directory, 'templates'), keep=2)
+		self.extractor = Extractor()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def test_get(self):
+		template = self.store.get('x86', 'i686', 'stage3-i686-20150101', 'stage3.tar.bz2', self.extractor)
+		assert template == os.path.join(self.directory, 'templates/x86/i686/stage3-i686-20150101')
+		assert self.store.get('x86', 'i686', 'stage3-i686-20150101', 'stage3.tar.bz2', self.extractor) == template
+		assert self.extractor.extracted == ['stage3.tar.bz2']
+		assert not os.path.exists(template + '.tmp')
+
+	def test_prune(self):
+		held = None
+		for i, name in enumerate(['stage3-amd64-20150101', 'stage3-amd64-20150201', 'stage3-amd64-20150301',
+								  'stage3-amd64-20150401']):
+			template = self.store.get('amd64', None, name, name, self.extractor)
+			os.utime(template, (time.time() - 100 + i, time.time() - 100 + i))
+			if i == 0:
+				# being cloned
+				held = open("%s.lock" % template, 'a')
+				fcntl.flock(held, fcntl.LOCK_SH)
+
+		held.close()
+		assert sorted(os.listdir(os.path.join(self.directory, 'templates/amd64/amd64'))) == [
+			'stage3-amd64-20150101', 'stage3-amd64-20150101.lock',
+			'stage3-amd64-20150301', 'stage3-amd64-20150301.lock',
+			'stage3-amd64-20150401', 'stage3-amd64-20150401.lock',
+		]
+
+	def test_clone(self):
+		template = self.store.get('amd64', None, 'stage3-amd64-20150101', 'stage3.tar.bz2', self.extractor)
+		os.chmod(os.path.join(template, 'usr'), 0o750)
+		target = os.path.join(self.directory, 'root')
+		os.mkdir(target)
+
+		self.store.clone(template, target, threads=2)
+		with open(os.path.join(target, 'etc/stage3')) as f:
+			assert f.read() == 'stage3.tar.bz2'
+		assert os.readlink(os.path.join(target, 'usr/lib64')) == 'lib'
+		assert os.path.isdir(os.path.join(target, 'usr/lib/modules'))
+		assert os.stat(os.path.join(target, 'usr')).st_mode & 0o777 == 0o750
+
+
+class TestCopyTree(object):
+
+	def setup_method(self, method):
+		self.directory = tempfile.mkdtemp()
+		self.source = os.path.join(self.directory, 'source')
+		self.target = os.path.join(self.directory, 'target')
+		os.mkdir(self.target)
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.directory)
+
+	def write(self, name, content=''):
+		path = os.path.join(self.source, name)
+		if not os.path.exists(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		with open(path, 'w') as f:
+			f.write(content)
+		return path
+
+	def test_hardlinks(self):
+		gcc = self.write('usr/bin/gcc', 'gcc')
+		os.makedirs(os.path.join(self.source, 'usr/x86_64-pc-linux-gnu/gcc-bin/4.8.3'))
+		os.link(gcc, os.path.join(self.source, 'usr/x86_64-pc-linux-gnu/gcc-bin/4.8.3/gcc'))
+		self.write('etc/hostname', 'domu')
+		self.write('-rf', 'not an option')
+
+		units = list(_units(self.source, 3))
+		groups = _link_groups(self.source, units)
+		assert sorted(sorted(group) for group in groups if len(group) > 1) == [
+			['usr/bin/gcc', 'usr/x86_64-pc-linux-gnu/gcc-bin']]
+
+		copy_tree(self.source, self.target, threads=4)
+
+		first = os.stat(os.path.join(self.target, 'usr/bin/gcc'))
+		second = os.stat(os.path.join(self.target, 'usr/x86_64-pc-linux-gnu/gcc-bin/4.8.3/gcc'))
+		assert first.st_ino == second.st_ino and first.st_nlink == 2
+		with open(os.path.join(self.target, 'etc/hostname')) as f:
+			assert f.read() == 'domu'
+		assert os.path.exists(os.path.join(self.target, '-rf'))